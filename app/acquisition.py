@@ -0,0 +1,153 @@
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from config import connect_instruments, create_instruments, create_xy_stage
+from scan.engine import ScanEngine
+from scan.jobs import run_queue
+from scan.raster import WaveformCube, run_image, save_peak_map
+from scan.recipe import ScanRecipe
+
+
+class AcquisitionWorker(QObject):
+    # Lives in its own QThread and is the only owner of the instruments once the GUI is up.
+    # Requests arrive as queued slot calls, results go back to the GUI through signals.
+    # The scan itself is run by the headless ScanEngine, this class only adapts it to Qt.
+    scanStarted = pyqtSignal(int)
+    pointAcquired = pyqtSignal(int, float, float, float)
+    scanFinished = pyqtSignal(object)  # ScanResult, None if the scan failed
+    statusChanged = pyqtSignal(str)
+    sensitivityRead = pyqtSignal(object)
+    timeConstantChanged = pyqtSignal(float)
+    instrumentsReady = pyqtSignal(float, object)  # time constant, sensitivity
+    instrumentsFailed = pyqtSignal(str)
+    jobStarted = pyqtSignal(object)  # recipe
+    jobFinished = pyqtSignal(object)  # result, already written to disk
+    queueFinished = pyqtSignal(int)  # jobs finished
+    pixelAcquired = pyqtSignal(int, int, float)  # ix, iy, peak
+    imageFinished = pyqtSignal(int)  # pixels measured
+
+    # lia and stage may be None, open_instruments brings them up in the thread later.
+    def __init__(self, lia=None, stage=None, cancel_token=None, timer=None):
+        super(AcquisitionWorker, self).__init__()
+        self.lia = lia
+        self.stage = stage
+        # Sample stage for raster images, opened the first time one is taken.
+        self.backend = None
+        self.xyStage = None
+        self.engine = ScanEngine(lia, stage, cancel_token, timer)
+        self.engine.on_point = self.pointAcquired.emit
+        self.engine.on_status = self.statusChanged.emit
+
+    @property
+    def cancel_token(self):
+        return self.engine.cancel_token
+
+    def set_instruments(self, lia, stage):
+        self.lia = lia
+        self.stage = stage
+        self.engine.lia = lia
+        self.engine.stage = stage
+
+    @pyqtSlot(object)
+    def open_instruments(self, backend):
+        # Connecting and homing run here, so the window is usable while they take their time.
+        self.backend = backend
+        try:
+            lia, stage = create_instruments(backend)
+            connect_instruments(lia, stage, on_status=self.statusChanged.emit)
+            self.set_instruments(lia, stage)
+            self.instrumentsReady.emit(lia.getTimeConstant(), lia.getSensitivity())
+        except Exception as e:
+            self.instrumentsFailed.emit(str(e))
+
+    # An exception must not leave a slot, PyQt aborts on it. Failures go to the status bar,
+    # and the finished signals always come so the GUI enables its buttons again.
+    @pyqtSlot(object)
+    def run_scan(self, recipe):
+        result = None
+        try:
+            if isinstance(recipe, dict):
+                recipe = ScanRecipe.from_dict(recipe)
+            self.scanStarted.emit(recipe.length_of_scan())
+            result = self.engine.run(recipe)
+        except Exception as e:
+            self.statusChanged.emit('Scan failed: ' + str(e))
+        finally:
+            self.scanFinished.emit(result)
+
+    @pyqtSlot(object)
+    def run_queue(self, request):
+        queue, directory = request
+        finished = 0
+        try:
+            finished = run_queue(self.engine, queue, directory,
+                                 on_start=lambda job, recipe: self.jobStarted.emit(recipe),
+                                 on_job=lambda job, result: self.jobFinished.emit(result))
+        except Exception as e:
+            self.statusChanged.emit('Queue failed: ' + str(e))
+        finally:
+            self.queueFinished.emit(finished)
+
+    @pyqtSlot(object)
+    def run_image(self, request):
+        # imageFinished always comes, the GUI waits for it to enable its buttons again.
+        recipe, path = request
+        pixels = 0
+        try:
+            if self.xyStage is None:
+                self.statusChanged.emit('Connecting xy stage')
+                xyStage = create_xy_stage(self.backend)
+                xyStage.openConnection()
+                xyStage.home()
+                self.xyStage = xyStage
+        except Exception as e:
+            self.instrumentsFailed.emit(str(e))
+            self.imageFinished.emit(pixels)
+            return
+        try:
+            self.scanStarted.emit(recipe.delay.length_of_scan())
+            cube = WaveformCube.create(path, recipe)
+            pixels = run_image(self.engine, self.xyStage, recipe, cube, on_pixel=self.pixelAcquired.emit)
+            save_peak_map(cube)
+        except Exception as e:
+            self.statusChanged.emit('Image failed: ' + str(e))
+        finally:
+            self.imageFinished.emit(pixels)
+
+    @pyqtSlot()
+    def close_instruments(self):
+        # Closing the stages stores where they were left, the next start can skip homing.
+        for stage in (self.stage, self.xyStage):
+            if stage is None:
+                continue
+            try:
+                stage.closeConnection()
+            except Exception as e:
+                self.statusChanged.emit('Closing the stage failed: ' + str(e))
+        self.stage = self.engine.stage = self.xyStage = None
+
+    @pyqtSlot(float)
+    def goto(self, position):
+        self.statusChanged.emit('Starting Goto')
+        try:
+            self.stage.move(position)
+        except Exception as e:
+            self.statusChanged.emit('Goto failed: ' + str(e))
+            return
+        self.statusChanged.emit('Goto value reached')
+
+    @pyqtSlot()
+    def read_sensitivity(self):
+        try:
+            self.sensitivityRead.emit(self.lia.getSensitivity())
+        except Exception as e:
+            self.statusChanged.emit('Reading the sensitivity failed: ' + str(e))
+
+    @pyqtSlot(float)
+    def set_time_constant(self, time_constant):
+        try:
+            self.lia.setTimeConstant(time_constant)
+            newTimeConstant = self.lia.getTimeConstant()
+        except Exception as e:
+            self.statusChanged.emit('Setting the time constant failed: ' + str(e))
+            return
+        self.timeConstantChanged.emit(newTimeConstant)
+        self.statusChanged.emit("Time constant is set in Lockin to " + str(newTimeConstant) + " seconds.")
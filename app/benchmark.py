@@ -0,0 +1,123 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+import config
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.storage import save_scan
+from scan.timing import PhaseTimer, PHASES
+from tracing import TRACER
+
+# Standard recipes, small enough to run in CI against the Demo instruments.
+STANDARD_RECIPES = {
+    'step': ScanRecipe(start=1000, stop=2000, stepsize=20, nAvg=1, nPostmove=0, timeConstant=0.001),
+    'averaged': ScanRecipe(start=1000, stop=2000, stepsize=20, nAvg=20, nPostmove=0, timeConstant=0.001),
+    'fine': ScanRecipe(start=1400, stop=1600, stepsize=1, nAvg=1, nPostmove=0, timeConstant=0.001),
+    'fly': ScanRecipe(start=1000, stop=2000, stepsize=10, timeConstant=0.001, mode='fly', velocity=2000),
+}
+
+
+def live_plot_feeder(timer):
+    # Headless Agg stand-in for the GUI plot, drawn for every point to price the worst case.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from liveplot import LivePlot
+    from scan.buffer import ScanBuffer
+
+    figure = Figure()
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    line, = ax.plot([], [], 'r-')
+    plot = LivePlot(canvas, phase_timer=timer)
+    plot.attach(ax, line)
+    buffer = ScanBuffer(1000)
+
+    def on_point(index, position, value, timestamp):
+        buffer.append(position, value, timestamp)
+        plot.set_data(buffer.positions, buffer.values,
+                      (buffer.position_min, buffer.position_max, buffer.value_min, buffer.value_max))
+        plot.redraw()
+    return on_point
+
+
+def run_benchmark(name, recipe, backend='demo', plot=False, save=True, pipelined=True, readout='serial'):
+    lia, stage = config.create_instruments(backend, readout)
+    config.connect_instruments(lia, stage)
+
+    timer = PhaseTimer()
+    engine = ScanEngine(lia, stage, timer=timer)
+    engine.pipelined = pipelined
+    if plot:
+        engine.on_point = live_plot_feeder(timer)
+
+    start = time.perf_counter()
+    result = engine.run(recipe)
+    elapsed = time.perf_counter() - start
+    if save:
+        with tempfile.TemporaryDirectory() as directory:
+            with timer.phase('save'):
+                save_scan(result, directory)
+    stage.closeConnection()
+
+    summary = timer.summary()
+    return {
+        'name': name,
+        'backend': backend,
+        'pipelined': pipelined,
+        'readout': readout,
+        'points': len(result.buffer),
+        'samples': timer.points,
+        'elapsed': elapsed,
+        'points_per_second': len(result.buffer) / elapsed if elapsed > 0 else None,
+        'phases': {phase: summary[phase] for phase in PHASES if phase in summary},
+        'counters': result.counters,
+    }
+
+
+def format_report(report):
+    lines = ['%s (%s%s%s): %d points in %.3f s, %.1f points/s' % (
+        report['name'], report['backend'], '' if report['pipelined'] else ', sequential',
+        ', daq' if report['readout'] == 'daq' else '', report['points'],
+        report['elapsed'], report['points_per_second'])]
+    for phase, stats in report['phases'].items():
+        lines.append('    %-8s total %8.4f s   mean %10.6f s   n=%d' % (phase, stats['total'], stats['mean'],
+                                                                       stats['count']))
+    if report['counters']:
+        lines.append('    ' + ', '.join('%s %d' % item for item in sorted(report['counters'].items())))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time standard scans and report per-phase costs.')
+    parser.add_argument('--backend', choices=['demo', 'simulator'], default='demo')
+    parser.add_argument('--recipe', action='append', choices=sorted(STANDARD_RECIPES),
+                        help='recipe to run, repeatable, defaults to all')
+    parser.add_argument('--plot', action='store_true', help='also time a headless live plot')
+    parser.add_argument('--sequential', action='store_true',
+                        help='wait for every move before storing the previous point')
+    parser.add_argument('--readout', choices=['serial', 'daq'], default='serial',
+                        help='read the lock-in over serial or through the (simulated) NI-DAQ')
+    parser.add_argument('--json', help='write the reports to this file')
+    parser.add_argument('--trace', help='write a trace of all instrument calls to this file')
+    args = parser.parse_args(argv)
+    TRACER.enable(args.trace is not None)
+
+    reports = []
+    for name in args.recipe or sorted(STANDARD_RECIPES):
+        report = run_benchmark(name, STANDARD_RECIPES[name], args.backend, args.plot,
+                               pipelined=not args.sequential, readout=args.readout)
+        reports.append(report)
+        print(format_report(report), file=sys.stderr)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if args.trace:
+        TRACER.export(args.trace)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
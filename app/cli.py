@@ -0,0 +1,83 @@
+import argparse
+import signal
+import sys
+import config
+from instruments.lockinAmplifier.sr830 import SR830_SNAP_CODES
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.storage import default_data_directory, save_scan
+from tracing import TRACER
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run a THz-TDS delay scan without the GUI.')
+    parser.add_argument('--start', type=float, required=True, help='scan start position (um)')
+    parser.add_argument('--stop', type=float, required=True, help='scan stop position (um)')
+    parser.add_argument('--step', type=float, required=True, help='step size (um)')
+    parser.add_argument('--avg', type=int, default=1, help='lock-in reads averaged per point')
+    parser.add_argument('--decorrelated', action='store_true',
+                        help='space the averaged reads half a time constant apart, slower but independent')
+    parser.add_argument('--channels', default='',
+                        help='lock-in outputs saved next to R, comma separated, e.g. X,Y,theta,aux1')
+    parser.add_argument('--postmove', type=float, default=0, help='extra settle time in time constants')
+    parser.add_argument('--tc', type=float, default=None, help='lock-in time constant (s)')
+    parser.add_argument('--prefix', default='', help='file prefix')
+    parser.add_argument('--data-dir', default=None, help='output directory, defaults to ../data/')
+    parser.add_argument('--no-save', action='store_true', help='do not write the result to disk')
+    parser.add_argument('--trace', default=None,
+                        help='write a trace of all instrument calls to this file (chrome://tracing format)')
+    parser.add_argument('--verbose', action='store_true', help='print every stage command')
+    parser.add_argument('--readout', choices=['serial', 'daq'], default=config.LIA_READOUT,
+                        help='query the lock-in over serial or read its output with the NI-DAQ')
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--backend', choices=['demo', 'simulator', 'hardware', 'server'], default=config.INSTRUMENT_BACKEND,
+                         help='instruments to use, defaults to DEMO_MODE in config.py')
+    backend.add_argument('--demo', dest='backend', action='store_const', const='demo', help='use the Demo instruments')
+    backend.add_argument('--simulator', dest='backend', action='store_const', const='simulator',
+                         help='use the simulated instruments')
+    backend.add_argument('--hardware', dest='backend', action='store_const', const='hardware',
+                         help='use the real instruments')
+    args = parser.parse_args(argv)
+    args.channels = tuple(channel for channel in args.channels.split(',') if channel)
+    unknown = [channel for channel in args.channels if channel not in SR830_SNAP_CODES]
+    if unknown:
+        parser.error('unknown lock-in channel: ' + ', '.join(unknown))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    TRACER.enable(args.trace is not None)
+    TRACER.echo = args.verbose
+    recipe = ScanRecipe(start=args.start, stop=args.stop, stepsize=args.step, nAvg=args.avg,
+                        decorrelated=args.decorrelated, nPostmove=args.postmove, timeConstant=args.tc, fileprefix=args.prefix,
+                        channels=args.channels)
+
+    lia, stage = config.create_instruments(args.backend, args.readout)
+    config.connect_instruments(lia, stage)
+
+    engine = ScanEngine(lia, stage)
+    engine.on_status = lambda message: print('Status: ' + message)
+    if not args.no_save:
+        # Points reach the disk as they are measured, a crash keeps everything up to the last flush.
+        engine.stream_directory = args.data_dir or default_data_directory()
+    # Ctrl+C finishes the current point and still saves what was measured.
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: engine.cancel_token.cancel())
+
+    try:
+        result = engine.run(recipe)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        stage.closeConnection()
+
+    print('Measured %d of %d points' % (len(result.buffer), recipe.length_of_scan()))
+    print(', '.join('%s %d' % item for item in sorted(result.counters.items())))
+    if args.trace is not None:
+        print('Wrote %d trace events to %s' % (TRACER.export(args.trace), args.trace))
+    if not args.no_save:
+        save_scan(result, args.data_dir)
+    return 1 if result.stopped else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
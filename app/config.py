@@ -0,0 +1,146 @@
+import os
+import secrets
+
+DEMO_MODE = True
+# 'demo', 'simulator', 'hardware' or 'server'. None follows DEMO_MODE.
+INSTRUMENT_BACKEND = None
+
+THORLABS_STAGE_SERIAL_NO = "45283704"
+# x and y axes of the sample stage for raster imaging, see app/image.py.
+XY_STAGE_SERIAL_NOS = ("45283705", "45283706")
+LIA_PORT = "ASRL5::INSTR"
+LIA_BAUDRATE = 9600
+# 'serial' queries the lock-in, 'daq' reads its CH1 output with the NI-DAQ (simulated off hardware).
+LIA_READOUT = 'serial'
+NIDAQ_CHANNEL = "Dev1/ai5"
+# Homed state and last position of the stage, lets a restart skip homing.
+STAGE_STATE_FILE = os.path.join(os.path.expanduser('~'), '.light', 'stage_state.json')
+# Scan jobs waiting to run unattended, see app/jobs.py.
+JOB_QUEUE_FILE = os.path.join(os.path.expanduser('~'), '.light', 'queue.json')
+# Resampled traces and spectra of processed scans, see app/process.py.
+PROCESSING_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.light', 'cache')
+# app/instrument_server.py listens here, the 'server' backend connects to it.
+INSTRUMENT_SERVER_ADDRESS = ('localhost', 50830)
+# Shared by the server and its clients, random per install and readable by this user only.
+INSTRUMENT_SERVER_KEY_FILE = os.path.join(os.path.expanduser('~'), '.light', 'instrument_server.key')
+
+
+time_constants = {
+    '100 s': 100.0,
+    '30 s': 30.0,
+    '10 s': 10.0,
+    '3 s': 3.0,
+    '1 s': 1.0,
+    '300 ms': 0.3,   # 300 milliseconds = 0.3 seconds
+    '100 ms': 0.1,   # 100 milliseconds = 0.1 seconds
+    '30 ms': 0.03,   # 50 milliseconds = 0.05 seconds
+    '10 ms': 0.01,   # 10 milliseconds = 0.01 seconds
+    '3 ms': 0.003,   # 1 millisecond = 0.001 seconds
+    '1 ms': 0.001,   # 1 millisecond = 0.001 seconds
+}
+
+
+def instrument_server_key(path=INSTRUMENT_SERVER_KEY_FILE):
+    # Created on first use by whichever side starts first. Written to a temporary file and
+    # linked into place, so the other side never reads half a key or overwrites it.
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = path + '.%d.tmp' % os.getpid()
+        with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(secrets.token_hex(32).encode())
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def create_instruments(backend=None, readout=None):
+    # backend is 'demo', 'simulator', 'hardware' or 'server', None follows DEMO_MODE.
+    # 'server' talks to the instruments of a running app/instrument_server.py.
+    # readout is 'serial' or 'daq', None follows LIA_READOUT.
+    from instruments.lockinAmplifier.sr830 import SR830Demo, SR830
+    from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo, ThorlabsStageController
+
+    if backend is None:
+        backend = 'demo' if DEMO_MODE else 'hardware'
+
+    if backend == 'demo':
+        lia = SR830Demo()
+        stage = ThorlabsStageControllerDemo(THORLABS_STAGE_SERIAL_NO)
+    elif backend == 'simulator':
+        from instruments.simulator.simulator import SR830Simulator, ThorlabsStageSimulator
+        stage = ThorlabsStageSimulator(THORLABS_STAGE_SERIAL_NO)
+        lia = SR830Simulator(stage)
+    elif backend == 'server':
+        from instruments.server.client import InstrumentConnection, LockinAmplifierClient, ThorlabsStageClient
+        connection = InstrumentConnection(INSTRUMENT_SERVER_ADDRESS, instrument_server_key())
+        # The server does its own readout, a DAQ on this side would have nothing to read.
+        return LockinAmplifierClient(connection), ThorlabsStageClient(connection)
+    elif backend == 'hardware':
+        from instruments.thorlabsStage.session import StageSession
+        lia = SR830()
+        stage = ThorlabsStageController(THORLABS_STAGE_SERIAL_NO,
+                                        StageSession(THORLABS_STAGE_SERIAL_NO, STAGE_STATE_FILE))
+    else:
+        raise ValueError(f"Unknown instrument backend: {backend}")
+
+    if readout is None:
+        readout = LIA_READOUT
+    if readout == 'daq':
+        lia = create_daq(backend, lia)
+    elif readout != 'serial':
+        raise ValueError(f"Unknown lock-in readout: {readout}")
+    return lia, stage
+
+
+def create_daq(backend, lia):
+    # The serial lock-in stays in charge of time constant and sensitivity.
+    from instruments.nidaq.nidaq import NIDAQ, NIDAQSimulated
+
+    if backend == 'hardware':
+        return NIDAQ(lia, NIDAQ_CHANNEL)
+    if backend == 'simulator':
+        import math
+        return NIDAQSimulated(lia, source=lambda: math.hypot(*lia.readOutputs()))
+    return NIDAQSimulated(lia)
+
+
+def create_xy_stage(backend=None):
+    # Sample stage for raster imaging. There is no simulated one, the simulator uses the Demo.
+    from instruments.thorlabsStage.xystage import XYStage, XYStageDemo
+
+    if backend is None:
+        backend = 'demo' if DEMO_MODE else 'hardware'
+    if backend in ('demo', 'simulator'):
+        return XYStageDemo(XY_STAGE_SERIAL_NOS)
+    if backend == 'hardware':
+        from instruments.thorlabsStage.session import StageSession
+        sessions = [StageSession(serialNumber, os.path.join(os.path.dirname(STAGE_STATE_FILE),
+                                                            'stage_state_' + serialNumber + '.json'))
+                    for serialNumber in XY_STAGE_SERIAL_NOS]
+        return XYStage(XY_STAGE_SERIAL_NOS, sessions)
+    raise ValueError(f"No xy stage for the {backend} backend")
+
+
+def connect_instruments(lia, stage, time_constant=0.3, on_status=None):
+    # on_status(message) reports progress, bring-up can take a while on the real hardware.
+    # Server clients only connect, the server set up the instruments and other clients share them.
+    from instruments.server.client import LockinAmplifierClient
+
+    report = on_status or (lambda message: None)
+    report('Connecting lock-in')
+    lia.openConnection(LIA_PORT, LIA_BAUDRATE)
+    shared = isinstance(lia, LockinAmplifierClient)
+    if not shared:
+        lia.setTimeConstant(time_constant)
+    report('Connecting stage')
+    stage.openConnection()
+    if not shared:
+        report('Homing stage')
+        stage.home()
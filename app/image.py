@@ -0,0 +1,66 @@
+import argparse
+import signal
+import sys
+import config
+from scan.engine import ScanEngine
+from scan.raster import ImageRecipe, WaveformCube, image_path, run_image, save_peak_map
+from scan.recipe import ScanRecipe
+from scan.storage import default_data_directory
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Raster a sample on the xy stage, a delay scan at every pixel.')
+    parser.add_argument('--x', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'),
+                        help='x raster (um)')
+    parser.add_argument('--y', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'),
+                        help='y raster (um)')
+    parser.add_argument('--start', type=float, required=True, help='delay scan start position (um)')
+    parser.add_argument('--stop', type=float, required=True, help='delay scan stop position (um)')
+    parser.add_argument('--step', type=float, required=True, help='delay step size (um)')
+    parser.add_argument('--avg', type=int, default=1, help='lock-in reads averaged per point')
+    parser.add_argument('--decorrelated', action='store_true',
+                        help='space the averaged reads half a time constant apart, slower but independent')
+    parser.add_argument('--postmove', type=float, default=0, help='extra settle time in time constants')
+    parser.add_argument('--tc', type=float, default=None, help='lock-in time constant (s)')
+    parser.add_argument('--fly', action='store_true', help='sweep the delay stage instead of stepping')
+    parser.add_argument('--no-serpentine', action='store_true', help='every row and trace in the same direction')
+    parser.add_argument('--prefix', default='', help='file prefix')
+    parser.add_argument('--data-dir', default=None, help='output directory, defaults to ../data/')
+    parser.add_argument('--backend', choices=['demo', 'simulator', 'hardware'], default=config.INSTRUMENT_BACKEND,
+                        help='instruments to use, defaults to DEMO_MODE in config.py')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    delay = ScanRecipe(start=args.start, stop=args.stop, stepsize=args.step, nAvg=args.avg,
+                       decorrelated=args.decorrelated, nPostmove=args.postmove, timeConstant=args.tc, mode='fly' if args.fly else 'step')
+    recipe = ImageRecipe(*args.x, *args.y, delay=delay, serpentine=not args.no_serpentine,
+                         fileprefix=args.prefix)
+
+    lia, stage = config.create_instruments(args.backend)
+    xy_stage = config.create_xy_stage(args.backend)
+    config.connect_instruments(lia, stage)
+    xy_stage.openConnection()
+    xy_stage.home()
+
+    cube = WaveformCube.create(image_path(recipe, args.data_dir or default_data_directory()), recipe)
+    print('Writing %d x %d x %d waveforms to %s' % (cube.data.shape + (cube.path,)))
+    engine = ScanEngine(lia, stage)
+    engine.on_status = lambda message: print('Status: ' + message)
+    # Ctrl+C finishes the current pixel point, everything measured so far stays in the cube.
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: engine.cancel_token.cancel())
+    try:
+        pixels = run_image(engine, xy_stage, recipe, cube)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        stage.closeConnection()
+        xy_stage.closeConnection()
+
+    save_peak_map(cube)
+    print('Measured %d of %d pixels' % (pixels, cube.data.shape[0] * cube.data.shape[1]))
+    return 1 if engine.cancel_token.is_cancelled() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import argparse
+import signal
+import sys
+import config
+from instruments.server.server import InstrumentServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Keep the instruments connected and share them with local clients.')
+    parser.add_argument('--backend', choices=['demo', 'simulator', 'hardware'], default=config.INSTRUMENT_BACKEND,
+                        help='instruments to serve, defaults to DEMO_MODE in config.py')
+    parser.add_argument('--readout', choices=['serial', 'daq'], default=config.LIA_READOUT,
+                        help='query the lock-in over serial or read its output with the NI-DAQ')
+    parser.add_argument('--port', type=int, default=config.INSTRUMENT_SERVER_ADDRESS[1], help='local port to listen on')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    lia, stage = config.create_instruments(args.backend, args.readout)
+    config.connect_instruments(lia, stage, on_status=lambda message: print('Status: ' + message))
+
+    server = InstrumentServer(lia, stage, (config.INSTRUMENT_SERVER_ADDRESS[0], args.port),
+                              config.instrument_server_key(), homed=True)
+    print('Serving instruments on %s:%d' % server.address)
+    # Ctrl+C stops serving, the connections are closed on the way out.
+    signal.signal(signal.SIGINT, lambda signum, frame: server.close())
+    try:
+        server.serve_forever()
+    finally:
+        stage.closeConnection()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
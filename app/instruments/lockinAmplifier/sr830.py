@@ -1,11 +1,9 @@
+import math
 import random
 import numpy as np
-from time import sleep
+from time import sleep, monotonic
 from abc import ABC, abstractmethod
-from pymeasure.instruments.srs import SR830 as RealSR830
-from pymeasure.instruments.resources import list_resources
-import pyvisa
-from pyvisa.constants import StopBits, Parity
+from tracing import SERIAL_ROUND_TRIPS, TRACER
 
 class LockinAmplifierBaseClass(ABC):
     @abstractmethod
@@ -16,6 +14,26 @@ class LockinAmplifierBaseClass(ABC):
     def measure(self):
         pass
 
+    # Reads count samples in one go. Backends with an internal buffer override this,
+    # the fallback just loops over measure().
+    def measureBuffered(self, count):
+        return np.array([self.measure() for i in range(int(count))], dtype=float)
+
+    # Reads several outputs (names from SR830_SNAP_CODES) at the same instant, returns
+    # one value per name. The fallback only knows R, the rest comes back as nan.
+    def measureChannels(self, channels):
+        return np.array([self.measure() if channel == 'R' else np.nan for channel in channels], dtype=float)
+
+    # count readings of several outputs, a (count, channels) array. Backends with a buffer
+    # override this, the fallback loops over measureChannels().
+    def measureBufferedChannels(self, channels, count):
+        samples = [self.measureChannels(channels) for i in range(int(count))]
+        return np.array(samples, dtype=float).reshape(-1, len(channels))
+
+    # Rate of the measureBuffered samples, None is the fastest. Backends without a buffer ignore it.
+    def setSampleRate(self, sampleRate):
+        pass
+
     @abstractmethod
     def setTimeConstant(self, timeConstant):
         pass
@@ -33,6 +51,50 @@ class LockinAmplifierBaseClass(ABC):
         pass
 
 
+# SR830 buffer sample rates are 62.5 mHz * 2**i for i in 0..13, see SRAT in the manual.
+SR830_SAMPLE_RATES = [0.0625 * 2 ** i for i in range(14)]
+SR830_BUFFER_SIZE = 16383
+# Buffered samples closer together than this are correlated by the output filter, more of
+# them do not average the noise down any further. Only used for decorrelated recipes.
+SAMPLES_PER_TIME_CONSTANT = 2
+
+# SNAP? parameter codes. theta is in degrees, aux are the rear panel inputs in V.
+SR830_SNAP_CODES = {'X': 1, 'Y': 2, 'R': 3, 'theta': 4, 'aux1': 5, 'aux2': 6, 'aux3': 7, 'aux4': 8,
+                    'frequency': 9}
+SR830_SNAP_MAX = 6  # values per SNAP? query
+LOCKIN_CHANNELS = ('X', 'Y', 'R', 'theta')
+# Read through the buffer, CH1 and CH2 showing X and Y (DDEF display 0). R and theta follow.
+SR830_BUFFERED_CHANNELS = LOCKIN_CHANNELS
+
+
+def sr830_sample_rate_index(sampleRate):
+    # Rounded down, samples are never closer together than asked for.
+    index = int(math.floor(math.log2(sampleRate / SR830_SAMPLE_RATES[0]) + 1e-9))
+    return min(max(index, 0), len(SR830_SAMPLE_RATES) - 1)
+
+
+def buffer_sample_rate(timeConstant):
+    return SAMPLES_PER_TIME_CONSTANT / timeConstant
+
+
+def xy_channels(channels, x, y):
+    # Columns of the named outputs from X and Y samples, theta in degrees.
+    outputs = {'X': x, 'Y': y, 'R': np.hypot(x, y), 'theta': np.degrees(np.arctan2(y, x))}
+    return np.column_stack([outputs[channel] for channel in channels])
+
+
+def mean_channels(channels, samples):
+    # Per channel mean of (count, channels) samples. theta is averaged as an angle, readings
+    # either side of +-180 degrees would otherwise average to about 0.
+    samples = np.asarray(samples, dtype=float).reshape(-1, len(channels))
+    means = samples.mean(axis=0)
+    for i, channel in enumerate(channels):
+        if channel == 'theta':
+            radians = np.radians(samples[:, i])
+            means[i] = np.degrees(np.arctan2(np.sin(radians).mean(), np.cos(radians).mean()))
+    return means
+
+
 class SR830Demo(LockinAmplifierBaseClass):
     def __init__(self):
         self.timeConstant = 0
@@ -44,12 +106,35 @@ class SR830Demo(LockinAmplifierBaseClass):
     def measure(self) -> float:
         lower_limit = 0  
         upper_limit = 10 
+        start = TRACER.begin()
         random_number = random.uniform(lower_limit, upper_limit)
 
         sleep(0.00001)
-        print("Measurement is: ", random_number)
+        TRACER.count(SERIAL_ROUND_TRIPS)
+        TRACER.end(start, 'OUTP? 3')
         return random_number
 
+    def measureBuffered(self, count):
+        start = TRACER.begin()
+        sleep(0.00001)
+        TRACER.count(SERIAL_ROUND_TRIPS)
+        TRACER.end(start, 'TRCB?', 4 * int(count))
+        return np.random.uniform(0, 10, int(count))
+
+    def measureChannels(self, channels):
+        start = TRACER.begin()
+        sleep(0.00001)
+        TRACER.count(SERIAL_ROUND_TRIPS, -(-len(channels) // SR830_SNAP_MAX))
+        TRACER.end(start, 'SNAP?')
+        return np.random.uniform(0, 10, len(channels))
+
+    def measureBufferedChannels(self, channels, count):
+        start = TRACER.begin()
+        sleep(0.00001)
+        TRACER.count(SERIAL_ROUND_TRIPS, 2)
+        TRACER.end(start, 'TRCB?', 8 * int(count))
+        return np.random.uniform(0, 10, (int(count), len(channels)))
+
     def setTimeConstant(self, timeConstant):
         self.timeConstant = timeConstant
         print('DEMO SR830: time constant is set to '+ str(self.timeConstant) + ' second.')
@@ -68,8 +153,14 @@ class SR830Demo(LockinAmplifierBaseClass):
 class SR830(LockinAmplifierBaseClass):
     def __init__(self):
         self.instrument = None
+        self.resource = None
+        self.sampleRate = SR830_SAMPLE_RATES[-1]
 
     def openConnection(self, port, baudrate):
+        # Imported here, pymeasure and pyvisa are slow to import and only the real SR830 needs them.
+        import pyvisa
+        from pymeasure.instruments.srs import SR830 as RealSR830
+
         # Initialize visa resource manager
         rm = pyvisa.ResourceManager()
         print(rm.list_resources())
@@ -79,18 +170,118 @@ class SR830(LockinAmplifierBaseClass):
         my_instrument.read_termination = '\r' 
         my_instrument.write_termination = '\n' 
         self.instrument = RealSR830(my_instrument)
+        self.resource = my_instrument
 
         print(my_instrument.query('*IDN?'))
         print("Time constant is", self.instrument.time_constant)
         print("Sensitivity is", self.instrument.sensitivity)
        
+    # Every serial exchange goes through query() or write(), they count and trace it.
+    def query(self, command):
+        start = TRACER.begin()
+        reply = self.resource.query(command)
+        TRACER.count(SERIAL_ROUND_TRIPS)
+        TRACER.end(start, command, len(command) + len(reply) + 2)
+        return reply
+
+    def write(self, command):
+        start = TRACER.begin()
+        self.resource.write(command)
+        TRACER.count(SERIAL_ROUND_TRIPS)
+        TRACER.end(start, command, len(command) + 1)
+
     def measure(self) -> float:
         if self.instrument is None:
             raise ConnectionError("Instrument not connected.")
-        
-        voltage = self.instrument.magnitude
-        print("Measurement is: ", voltage)
-        return voltage
+
+        # Same query the pymeasure magnitude property sends, R in V.
+        return float(self.query('OUTP? 3'))
+
+    def measureChannels(self, channels):
+        if self.instrument is None:
+            raise ConnectionError("Instrument not connected.")
+
+        # One SNAP? round trip for up to six values, all taken at the same instant.
+        codes = [SR830_SNAP_CODES[channel] for channel in channels]
+        values = []
+        for i in range(0, len(codes), SR830_SNAP_MAX):
+            chunk = codes[i:i + SR830_SNAP_MAX]
+            # SNAP? wants at least two parameters.
+            query = chunk if len(chunk) > 1 else chunk + [SR830_SNAP_CODES['X']]
+            reply = self.query('SNAP? ' + ','.join(str(code) for code in query))
+            values.extend(float(value) for value in reply.split(',')[:len(chunk)])
+        return np.array(values, dtype=float)
+
+    def setSampleRate(self, sampleRate):
+        # Rounded down to a rate the SR830 buffer supports.
+        if sampleRate is None:
+            sampleRate = SR830_SAMPLE_RATES[-1]
+        self.sampleRate = SR830_SAMPLE_RATES[sr830_sample_rate_index(sampleRate)]
+
+    def measureBuffered(self, count):
+        if self.instrument is None:
+            raise ConnectionError("Instrument not connected.")
+
+        count = int(count)
+        if count <= 1:
+            # Buffer setup costs more than a single magnitude query.
+            return np.array([self.measure()] * count, dtype=float)
+        return self.readBuffer(count, {1: 1})[0]  # channel 1 shows R
+
+    def measureBufferedChannels(self, channels, count):
+        if self.instrument is None:
+            raise ConnectionError("Instrument not connected.")
+
+        count = int(count)
+        buffered = [channel for channel in channels if channel in SR830_BUFFERED_CHANNELS]
+        if count <= 1 or not buffered:
+            return np.tile(self.measureChannels(channels), (count, 1))
+
+        # One fill of both buffer channels, X and Y, two binary transfers for all the samples.
+        x, y = self.readBuffer(count, {1: 0, 2: 0})
+        samples = np.empty((count, len(channels)))
+        columns = [i for i, channel in enumerate(channels) if channel in SR830_BUFFERED_CHANNELS]
+        samples[:, columns] = xy_channels(buffered, x, y)
+        others = [i for i, channel in enumerate(channels) if channel not in SR830_BUFFERED_CHANNELS]
+        if others:
+            # Aux inputs and the frequency are not in the buffer, one SNAP? stands for all samples.
+            samples[:, others] = self.measureChannels([channels[i] for i in others])
+        return samples
+
+    def readBuffer(self, count, displays):
+        # Fills the buffer with count samples, displays maps the buffer channel (1, 2) to what
+        # it shows (DDEF). Returns one array per channel, each one binary transfer.
+        if count > SR830_BUFFER_SIZE:
+            raise ValueError("SR830 buffer holds at most " + str(SR830_BUFFER_SIZE) + " points.")
+
+        for channel, display in displays.items():
+            self.write('DDEF %d,%d,0' % (channel, display))
+        self.write('SRAT ' + str(sr830_sample_rate_index(self.sampleRate)))
+        self.write('SEND 0')      # stop at the end of the buffer
+        self.write('REST')
+        self.write('STRT')
+
+        # Let the buffer fill, then poll the point count for the last few samples.
+        sleep(count / self.sampleRate)
+        deadline = monotonic() + 1 + count / self.sampleRate
+        while int(self.query('SPTS?')) < count:
+            if monotonic() > deadline:
+                raise TimeoutError("SR830 buffer did not fill in time.")
+            sleep(1 / self.sampleRate)
+        self.write('PAUS')
+
+        # TRCB transfers 4-byte little endian floats, a single binary read per channel.
+        data = []
+        for channel in displays:
+            start = TRACER.begin()
+            values = self.resource.query_binary_values('TRCB? %d,0,%d' % (channel, count), datatype='f',
+                                                       is_big_endian=False, container=np.array,
+                                                       header_fmt='empty', data_points=count,
+                                                       expect_termination=False)
+            TRACER.count(SERIAL_ROUND_TRIPS)
+            TRACER.end(start, 'TRCB?', 4 * count)
+            data.append(values.astype(float))
+        return data
 
     def setTimeConstant(self, timeConstant):
         if self.instrument is None:
@@ -1,36 +1,209 @@
-# from abc import ABC, abstractmethod
-# import random
-# from time import sleep
+import random
+import numpy as np
+from abc import abstractmethod
+from time import sleep, monotonic
+from instruments.lockinAmplifier.sr830 import LockinAmplifierBaseClass
+from tracing import DAQ_BLOCKS, TRACER
 
 # For MacOS this import will fail, thats why it is in try/catch block to bypass.
-# try:
-    # import nidaqmx
-# except Exception as e:
-    # print(f"Unexpected error: {e}")
-
-# class NIDAQBaseClass(ABC):
-    # @abstractmethod
-    # def measure(self):
-        # pass
-
-# class NIDAQ(NIDAQBaseClass):
-    # def measure(self):
-        # try:
-            # with nidaqmx.Task() as task:
-                # task.ai_channels.add_ai_voltage_chan("Dev1/ai5")
-                # data = task.read()
-                # print(f"Acquired data: {data:f}")
-                # return data
-                
-        # except Exception as e:
-            # print(f"Unexpected error: {e}")
-
-# class NIDAQDemo(NIDAQBaseClass):
-    # def measure(self):
-        # lower_limit = 0  
-        # upper_limit = 10 
-        # random_number = random.uniform(lower_limit, upper_limit)
-
-        # sleep(0.00001)
-        # print("Measurement is: ", random_number)
-        # return random_number
\ No newline at end of file
+try:
+    import nidaqmx
+    from nidaqmx.constants import AcquisitionType, Edge
+    from nidaqmx.stream_readers import AnalogSingleChannelReader
+except Exception as e:
+    print(f"Unexpected error: {e}")
+
+NIDAQ_CHANNEL = "Dev1/ai5"
+NIDAQ_SAMPLE_RATE = 100000.0  # Hz, the USB-6361 does up to 2 MS/s on one channel
+NIDAQ_MIN_BLOCK = 2  # finite acquisitions need at least two samples
+NIDAQ_TRIGGER_TIMEOUT = 10.0  # s, on top of the acquisition time
+SR830_FULL_SCALE_OUTPUT = 10.0  # V on the CH1 output at full scale of the sensitivity
+
+
+class NIDAQBaseClass(LockinAmplifierBaseClass):
+    # Reads the SR830 CH1 analog output with the DAQ instead of querying it over serial.
+    # Time constant and sensitivity are still set on the lock-in itself, lockin is the
+    # serial SR830 (or its Demo/simulator) for that. Without one, raw DAQ volts are returned.
+    def __init__(self, lockin=None, sampleRate=NIDAQ_SAMPLE_RATE, trigger=None):
+        self.lockin = lockin
+        self.sampleRate = sampleRate
+        # measureBuffered blocks are clocked slower, a few samples per time constant. Samples
+        # microseconds apart only average the ADC noise, not the noise of the lock-in output.
+        self.bufferRate = None
+        # Digital start trigger terminal, e.g. "/Dev1/PFI0". None starts right away.
+        self.trigger = trigger
+        self.timeConstant = 0
+        self.sensitivity = 0
+
+    def openConnection(self, port, baudrate):
+        if self.lockin is not None:
+            self.lockin.openConnection(port, baudrate)
+            self.sensitivity = self.lockin.getSensitivity()
+        self.openDevice()
+
+    @abstractmethod
+    def openDevice(self):
+        pass
+
+    # Hardware-timed read of count samples at sampleRate (self.sampleRate if None), in output
+    # volts. Returns a new array.
+    @abstractmethod
+    def readBlock(self, count, sampleRate=None):
+        pass
+
+    @abstractmethod
+    def closeConnection(self):
+        pass
+
+    def toSignal(self, volts):
+        # Output volts back to the lock-in reading, full scale output is the sensitivity.
+        if not self.sensitivity:
+            return volts * 1.0
+        return volts * (self.sensitivity / SR830_FULL_SCALE_OUTPUT)
+
+    def measure(self) -> float:
+        return float(self.toSignal(self.readBlock(1))[0])
+
+    def measureBuffered(self, count):
+        return self.toSignal(self.readBlock(int(count), self.bufferRate))
+
+    def measureChannels(self, channels):
+        # R comes through the DAQ, anything else takes one SNAP? on the serial lock-in.
+        values = np.full(len(channels), np.nan)
+        serial = [i for i, channel in enumerate(channels) if channel != 'R']
+        if serial and self.lockin is not None:
+            values[serial] = self.lockin.measureChannels([channels[i] for i in serial])
+        if len(serial) < len(channels):
+            values[[i for i, channel in enumerate(channels) if channel == 'R']] = self.measure()
+        return values
+
+    def measureBufferedChannels(self, channels, count):
+        # R from one DAQ block, the other outputs from one SNAP? that stands for all the samples.
+        count = int(count)
+        samples = np.empty((count, len(channels)))
+        others = [i for i, channel in enumerate(channels) if channel != 'R']
+        if others:
+            samples[:, others] = self.measureChannels([channels[i] for i in others])
+        if len(others) < len(channels):
+            r = [i for i, channel in enumerate(channels) if channel == 'R']
+            samples[:, r] = self.measureBuffered(count)[:, None]
+        return samples
+
+    def setSampleRate(self, sampleRate):
+        # Rate of the measureBuffered blocks, up to the DAQ clock rate. None is the DAQ clock rate.
+        self.bufferRate = None if sampleRate is None else min(sampleRate, self.sampleRate)
+
+    def setTimeConstant(self, timeConstant):
+        self.timeConstant = timeConstant
+        if self.lockin is not None:
+            self.lockin.setTimeConstant(timeConstant)
+
+    def setSensitivity(self, sensitivity):
+        self.sensitivity = sensitivity
+        if self.lockin is not None:
+            self.lockin.setSensitivity(sensitivity)
+
+    def getTimeConstant(self):
+        if self.lockin is not None:
+            self.timeConstant = self.lockin.getTimeConstant()
+        return self.timeConstant
+
+    def getSensitivity(self):
+        # Refreshes the cached value the readings are scaled with.
+        if self.lockin is not None:
+            self.sensitivity = self.lockin.getSensitivity()
+        return self.sensitivity
+
+
+class NIDAQ(NIDAQBaseClass):
+    # One task for the whole session. Each block is a finite, sample-clocked acquisition read
+    # straight into a reused NumPy array, the old version opened a task for every sample.
+    def __init__(self, lockin=None, channel=NIDAQ_CHANNEL, sampleRate=NIDAQ_SAMPLE_RATE, trigger=None):
+        super(NIDAQ, self).__init__(lockin, sampleRate, trigger)
+        self.channel = channel
+        self.task = None
+        self.reader = None
+        self.blockSize = None
+        self.blockRate = None
+        self.buffers = {}
+
+    def openDevice(self):
+        self.task = nidaqmx.Task()
+        self.task.ai_channels.add_ai_voltage_chan(self.channel, min_val=-SR830_FULL_SCALE_OUTPUT,
+                                                  max_val=SR830_FULL_SCALE_OUTPUT)
+        if self.trigger is not None:
+            self.task.triggers.start_trigger.cfg_dig_edge_start_trig(self.trigger, Edge.RISING)
+        self.reader = AnalogSingleChannelReader(self.task.in_stream)
+        print('NI-DAQ task is open on ' + self.channel)
+
+    def readBlock(self, count, sampleRate=None):
+        if self.task is None:
+            raise ConnectionError("NI-DAQ not connected.")
+
+        rate = sampleRate or self.sampleRate
+        size = max(int(count), NIDAQ_MIN_BLOCK)
+        # Timing is only reprogrammed when the block size or rate changes.
+        if size != self.blockSize or rate != self.blockRate:
+            self.task.timing.cfg_samp_clk_timing(rate, sample_mode=AcquisitionType.FINITE, samps_per_chan=size)
+            self.blockSize = size
+            self.blockRate = rate
+        data = self.buffers.get(size)
+        if data is None:
+            data = self.buffers[size] = np.empty(size)
+
+        timeout = size / rate + (NIDAQ_TRIGGER_TIMEOUT if self.trigger is not None else 1.0)
+        start = TRACER.begin()
+        self.task.start()
+        try:
+            self.reader.read_many_sample(data, number_of_samples_per_channel=size, timeout=timeout)
+        finally:
+            self.task.stop()
+        TRACER.count(DAQ_BLOCKS)
+        TRACER.end(start, 'DAQ block', 8 * size)
+        # The read buffer is reused by the next block of this size.
+        return data[:int(count)].copy()
+
+    def closeConnection(self):
+        if self.task is not None:
+            self.task.close()
+            self.task = None
+        print('NI-DAQ task is closed.')
+
+
+class NIDAQSimulated(NIDAQBaseClass):
+    # Stand-in for the USB-6361. A block takes count / sampleRate like the real clocked read.
+    # source() is the lock-in output (V) at the time of the block, DAQ noise is added per sample.
+    def __init__(self, lockin=None, source=None, sampleRate=NIDAQ_SAMPLE_RATE, trigger=None,
+                 noise=1e-4, seed=None):
+        super(NIDAQSimulated, self).__init__(lockin, sampleRate, trigger)
+        self.source = source if source is not None else lambda: random.uniform(0, 10)
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.isOpen = False
+        self.blockCount = 0
+
+    def openDevice(self):
+        self.isOpen = True
+        print('SIMULATED NI-DAQ task is open')
+
+    def readBlock(self, count, sampleRate=None):
+        if not self.isOpen:
+            raise ConnectionError("NI-DAQ not connected.")
+
+        rate = sampleRate or self.sampleRate
+        count = int(count)
+        start = monotonic()
+        trace = TRACER.begin()
+        signal = self.source()
+        volts = signal if not self.sensitivity else signal * (SR830_FULL_SCALE_OUTPUT / self.sensitivity)
+        data = volts + self.noise * self.rng.standard_normal(count)
+        np.clip(data, -SR830_FULL_SCALE_OUTPUT, SR830_FULL_SCALE_OUTPUT, out=data)
+        sleep(max(start + max(count, NIDAQ_MIN_BLOCK) / rate - monotonic(), 0))
+        self.blockCount += 1
+        TRACER.count(DAQ_BLOCKS)
+        TRACER.end(trace, 'DAQ block', 8 * count)
+        return data
+
+    def closeConnection(self):
+        self.isOpen = False
+        print('SIMULATED NI-DAQ task is closed.')
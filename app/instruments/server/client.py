@@ -0,0 +1,135 @@
+import builtins
+import threading
+from multiprocessing.connection import Client
+import numpy as np
+from instruments.lockinAmplifier.sr830 import LockinAmplifierBaseClass
+from instruments.server.protocol import decode, encode
+from instruments.thorlabsStage.lts150m import ThorlabsStageBaseClass
+from tracing import SERVER_ROUND_TRIPS, TRACER
+
+
+def remote_error(name, message):
+    # Builtin exception types are raised as themselves, anything else as a RuntimeError.
+    error = getattr(builtins, name, None)
+    if isinstance(error, type) and issubclass(error, Exception):
+        return error(message)
+    return RuntimeError('%s: %s' % (name, message))
+
+
+class InstrumentConnection:
+    # One socket to the instrument server, shared by the lock-in and stage clients.
+    # Every call is a round trip, batch() sends several calls in one.
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.connection = None
+        self.lock = threading.Lock()
+        self.roundTrips = 0
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = Client(self.address, authkey=self.authkey)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def batch(self, calls):
+        # calls is a list of (instrument, method, args), the results come back in order.
+        # The server runs them as a whole, no other client gets in between.
+        if self.connection is None:
+            raise ConnectionError("Instrument server not connected.")
+        start = TRACER.begin()
+        with self.lock:
+            self.connection.send_bytes(encode([(instrument, method, list(args)) for instrument, method, args in calls]))
+            response = decode(self.connection.recv_bytes())
+            self.roundTrips += 1
+        TRACER.count(SERVER_ROUND_TRIPS)
+        if start is not None:
+            TRACER.end(start, ', '.join(instrument + '.' + method for instrument, method, args in calls))
+        if response[0] == 'error':
+            raise remote_error(response[2], response[3])
+        return response[1]
+
+    def call(self, instrument, method, *args):
+        return self.batch([(instrument, method, args)])[0]
+
+
+class LockinAmplifierClient(LockinAmplifierBaseClass):
+    # The lock-in of an instrument server. Port and baudrate are the server's business.
+    def __init__(self, connection):
+        self.connection = connection
+
+    def openConnection(self, port=None, baudrate=None):
+        self.connection.connect()
+
+    def measure(self):
+        return self.connection.call('lockin', 'measure')
+
+    # Arrays come back as lists.
+    def measureBuffered(self, count):
+        return np.asarray(self.connection.call('lockin', 'measureBuffered', count), dtype=float)
+
+    def measureChannels(self, channels):
+        return np.asarray(self.connection.call('lockin', 'measureChannels', list(channels)), dtype=float)
+
+    def measureBufferedChannels(self, channels, count):
+        samples = self.connection.call('lockin', 'measureBufferedChannels', list(channels), count)
+        return np.asarray(samples, dtype=float).reshape(-1, len(channels))
+
+    def setSampleRate(self, sampleRate):
+        self.connection.call('lockin', 'setSampleRate', sampleRate)
+
+    def setTimeConstant(self, timeConstant):
+        self.connection.call('lockin', 'setTimeConstant', timeConstant)
+
+    def setSensitivity(self, sensitivity):
+        self.connection.call('lockin', 'setSensitivity', sensitivity)
+
+    def getTimeConstant(self):
+        return self.connection.call('lockin', 'getTimeConstant')
+
+    def getSensitivity(self):
+        return self.connection.call('lockin', 'getSensitivity')
+
+    def closeConnection(self):
+        self.connection.close()
+
+
+class ThorlabsStageClient(ThorlabsStageBaseClass):
+    # The stage of an instrument server. home() only homes the first time the server is asked.
+    def __init__(self, connection):
+        self.connection = connection
+
+    def openConnection(self):
+        self.connection.connect()
+
+    def home(self):
+        self.connection.call('stage', 'home')
+
+    def move(self, position):
+        self.connection.call('stage', 'move', position)
+
+    def startMove(self, position):
+        self.connection.call('stage', 'startMove', position)
+
+    def startMoveBy(self, distance):
+        self.connection.call('stage', 'startMoveBy', distance)
+
+    def waitForMove(self, timeout=60.0, poll_interval=0.002):
+        # Polled on the server, not one round trip per poll.
+        return self.connection.call('stage', 'waitForMove', timeout, poll_interval)
+
+    def sweep(self, position, velocity):
+        self.connection.call('stage', 'sweep', position, velocity)
+
+    def getPosition(self):
+        return self.connection.call('stage', 'getPosition')
+
+    def isMoving(self):
+        return self.connection.call('stage', 'isMoving')
+
+    def closeConnection(self):
+        # Only this client goes, the server keeps the stage connected.
+        self.connection.close()
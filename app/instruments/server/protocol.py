@@ -0,0 +1,20 @@
+import json
+import numpy as np
+
+# Messages are JSON, never pickles: unpickling runs whatever code the sender chooses.
+# A request is a list of [instrument, method, args], a response ['ok', results] or
+# ['error', index, type name, message]. Arrays travel as lists, the client turns them back.
+
+
+def to_json(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError('%s is not sent to instrument clients' % type(value).__name__)
+
+
+def encode(message):
+    return json.dumps(message, default=to_json).encode()
+
+
+def decode(data):
+    return json.loads(data.decode())
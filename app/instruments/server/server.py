@@ -0,0 +1,117 @@
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, answer_challenge, deliver_challenge
+from instruments.server.protocol import decode, encode
+
+# Methods clients may call, per instrument. Opening and closing the connections is the
+# server's job, clients only connect to and disconnect from the server.
+LOCKIN_METHODS = ('measure', 'measureBuffered', 'measureChannels', 'measureBufferedChannels', 'setTimeConstant',
+                  'setSensitivity', 'getTimeConstant', 'getSensitivity', 'setSampleRate')
+STAGE_METHODS = ('home', 'move', 'startMove', 'startMoveBy', 'waitForMove', 'sweep', 'getPosition', 'isMoving')
+
+
+def error_response(index, error):
+    # Exceptions are sent as their type name and message, the client raises them again.
+    return ('error', index, type(error).__name__, str(error))
+
+
+class InstrumentServer:
+    # Owns the lock-in and the stage for as long as it runs, so clients come and go without
+    # reopening the connections or homing again. Every client gets a thread. Commands to one
+    # instrument run one at a time, a batch holds the locks of all instruments it touches
+    # and runs as a whole, e.g. a move and the reading after it.
+    def __init__(self, lia, stage, address, authkey, homed=False):
+        self.instruments = {'lockin': lia, 'stage': stage}
+        self.methods = {'lockin': LOCKIN_METHODS, 'stage': STAGE_METHODS}
+        # Always taken in this order, two batches never wait on each other.
+        self.locks = {'lockin': threading.Lock(), 'stage': threading.Lock()}
+        self.homed = homed
+        # Clients authenticate in their own thread, a slow one does not hold up accept().
+        self.authkey = authkey
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        self.clients = []
+        self.closed = threading.Event()
+
+    def serve_forever(self):
+        while not self.closed.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # The listener was closed, or a client hung up right away.
+                continue
+            thread = threading.Thread(target=self.serve_client, args=(connection,), daemon=True)
+            self.clients.append(connection)
+            thread.start()
+
+    def start(self):
+        # Serves from a background thread, for tests and for embedding in another program.
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self.closed.set()
+        self.listener.close()
+        for connection in list(self.clients):
+            connection.close()
+
+    def serve_client(self, connection):
+        try:
+            with connection:
+                try:
+                    deliver_challenge(connection, self.authkey)
+                    answer_challenge(connection, self.authkey)
+                except (AuthenticationError, EOFError, OSError):
+                    return
+                while True:
+                    try:
+                        data = connection.recv_bytes()
+                    except (EOFError, OSError):
+                        return
+                    try:
+                        response = encode(self.run_batch(decode(data)))
+                    except Exception as e:
+                        # Not a request, or a result that has no JSON form, e.g. a .NET object.
+                        response = encode(error_response(0, e))
+                    try:
+                        connection.send_bytes(response)
+                    except (EOFError, OSError):
+                        return
+        finally:
+            self.clients.remove(connection)
+
+    def run_batch(self, calls):
+        # calls is a list of (instrument, method, args). Returns ('ok', results) or, at the first
+        # failing call, ('error', index, type name, message).
+        try:
+            targets = sorted({self.check_call(instrument, method) for instrument, method, args in calls})
+        except (ValueError, TypeError) as e:
+            return error_response(0, e)
+        locks = [self.locks[instrument] for instrument in targets]
+        for lock in locks:
+            lock.acquire()
+        try:
+            results = []
+            for index, (instrument, method, args) in enumerate(calls):
+                try:
+                    results.append(self.call(instrument, method, args))
+                except Exception as e:
+                    return error_response(index, e)
+            return ('ok', results)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def check_call(self, instrument, method):
+        if method not in self.methods.get(instrument, ()):
+            raise ValueError("Unknown instrument call: %s.%s" % (instrument, method))
+        return instrument
+
+    def call(self, instrument, method, args):
+        if instrument == 'stage' and method == 'home':
+            # Homing takes up to a minute and only needs to happen once per server.
+            if self.homed:
+                return None
+            self.homed = True
+        return getattr(self.instruments[instrument], method)(*args)
@@ -0,0 +1,237 @@
+import math
+import numpy as np
+from time import sleep, monotonic
+from instruments.lockinAmplifier.sr830 import LOCKIN_CHANNELS, LockinAmplifierBaseClass, xy_channels
+from instruments.thorlabsStage.lts150m import ThorlabsStageBaseClass
+from tracing import SERIAL_ROUND_TRIPS, STAGE_MOVES, TRACER
+
+SPEED_OF_LIGHT = 299.792458  # um/ps
+
+
+def stage_delay(position):
+    # Delay line: the beam travels the stage displacement twice. um -> ps.
+    return 2 * np.asarray(position, dtype=float) / SPEED_OF_LIGHT
+
+
+def thz_pulse(position, center=1500.0, width=0.4, amplitude=1e-3, offset=0.0):
+    # Single-cycle THz field, the first derivative of a Gaussian in delay time.
+    # center is a stage position in um, width is in ps, amplitude is the peak in V.
+    t = stage_delay(position) - stage_delay(center)
+    x = t / width
+    return offset + amplitude * math.sqrt(2 * math.e) * -x * np.exp(-x ** 2)
+
+
+def trapezoid_travel_time(distance, velocity, acceleration):
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    ramp_distance = velocity ** 2 / acceleration
+    if distance < ramp_distance:
+        # Triangular profile, the stage never reaches velocity.
+        return 2 * math.sqrt(distance / acceleration)
+    return distance / velocity + velocity / acceleration
+
+
+def trapezoid_distance(distance, velocity, acceleration, elapsed):
+    # Distance covered after elapsed seconds of a trapezoidal move of the given length.
+    distance = abs(distance)
+    total = trapezoid_travel_time(distance, velocity, acceleration)
+    if elapsed >= total:
+        return distance
+    if elapsed <= 0:
+        return 0.0
+    peak = min(velocity, math.sqrt(distance * acceleration))
+    ramp_time = peak / acceleration
+    if elapsed < ramp_time:
+        return 0.5 * acceleration * elapsed ** 2
+    if elapsed < total - ramp_time:
+        return 0.5 * acceleration * ramp_time ** 2 + peak * (elapsed - ramp_time)
+    remaining = total - elapsed
+    return distance - 0.5 * acceleration * remaining ** 2
+
+
+class SerialLink:
+    # Cost of one command/response exchange: fixed latency plus 10 bits per byte on the wire.
+    def __init__(self, latency=0.01, baudrate=9600):
+        self.latency = latency
+        self.baudrate = baudrate
+        self.roundTrips = 0
+        self.bytesTransferred = 0
+
+    def cost(self, bytes_out, bytes_in):
+        return self.latency + 10 * (bytes_out + bytes_in) / self.baudrate
+
+    def transfer(self, bytes_out, bytes_in, command='serial'):
+        start = TRACER.begin()
+        self.roundTrips += 1
+        self.bytesTransferred += bytes_out + bytes_in
+        sleep(self.cost(bytes_out, bytes_in))
+        TRACER.count(SERIAL_ROUND_TRIPS)
+        TRACER.end(start, command, bytes_out + bytes_in)
+
+
+class ThorlabsStageSimulator(ThorlabsStageBaseClass):
+    # Trapezoidal velocity profile in um, um/s and um/s^2. Moves take real time.
+    def __init__(self, serialNumber, velocity=5000.0, acceleration=5000.0, moveOverhead=0.02,
+                 homingTime=0.5):
+        self.serialNumber = serialNumber
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.moveOverhead = moveOverhead
+        self.homingTime = homingTime
+        self.moveStart = (monotonic(), 0.0, 0.0, velocity)
+        self.moveCount = 0
+
+    def openConnection(self):
+        print('SIMULATED stagecontroller connected.')
+
+    def home(self):
+        sleep(self.homingTime)
+        self.moveStart = (monotonic(), 0.0, 0.0, self.velocity)
+
+    def positionAt(self, t):
+        t0, start, target, velocity = self.moveStart
+        travel = trapezoid_distance(target - start, velocity, self.acceleration, t - t0)
+        return start + travel if target >= start else start - travel
+
+    def moveEnd(self):
+        t0, start, target, velocity = self.moveStart
+        return t0 + trapezoid_travel_time(target - start, velocity, self.acceleration)
+
+    def startMoveAt(self, position, velocity):
+        now = monotonic()
+        self.moveStart = (now, self.positionAt(now), float(position), float(velocity))
+        self.moveCount += 1
+        TRACER.count(STAGE_MOVES)
+
+    def move(self, position):
+        sleep(self.moveOverhead)
+        self.startMoveAt(position, self.velocity)
+        sleep(max(self.moveEnd() - monotonic(), 0))
+
+    def startMove(self, position):
+        sleep(self.moveOverhead)
+        self.startMoveAt(position, self.velocity)
+
+    def sweep(self, position, velocity):
+        sleep(self.moveOverhead)
+        self.startMoveAt(position, min(abs(velocity), self.velocity))
+
+    def getPosition(self):
+        return self.positionAt(monotonic())
+
+    def isMoving(self):
+        return monotonic() < self.moveEnd()
+
+    def closeConnection(self):
+        print('SIMULATED stageController is disconnected.')
+
+
+class SR830Simulator(LockinAmplifierBaseClass):
+    # The input is the THz waveform at the current stage position plus white noise.
+    # Output follows it through a first-order (6 dB/oct) low pass with the set time constant.
+    # Noise is an Ornstein-Uhlenbeck process, so readings closer than a time constant are correlated.
+    def __init__(self, stage, waveform=thz_pulse, noise=2e-6, link=None, seed=None,
+                 maxSampleRate=512.0):
+        self.stage = stage
+        self.waveform = waveform
+        self.noise = noise
+        self.link = link if link is not None else SerialLink()
+        self.rng = np.random.default_rng(seed)
+        self.maxSampleRate = maxSampleRate
+        self.sampleRate = maxSampleRate
+        self.timeConstant = 0.1
+        self.sensitivity = 1.0
+        self.lastUpdate = monotonic()
+        self.signal = 0.0
+        self.noiseState = np.zeros(2)
+
+    def openConnection(self, port, baudrate):
+        self.link.baudrate = baudrate
+        self.link.transfer(6, 20, '*IDN?')
+        print('SIMULATED SR830 is connected')
+
+    def noiseLevel(self):
+        # Stationary std of white noise after the low pass, ENBW = 1 / (4 tc).
+        return self.noise / (2 * math.sqrt(max(self.timeConstant, 1e-6)))
+
+    def advance(self, now):
+        # Integrate the filter from lastUpdate to now. Substeps follow a moving stage.
+        dt = now - self.lastUpdate
+        if dt <= 0:
+            return
+        tc = max(self.timeConstant, 1e-6)
+        steps = min(max(int(math.ceil(4 * dt / tc)), 1), 64)
+        sub_dt = dt / steps
+        decay = math.exp(-sub_dt / tc)
+        for i in range(steps):
+            target = float(self.waveform(self.stage.positionAt(self.lastUpdate + (i + 1) * sub_dt)))
+            self.signal = target + (self.signal - target) * decay
+        total_decay = math.exp(-dt / tc)
+        self.noiseState = self.noiseState * total_decay + \
+            self.noiseLevel() * math.sqrt(1 - total_decay ** 2) * self.rng.standard_normal(2)
+        self.lastUpdate = now
+
+    def readOutputs(self):
+        self.advance(monotonic())
+        x = self.signal + self.noiseState[0]
+        y = self.noiseState[1]
+        return x, y
+
+    def measure(self) -> float:
+        self.link.transfer(7, 12, 'OUTP? 3')
+        x, y = self.readOutputs()
+        return math.hypot(x, y)
+
+    def readBuffer(self, count):
+        # X and Y samples at sampleRate, like a fill of the SR830 buffer.
+        self.link.transfer(40, 0, 'buffer setup')
+        x, y = np.empty(count), np.empty(count)
+        period = 1 / self.sampleRate
+        start = monotonic()
+        sleep(count * period)
+        for i in range(count):
+            self.advance(start + (i + 1) * period)
+            x[i] = self.signal + self.noiseState[0]
+            y[i] = self.noiseState[1]
+        return x, y
+
+    def measureBuffered(self, count):
+        x, y = self.readBuffer(int(count))
+        self.link.transfer(16, 4 * len(x), 'TRCB?')  # binary transfer
+        return np.hypot(x, y)
+
+    def measureBufferedChannels(self, channels, count):
+        x, y = self.readBuffer(int(count))
+        for channel in (1, 2):
+            self.link.transfer(16, 4 * len(x), 'TRCB?')
+        columns = [xy_channels((channel,), x, y)[:, 0] if channel in LOCKIN_CHANNELS
+                   else np.full(len(x), 1000.0 if channel == 'frequency' else 0.0) for channel in channels]
+        return np.column_stack(columns) if columns else np.empty((len(x), 0))
+
+    def measureChannels(self, channels):
+        self.link.transfer(8 + 2 * len(channels), 12 * len(channels), 'SNAP?')
+        x, y = self.readOutputs()
+        outputs = {'X': x, 'Y': y, 'R': math.hypot(x, y), 'theta': math.degrees(math.atan2(y, x)),
+                   'frequency': 1000.0}
+        return np.array([outputs.get(channel, 0.0) for channel in channels], dtype=float)
+
+    def setSampleRate(self, sampleRate):
+        self.sampleRate = self.maxSampleRate if sampleRate is None else min(sampleRate, self.maxSampleRate)
+
+    def setTimeConstant(self, timeConstant):
+        self.link.transfer(8, 0, 'OFLT')
+        self.advance(monotonic())
+        self.timeConstant = timeConstant
+
+    def setSensitivity(self, sensitivity):
+        self.link.transfer(8, 0, 'SENS')
+        self.sensitivity = sensitivity
+
+    def getTimeConstant(self):
+        self.link.transfer(6, 4, 'OFLT?')
+        return self.timeConstant
+
+    def getSensitivity(self):
+        self.link.transfer(6, 4, 'SENS?')
+        return self.sensitivity
@@ -1,28 +1,46 @@
 import os
 import decimal  # necessary for real world units
 import sys
-import clr
 import time
 from abc import ABC, abstractmethod
 import serial
 from time import sleep
+from instruments.thorlabsStage.session import wait_until
+from tracing import STAGE_MOVES, TRACER
 
-#This part only works at Lab Computer. Thats why it is inside try/catch block to bypass for development.
-try:
-    clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.DeviceManagerCLI.dll")
-    clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.GenericMotorCLI.dll")
-    clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\ThorLabs.MotionControl.IntegratedStepperMotorsCLI.dll")
-    from Thorlabs.MotionControl.DeviceManagerCLI import *
-    from Thorlabs.MotionControl.GenericMotorCLI import *
-    from Thorlabs.MotionControl.IntegratedStepperMotorsCLI import *
-    from System import Decimal  # necessary for real world units
-
-except AttributeError as e:
-    print(f"AttributeError: {e}")
-except ImportError as e:
-    print(f"ImportError: {e}. Please download Kinesis software and check references to dlls.")
-except Exception as e:
-    print(f"Unexpected error: {e}")
+# Kinesis .NET types, filled in by load_kinesis() when the real stage is first opened.
+DeviceManagerCLI = LongTravelStage = MotorDirection = Decimal = None
+
+
+def load_kinesis():
+    # Loading pythonnet and the Kinesis dlls takes seconds, so importing this module does not do it.
+    global DeviceManagerCLI, LongTravelStage, MotorDirection, Decimal
+    if Decimal is not None:
+        return
+    #This part only works at Lab Computer. Thats why it is inside try/catch block to bypass for development.
+    try:
+        import clr
+        clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.DeviceManagerCLI.dll")
+        clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\Thorlabs.MotionControl.GenericMotorCLI.dll")
+        clr.AddReference("C:\\Program Files\\Thorlabs\\Kinesis\\ThorLabs.MotionControl.IntegratedStepperMotorsCLI.dll")
+        from Thorlabs.MotionControl.DeviceManagerCLI import DeviceManagerCLI
+        from Thorlabs.MotionControl.GenericMotorCLI import MotorDirection
+        from Thorlabs.MotionControl.IntegratedStepperMotorsCLI import LongTravelStage
+        from System import Decimal  # necessary for real world units
+
+    except AttributeError as e:
+        print(f"AttributeError: {e}")
+        raise
+    except ImportError as e:
+        print(f"ImportError: {e}. Please download Kinesis software and check references to dlls.")
+        raise
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        raise
+
+STAGE_VELOCITY = 5.0  # mm/s
+DEMO_VELOCITY = 5000.0  # um/s, the 5 mm/s the real stage is driven at
+POSITION_TOLERANCE = 0.5  # um
 
 class ThorlabsStageBaseClass(ABC):
     @abstractmethod
@@ -37,6 +55,39 @@ class ThorlabsStageBaseClass(ABC):
     def move(self):
         pass
 
+    # Starts a move to position (um) at the normal velocity and returns immediately.
+    @abstractmethod
+    def startMove(self, position):
+        pass
+
+    # Relative move by distance (um). Uniform scan steps go out this way, so the controller
+    # can keep the step size instead of getting a new absolute target for every point.
+    def startMoveBy(self, distance):
+        self.startMove(self.getPosition() + distance)
+
+    # Blocks until the stage has stopped. Returns False on timeout.
+    def waitForMove(self, timeout=60.0, poll_interval=0.002):
+        deadline = time.monotonic() + timeout
+        while self.isMoving():
+            if time.monotonic() > deadline:
+                return False
+            sleep(poll_interval)
+        return True
+
+    # Starts a constant velocity move (um/s) towards position (um) and returns immediately.
+    @abstractmethod
+    def sweep(self, position, velocity):
+        pass
+
+    # Current stage position in um.
+    @abstractmethod
+    def getPosition(self):
+        pass
+
+    @abstractmethod
+    def isMoving(self):
+        pass
+
     @abstractmethod
     def closeConnection(self):
         pass
@@ -44,8 +95,12 @@ class ThorlabsStageBaseClass(ABC):
 
 class ThorlabsStageControllerDemo(ThorlabsStageBaseClass):
 
-    def __init__(self, serialNumber):
+    # Moves take travel time at velocity (um/s), so overlapping them with other work shows.
+    def __init__(self, serialNumber, velocity=DEMO_VELOCITY):
         self.serialNumber = serialNumber
+        self.velocity = velocity
+        self.position = 0.0
+        self.sweepStart = None
 
     def openConnection(self):
         print('DEMO stagecontroller connected.')
@@ -54,7 +109,33 @@ class ThorlabsStageControllerDemo(ThorlabsStageBaseClass):
         print('DEMO stagecontroller homed.')
 
     def move(self, position):
-        print('DEMO stagecontroller is ordered to move to: ' + str(position))
+        self.startMove(position)
+        self.waitForMove()
+
+    def startMove(self, position):
+        TRACER.message('DEMO stagecontroller is ordered to move to: ' + str(position))
+        TRACER.count(STAGE_MOVES)
+        self.sweepStart = (time.monotonic(), self.getPosition(), position, self.velocity)
+
+    def sweep(self, position, velocity):
+        TRACER.message('DEMO stagecontroller sweeps to ' + str(position) + ' at ' + str(velocity) + ' um/s')
+        TRACER.count(STAGE_MOVES)
+        self.sweepStart = (time.monotonic(), self.getPosition(), position, abs(velocity))
+
+    def getPosition(self):
+        if self.sweepStart is None:
+            return self.position
+        t0, start, target, velocity = self.sweepStart
+        travel = velocity * (time.monotonic() - t0)
+        if travel >= abs(target - start):
+            self.sweepStart = None
+            self.position = target
+            return target
+        return start + travel if target > start else start - travel
+
+    def isMoving(self):
+        self.getPosition()
+        return self.sweepStart is not None
 
     def closeConnection(self):
         print('DEMO stageController is disconnected.')
@@ -62,12 +143,18 @@ class ThorlabsStageControllerDemo(ThorlabsStageBaseClass):
 
 class ThorlabsStageController(ThorlabsStageBaseClass):
 
-    def __init__(self, serial_no):
+    # session is a StageSession, it lets a restart skip homing. The velocity is
+    # cached and only sent to the controller when it changes.
+    def __init__(self, serial_no, session=None):
         if not isinstance(serial_no, str) or not serial_no.isnumeric():
             raise ValueError("serial_no must be a string containing only numeric characters.")
         self.serial_no = serial_no
+        self.session = session
+        self.target = None
+        self.velocity = None
 
     def openConnection(self):
+        load_kinesis()
         DeviceManagerCLI.BuildDeviceList()
         
         # Connect, begin polling, and enable
@@ -82,11 +169,11 @@ class ThorlabsStageController(ThorlabsStageBaseClass):
             assert self.device.IsSettingsInitialized() is True
         print("stage settings have been initialized.")
 
-        # Start polling and enable
+        # Start polling and enable, waiting only as long as the controller needs
         self.device.StartPolling(250)  # 250ms polling rate
-        time.sleep(10)  # Try a shorter delay first, then increase if necessary
         self.device.EnableDevice()
-        time.sleep(0.25)  # Wait for device to enable
+        if not wait_until(lambda: self.device.IsEnabled, 10):
+            raise RuntimeError("stage did not enable within 10 s")
         print("stage is enabled.")
 
         # Get Device Information and display description
@@ -98,6 +185,14 @@ class ThorlabsStageController(ThorlabsStageBaseClass):
         motor_config = self.device.LoadMotorConfiguration(self.serial_no)
 
     def home(self):
+        # The controller keeps its homed state until it is power cycled. If it says so and it is
+        # where this program left it, the position is still known and homing is skipped.
+        if self.session is not None and self.device.Status.IsHomed \
+                and self.session.can_skip_homing(self.getPosition()):
+            print("Stage is still homed, homing skipped")
+            self.session.forget()
+            return
+
         # Get parameters related to homing/zeroing/other
         home_params = self.device.GetHomingParams()
         home_params.Velocity = Decimal(5.0)  # real units, mm/s
@@ -108,27 +203,115 @@ class ThorlabsStageController(ThorlabsStageBaseClass):
         print("Homing Device")
         self.device.Home(60000)  # 60 second timeout
         print("Homing is Done")
+        if self.session is not None:
+            # The position is only stored again on a clean disconnect.
+            self.session.mark_homed(None)
+
+    def setVelocity(self, velocity):
+        # mm/s, only sent when it changes.
+        if velocity == self.velocity:
+            return
+        vel_params = self.device.GetVelocityParams()
+        vel_params.MaxVelocity = Decimal(velocity)
+        self.device.SetVelocityParams(vel_params)
+        self.velocity = velocity
 
     def move(self, position_in_um):
         position = position_in_um / 1000 # um to mm convertion.
-        print('stagecontroller is ordered to move to ' + str(position))
+        TRACER.message('stagecontroller is ordered to move to ' + str(position))
 
-        # Get Velocity Params
-        vel_params = self.device.GetVelocityParams()
-        vel_params.MaxVelocity = Decimal(5.0)
-        self.device.SetVelocityParams(vel_params)
+        self.setVelocity(STAGE_VELOCITY)
 
         # Move the device to a new position
         new_pos = Decimal(position)  # Must be a .NET decimal
-        print(f'Moving to {new_pos}')
+        start = TRACER.begin()
         try:
             self.device.MoveTo(new_pos, 60000)  # 60 second timeout
+            self.target = position_in_um
         except Exception as e:
             error_message = str(e)
             print("Given position could be outside of stage limits, detailed error; ", error_message)
-        print("Done")
+        TRACER.count(STAGE_MOVES)
+        TRACER.end(start, 'MoveTo')
+
+    def startMove(self, position_in_um):
+        position = position_in_um / 1000  # um to mm convertion.
+        TRACER.message('stagecontroller starts a move to ' + str(position))
+        self.setVelocity(STAGE_VELOCITY)
+
+        # A zero timeout makes MoveTo return as soon as the move is started.
+        start = TRACER.begin()
+        try:
+            self.device.MoveTo(Decimal(position), 0)
+            self.target = position_in_um
+        except Exception as e:
+            error_message = str(e)
+            print("Given position could be outside of stage limits, detailed error; ", error_message)
+        TRACER.count(STAGE_MOVES)
+        TRACER.end(start, 'MoveTo start')
+
+    def startMoveBy(self, distance_in_um):
+        # MoveRelative, not a jog: a jog does whatever the controller's jog mode says, and in
+        # continuous mode that is a run to the limit switch.
+        # target is the last commanded position, where the stage should be now.
+        position = self.getPosition()
+        expected = self.target if self.target is not None else position
+        if abs(position - expected) > POSITION_TOLERANCE / 2:
+            # Relative moves are rounded to encoder counts, do not let that add up over a scan.
+            self.startMove(expected + distance_in_um)
+            return
+
+        self.setVelocity(STAGE_VELOCITY)
+        step = abs(distance_in_um) / 1000  # um to mm convertion.
+        direction = MotorDirection.Forward if distance_in_um > 0 else MotorDirection.Backward
+        start = TRACER.begin()
+        try:
+            # A zero timeout returns as soon as the move is started, like MoveTo.
+            self.device.MoveRelative(direction, Decimal(step), 0)
+            self.target = expected + distance_in_um
+        except Exception as e:
+            error_message = str(e)
+            print("Given position could be outside of stage limits, detailed error; ", error_message)
+        TRACER.count(STAGE_MOVES)
+        TRACER.end(start, 'MoveRelative')
+
+    def waitForMove(self, timeout=60.0, poll_interval=0.002):
+        # Status is refreshed once per polling period, right after MoveTo it can still read idle.
+        # So the move is only done when the stage stopped at the target.
+        deadline = time.monotonic() + timeout
+        while self.isMoving() or (self.target is not None
+                                  and abs(self.getPosition() - self.target) > POSITION_TOLERANCE):
+            if time.monotonic() > deadline:
+                return False
+            sleep(poll_interval)
+        return True
+
+    def sweep(self, position_in_um, velocity):
+        position = position_in_um / 1000  # um to mm convertion.
+        TRACER.message('stagecontroller sweeps to ' + str(position) + ' at ' + str(velocity) + ' um/s')
+
+        self.setVelocity(velocity / 1000)
+
+        # A zero timeout makes MoveTo return as soon as the move is started.
+        start = TRACER.begin()
+        try:
+            self.device.MoveTo(Decimal(position), 0)
+            self.target = position_in_um
+        except Exception as e:
+            error_message = str(e)
+            print("Given position could be outside of stage limits, detailed error; ", error_message)
+        TRACER.count(STAGE_MOVES)
+        TRACER.end(start, 'MoveTo sweep')
+
+    def getPosition(self):
+        return Decimal.ToDouble(self.device.Position) * 1000  # mm to um convertion.
+
+    def isMoving(self):
+        return self.device.Status.IsInMotion
 
     def closeConnection(self):
+        if self.session is not None:
+            self.session.record_position(self.getPosition())
         self.device.StopPolling()
         self.device.Disconnect()
         print('stageController is disconnected.')
@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+POSITION_MATCH = 1.0  # um, a stored position that far off means the stage was moved or power cycled
+
+
+def wait_until(condition, timeout, poll_interval=0.05):
+    # Polls condition() until it is true. Returns False on timeout.
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(poll_interval)
+    return True
+
+
+class StageSession:
+    # Remembers across program restarts that the stage was homed and where it was left, so a
+    # restart within the same controller power cycle can skip the 60 s homing run.
+    def __init__(self, serialNumber, path):
+        self.serialNumber = serialNumber
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('serialNumber') != self.serialNumber:
+            return None
+        return state
+
+    def save(self, homed, position):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        state = {'serialNumber': self.serialNumber, 'homed': homed, 'position': position, 'saved': time.time()}
+        # Written to a temporary file first, a crash never leaves half a state file behind.
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+
+    def can_skip_homing(self, position):
+        # Only if the stage was left homed at the position it reports now.
+        state = self.load()
+        if state is None or not state.get('homed') or state.get('position') is None:
+            return False
+        return abs(state['position'] - position) <= POSITION_MATCH
+
+    def mark_homed(self, position):
+        self.save(True, position)
+
+    def record_position(self, position):
+        state = self.load()
+        self.save(bool(state and state.get('homed')), position)
+
+    def forget(self):
+        # Position is unknown from now on, e.g. while a move is in flight.
+        state = self.load()
+        if state is not None:
+            self.save(state.get('homed', False), None)
@@ -0,0 +1,53 @@
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo, ThorlabsStageController
+
+
+class MultiAxisStageBaseClass:
+    # Sample stage with one ThorlabsStageBaseClass per axis, e.g. two LTS150 for x and y.
+    # Positions are tuples in axis order, in um. The delay stage is not one of the axes.
+    def __init__(self, axes):
+        self.axes = tuple(axes)
+
+    def openConnection(self):
+        for axis in self.axes:
+            axis.openConnection()
+
+    def home(self):
+        for axis in self.axes:
+            axis.home()
+
+    # Starts all axes towards position at once and returns immediately.
+    def startMove(self, position):
+        for axis, target in zip(self.axes, position):
+            axis.startMove(target)
+
+    # Blocks until every axis has stopped. Returns False on timeout.
+    def waitForMove(self, timeout=60.0, poll_interval=0.002):
+        return all([axis.waitForMove(timeout, poll_interval) for axis in self.axes])
+
+    def move(self, position):
+        self.startMove(position)
+        self.waitForMove()
+
+    def getPosition(self):
+        return tuple(axis.getPosition() for axis in self.axes)
+
+    def isMoving(self):
+        return any(axis.isMoving() for axis in self.axes)
+
+    def closeConnection(self):
+        for axis in self.axes:
+            axis.closeConnection()
+
+
+class XYStageDemo(MultiAxisStageBaseClass):
+    def __init__(self, serialNumbers=('0', '1'), velocity=None):
+        kwargs = {} if velocity is None else {'velocity': velocity}
+        super(XYStageDemo, self).__init__([ThorlabsStageControllerDemo(serialNumber, **kwargs)
+                                           for serialNumber in serialNumbers])
+
+
+class XYStage(MultiAxisStageBaseClass):
+    # session is a StageSession per axis, or None.
+    def __init__(self, serialNumbers, sessions=(None, None)):
+        super(XYStage, self).__init__([ThorlabsStageController(serialNumber, session)
+                                       for serialNumber, session in zip(serialNumbers, sessions)])
@@ -0,0 +1,92 @@
+import argparse
+import signal
+import sys
+import config
+from scan.engine import ScanEngine
+from scan.jobs import ScanQueue, run_queue
+from scan.recipe import ScanRecipe
+from scan.storage import default_data_directory
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Queue scans and run them back to back.')
+    parser.add_argument('--queue', default=config.JOB_QUEUE_FILE, help='queue file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='append a scan to the queue')
+    add.add_argument('--start', type=float, required=True, help='scan start position (um)')
+    add.add_argument('--stop', type=float, required=True, help='scan stop position (um)')
+    add.add_argument('--step', type=float, required=True, help='step size (um)')
+    add.add_argument('--avg', type=int, default=1, help='lock-in reads averaged per point')
+    add.add_argument('--decorrelated', action='store_true',
+                     help='space the averaged reads half a time constant apart, slower but independent')
+    add.add_argument('--postmove', type=float, default=0, help='extra settle time in time constants')
+    add.add_argument('--tc', type=float, default=None, help='lock-in time constant (s)')
+    add.add_argument('--repeats', type=int, default=1, help='passes averaged per point')
+    add.add_argument('--prefix', default='', help='file prefix')
+
+    commands.add_parser('list', help='show the queued jobs')
+
+    remove = commands.add_parser('remove', help='drop a job from the queue')
+    remove.add_argument('id', type=int)
+
+    commands.add_parser('clear', help='drop all finished jobs')
+
+    run = commands.add_parser('run', help='run the queue, resuming interrupted jobs first')
+    run.add_argument('--data-dir', default=None, help='output directory, defaults to ../data/')
+    run.add_argument('--backend', choices=['demo', 'simulator', 'hardware', 'server'], default=config.INSTRUMENT_BACKEND,
+                     help='instruments to use, defaults to DEMO_MODE in config.py')
+    return parser.parse_args(argv)
+
+
+def format_job(job):
+    recipe = job['recipe']
+    return '%3d  %-8s %g..%g um step %g, avg %d, repeats %d  %s' % (
+        job['id'], job['state'], recipe['start'], recipe['stop'], recipe['stepsize'], recipe['nAvg'],
+        recipe['repeats'], recipe['fileprefix'])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    queue = ScanQueue(args.queue)
+
+    if args.command == 'add':
+        recipe = ScanRecipe(start=args.start, stop=args.stop, stepsize=args.step, nAvg=args.avg,
+                            decorrelated=args.decorrelated, nPostmove=args.postmove, timeConstant=args.tc, repeats=args.repeats,
+                            fileprefix=args.prefix)
+        print(format_job(queue.add(recipe)))
+    elif args.command == 'list':
+        for job in queue.load():
+            print(format_job(job))
+    elif args.command == 'remove':
+        queue.remove(args.id)
+    elif args.command == 'clear':
+        queue.clear()
+    elif args.command == 'run':
+        return run(queue, args)
+    return 0
+
+
+def run(queue, args):
+    lia, stage = config.create_instruments(args.backend)
+    config.connect_instruments(lia, stage)
+
+    engine = ScanEngine(lia, stage)
+    engine.on_status = lambda message: print('Status: ' + message)
+    # Ctrl+C finishes the current point, the job is marked stopped and resumes on the next run.
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: engine.cancel_token.cancel())
+    try:
+        finished = run_queue(engine, queue, args.data_dir or default_data_directory(),
+                             on_start=lambda job, recipe: print('Running job %d' % job['id']),
+                             on_job=lambda job, result: print('Job %d %s' % (job['id'],
+                                                                             'stopped' if result.stopped else 'done')))
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        stage.closeConnection()
+
+    print('Finished %d jobs' % finished)
+    return 1 if queue.next_job() is not None else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
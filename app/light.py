@@ -1,46 +1,45 @@
 import sys
-import time
 import os
 import numpy as np
-import pandas as pd
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow
 from PyQt5.uic import loadUi
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
-from matplotlib.figure import Figure
-import matplotlib
-import matplotlib.pyplot as plt
-from instruments.lockinAmplifier.sr830 import SR830Demo, SR830
-from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo, ThorlabsStageController
-
-DEMO_MODE = True
-
-THORLABS_STAGE_SERIAL_NO = "45283704"
-LIA_PORT = "ASRL5::INSTR"
-LIA_BAUDRATE = 9600
-
-
-time_constants = {
-    '100 s': 100.0,
-    '30 s': 30.0,
-    '10 s': 10.0,
-    '3 s': 3.0,
-    '1 s': 1.0,
-    '300 ms': 0.3,   # 300 milliseconds = 0.3 seconds
-    '100 ms': 0.1,   # 100 milliseconds = 0.1 seconds
-    '30 ms': 0.03,   # 50 milliseconds = 0.05 seconds
-    '10 ms': 0.01,   # 10 milliseconds = 0.01 seconds
-    '3 ms': 0.003,   # 1 millisecond = 0.001 seconds
-    '1 ms': 0.001,   # 1 millisecond = 0.001 seconds
-}
+from config import INSTRUMENT_BACKEND, JOB_QUEUE_FILE, time_constants
+from instruments.lockinAmplifier.sr830 import LOCKIN_CHANNELS
+from acquisition import AcquisitionWorker
+from scan.averaging import RunningAverage
+from scan.buffer import ScanBuffer
+from scan.engine import CancelToken, ScanResult
+from scan.jobs import ScanQueue
+from scan.raster import ImageRecipe, image_path
+from scan.timing import PhaseTimer, estimate_scan_time
+from scan.recipe import ScanRecipe
+from scan.storage import default_data_directory, save_scan
+from scan.spectrum import MAX_FREQUENCY, fft_length, stage_delay_step
+from spectrum import SPECTRUM_FPS, SpectrumWorker
 
 
 class LightUIWindow(QMainWindow):
+    # Requests to the acquisition thread. Queued, so they never block the GUI.
+    requestScan = pyqtSignal(object)
+    requestGoto = pyqtSignal(float)
+    requestSensitivity = pyqtSignal()
+    requestTimeConstant = pyqtSignal(float)
+    requestSpectrum = pyqtSignal(object)
+    requestInstruments = pyqtSignal(object)
+    requestQueue = pyqtSignal(object)
+    requestImage = pyqtSignal(object)
+    requestClose = pyqtSignal()
+
+    # The window shows up first. Matplotlib is loaded right after, and the instruments are
+    # connected and homed in the acquisition thread, with the scan controls off until then.
     def __init__(self):
         self.initialize_window()
-        self.initialize_instruments()
+        self.initialize_acquisition()
+        self.initialize_spectrum()
         self.initialize_ui_components()
         self.initialize_scan_data()
+        self.initialize_instruments()
 
     def initialize_window(self):
         super(LightUIWindow, self).__init__()
@@ -48,41 +47,110 @@ class LightUIWindow(QMainWindow):
         self.setWindowTitle('THz Scan GUI')
 
     def initialize_instruments(self):
-        if DEMO_MODE:
-            self.lia = SR830Demo()
-            self.stage = ThorlabsStageControllerDemo(THORLABS_STAGE_SERIAL_NO)
-        else:
-            self.lia = SR830()
-            self.stage = ThorlabsStageController(THORLABS_STAGE_SERIAL_NO)
-
-        self.lia.openConnection(LIA_PORT, LIA_BAUDRATE)
-        self.lia.setTimeConstant(0.3)
-        self.sensitivityOnUI.setText(str(self.lia.getSensitivity()))
-        self.stage.openConnection()
-        self.stage.home()
+        # Placeholders until the lock-in reports its settings.
+        self.timeConstant = 0.3
+        self.sensitivity = 0
+        self.update_statusbar('Connecting instruments')
+        self.requestInstruments.emit(INSTRUMENT_BACKEND)
+
+    def on_instruments_ready(self, timeConstant, sensitivity):
+        self.timeConstant = timeConstant
+        self.sensitivity = sensitivity
+        self.sensitivityOnUI.setText(str(self.sensitivity))
+        self.set_controls_enabled(True)
+        self.update_statusbar('Instruments ready')
+
+    def on_instruments_failed(self, message):
+        self.update_statusbar('Instruments failed to connect: ' + message)
+
+    def set_controls_enabled(self, enabled):
+        for button in (self.btnStart, self.btnRunQueue, self.btnGoto, self.btnUpdate, self.getSensButton):
+            button.setEnabled(enabled)
+
+    def initialize_acquisition(self):
+        # Only the worker thread ever talks to the instruments, it also creates them.
+        self.cancel_token = CancelToken()
+        # Rolling per-phase timings of the running app, they drive the ETA.
+        self.phaseTimer = PhaseTimer()
+        self.acquisition_thread = QThread()
+        self.worker = AcquisitionWorker(None, None, self.cancel_token, self.phaseTimer)
+        self.worker.moveToThread(self.acquisition_thread)
+
+        self.requestScan.connect(self.worker.run_scan)
+        self.requestGoto.connect(self.worker.goto)
+        self.requestSensitivity.connect(self.worker.read_sensitivity)
+        self.requestTimeConstant.connect(self.worker.set_time_constant)
+        self.requestInstruments.connect(self.worker.open_instruments)
+        self.requestQueue.connect(self.worker.run_queue)
+        self.requestImage.connect(self.worker.run_image)
+        # Blocks until the worker has closed the instruments, see closeEvent.
+        self.requestClose.connect(self.worker.close_instruments, Qt.BlockingQueuedConnection)
+
+        self.worker.scanStarted.connect(self.on_scan_started)
+        self.worker.pointAcquired.connect(self.on_point_acquired)
+        self.worker.scanFinished.connect(self.on_scan_finished)
+        self.worker.statusChanged.connect(self.update_statusbar)
+        self.worker.sensitivityRead.connect(self.on_sensitivity_read)
+        self.worker.timeConstantChanged.connect(self.on_time_constant_changed)
+        self.worker.instrumentsReady.connect(self.on_instruments_ready)
+        self.worker.instrumentsFailed.connect(self.on_instruments_failed)
+        self.worker.jobStarted.connect(self.on_job_started)
+        self.worker.jobFinished.connect(self.on_job_finished)
+        self.worker.queueFinished.connect(self.on_queue_finished)
+        self.worker.pixelAcquired.connect(self.on_pixel_acquired)
+        self.worker.imageFinished.connect(self.on_image_finished)
+
+        self.acquisition_thread.start()
+
+    def initialize_spectrum(self):
+        # The FFT runs in its own thread at SPECTRUM_FPS, the acquisition thread never waits for it.
+        self.spectrumBusy = False
+        self.traceChanged = False
+        self.spectrum_thread = QThread()
+        self.spectrumWorker = SpectrumWorker()
+        self.spectrumWorker.moveToThread(self.spectrum_thread)
+        self.requestSpectrum.connect(self.spectrumWorker.compute)
+        self.spectrumWorker.spectrumReady.connect(self.on_spectrum_ready)
+        self.spectrum_thread.start()
+
+        self.spectrumTimer = QTimer(self)
+        self.spectrumTimer.timeout.connect(self.update_spectrum)
+        self.spectrumTimer.start(int(1000 / SPECTRUM_FPS))
 
     def initialize_ui_components(self):  
         self.set_ui_buttons_to_default_values()
-        self.initialize_figure()
         self.initialize_buttons()
+        self.set_controls_enabled(False)
+        # Importing matplotlib takes longer than everything else, it waits for the event loop.
+        QTimer.singleShot(0, self.initialize_figure)
 
 
     def set_ui_buttons_to_default_values(self):
         # self.ddSens.setCurrentIndex(18)
         self.ddTc.setCurrentIndex(4)
-        self.StopRunFlag = False
         self.IsHomedFlag = False
         self.SaveAllFlag = False
         self.SaveOnStop = False
 
 
     def initialize_scan_data(self):
-        self.dataX = np.array([])
-        self.dataY = np.array([])
-        self.dataStep = np.array([])
+        self.scanBuffer = ScanBuffer(1)
+        self.jobQueue = ScanQueue(JOB_QUEUE_FILE)
+        # Raster image being taken and its peak map, None for delay scans.
+        self.imageRecipe = None
+        self.peakMap = None
+        self.recipe = self.scan_recipe()
+        # Per grid point mean and spread of a repeated scan, None for single passes.
+        self.repeatAverage = None
 
 
     def initialize_figure(self):
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
+        from matplotlib.figure import Figure
+        import matplotlib
+        from liveplot import LiveImage, LivePlot
+
         self.figure = Figure()
         self.canvas = FigureCanvas(self.figure)
         self.toolbar = NavigationToolbar(self.canvas, self)
@@ -90,6 +158,10 @@ class LightUIWindow(QMainWindow):
             matplotlib.rcParams.update({'font.size': 5})
         self.verticalLayout.insertWidget(0, self.toolbar)
         self.verticalLayout.replaceWidget(self.wplot, self.canvas)
+        self.livePlot = LivePlot(self.canvas, phase_timer=self.phaseTimer)
+        self.amplitudePlot = LivePlot(self.canvas, fps=SPECTRUM_FPS)
+        self.phasePlot = LivePlot(self.canvas, fps=SPECTRUM_FPS)
+        self.peakImage = LiveImage(self.canvas)
 
 
     def initialize_buttons(self):
@@ -98,72 +170,159 @@ class LightUIWindow(QMainWindow):
         self.btnGoto.clicked.connect(self.btnGoto_clicked)
         self.btnUpdate.clicked.connect(self.btnUpdate_clicked)
         self.getSensButton.clicked.connect(self.getSensButton_clicked)
+        self.btnQueue.clicked.connect(self.btnQueue_clicked)
+        self.btnRunQueue.clicked.connect(self.btnRunQueue_clicked)
         self.cbSaveall.stateChanged.connect(self.update_savestate)
 
 
-    #TODO: Refactor this method.
     def btnStart_clicked(self):
-        length_of_scan = int(((self.nStop.value() - self.nStart.value())/self.nStepsize.value()) + 1)
+        if self.cbImage.isChecked():
+            self.start_image()
+            return
+        self.imageRecipe = None
+        self.prepare_scan(self.scan_recipe())
+        self.btnStart.setEnabled(False)
+        self.btnRunQueue.setEnabled(False)
+
+        # Stream points to disk while scanning, the worker is idle until it gets the request.
+        self.worker.engine.stream_directory = default_data_directory() if self.SaveAllFlag else None
+        self.requestScan.emit(self.recipe)
+
+    def start_image(self):
+        # The delay settings are used for the trace at every pixel. The cube always goes to disk.
+        delay = self.scan_recipe()
+        self.imageRecipe = ImageRecipe(self.nXStart.value(), self.nXStop.value(), self.nXStep.value(),
+                                       self.nYStart.value(), self.nYStop.value(), self.nYStep.value(),
+                                       delay=delay, serpentine=self.cbSerpentine.isChecked(),
+                                       fileprefix=delay.fileprefix)
+        self.peakMap = np.full(self.imageRecipe.shape()[:2], np.nan)
+        self.prepare_scan(delay)
+        self.btnStart.setEnabled(False)
+        self.btnRunQueue.setEnabled(False)
+        self.requestImage.emit((self.imageRecipe, image_path(self.imageRecipe, default_data_directory())))
+
+    def on_pixel_acquired(self, ix, iy, peak):
+        self.peakMap[ix, iy] = peak
+        self.peakImage.set_data(self.peakMap.T)
+        # The trace plot shows the pixel being measured.
+        self.scanBuffer.reset()
+
+    def on_image_finished(self, pixels):
+        self.btnStart.setEnabled(True)
+        self.btnRunQueue.setEnabled(True)
+        self.update_statusbar('Image finished with ' + str(pixels) + ' pixels')
+
+    def prepare_scan(self, recipe):
+        # Fresh buffer and plot for the scan about to start.
         self.voltage_min = 0
         self.voltage_max = 10
-        self.time_min = self.nStart.value()
-        self.time_max = self.nStop.value()
+        self.time_min = recipe.start
+        self.time_max = recipe.stop
 
-        self.update_statusbar('Starting scan')
-        self.reset_data_array()
-        self.StopRunFlag = False
+        self.recipe = recipe
+        self.reset_data_array(self.recipe.length_of_scan())
         # It defaults to the end of the loop where it saves, anyway.
         self.SaveOnStop = False
+        if self.recipe.repeats > 1 and self.recipe.mode != 'refine':
+            self.repeatGrid = self.recipe.positions()
+            self.repeatAverage = RunningAverage(len(self.repeatGrid))
+        else:
+            self.repeatAverage = None
 
         self.generate_plot()
 
-        # goto start of scan range
-        self.stage.move(self.nStart.value())
-
-        post_move_wait_time = self.lia.getTimeConstant() * (1 + self.nPostmove.value())
- 
-        # wait for stage controller to arrive.
-        for i in range(length_of_scan):
-
-            # Check for stop flag
-            if self.StopRunFlag == True:
-                break
-
-            # Execute move start
-            self.PresentPosition = self.nStart.value() + (i * self.nStepsize.value())
-            self.stage.move(self.PresentPosition)
-            
-            # Execute post move wait
-            self.interruptable_sleep(post_move_wait_time)
-            
-            # Measure data
-            voltageValue = self.measureVoltage()
-
-            # append data to dataarray
-            self.dataX = np.append(self.dataX, self.PresentPosition)
-            self.dataY = np.append(self.dataY, voltageValue)
-            self.dataStep = np.append(self.dataStep, self.PresentPosition)
-
-            # Update plot
-            self.update_plot()
-
-        self.save_data_array()
-
+    def scan_recipe(self):
+        return ScanRecipe(start=self.nStart.value(), stop=self.nStop.value(), stepsize=self.nStepsize.value(),
+                          nAvg=self.nAvg.value(), nPostmove=self.nPostmove.value(),
+                          fileprefix=self.fileprefix.text(),
+                          mode=self.scan_mode(),
+                          velocity=self.nVelocity.value() or None,
+                          decorrelated=self.cbDecorrelated.isChecked(),
+                          adaptive=self.cbAdaptive.isChecked(),
+                          targetError=self.nTargetError.value() * 1e-6,  # uV to V
+                          minAvg=self.nMinAvg.value(),
+                          coarseStep=self.nCoarseStep.value() or None,
+                          repeats=self.nRepeats.value(),
+                          serpentine=self.cbSerpentine.isChecked(),
+                          channels=LOCKIN_CHANNELS if self.cbChannels.isChecked() else ())
+
+    def scan_mode(self):
+        if self.cbFlyscan.isChecked():
+            return 'fly'
+        if self.cbRefine.isChecked():
+            return 'refine'
+        return 'step'
+
+    def on_scan_started(self, length_of_scan):
+        self.update_statusbar('Scanning ' + str(length_of_scan) + ' points')
+
+    def on_point_acquired(self, index, position, voltageValue, timestamp):
+        self.PresentPosition = position
+        self.scanBuffer.append(position, voltageValue, timestamp)
+        if self.repeatAverage is not None:
+            # Repeated scans report the grid index, every pass folds into the running mean.
+            self.repeatAverage.update(index, voltageValue)
+        self.update_plot()
+
+    def on_scan_finished(self, result):
+        self.btnStart.setEnabled(True)
+        self.btnRunQueue.setEnabled(True)
+        if result is None:
+            # The scan failed, the worker has put the reason on the status bar.
+            return
+        self.show_result(result)
+        self.save_data_array(result)
+
+    def show_result(self, result):
+        self.timeConstant = result.timeConstant
+        self.sensitivity = result.sensitivity
+        # Show the final trace, for fly scans this is the gridded one.
+        self.scanBuffer = result.buffer
+        self.update_plot()
+
+    def btnQueue_clicked(self):
+        # The lock-in may be set to something else by the time the job runs.
+        recipe = self.scan_recipe()
+        recipe.timeConstant = time_constants[self.ddTc.currentText()]
+        job = self.jobQueue.add(recipe)
+        self.update_statusbar('Scan queued as job ' + str(job['id']))
+
+    def btnRunQueue_clicked(self):
+        # Jobs always save, an interrupted one resumes from its stream file on the next run.
+        self.imageRecipe = None
+        self.btnStart.setEnabled(False)
+        self.btnRunQueue.setEnabled(False)
+        self.btnQueue.setEnabled(False)
+        self.requestQueue.emit((self.jobQueue, default_data_directory()))
+
+    def on_job_started(self, recipe):
+        self.prepare_scan(recipe)
+
+    def on_job_finished(self, result):
+        self.show_result(result)
+
+    def on_queue_finished(self, finished):
+        self.btnStart.setEnabled(True)
+        self.btnRunQueue.setEnabled(True)
+        self.btnQueue.setEnabled(True)
+        self.update_statusbar('Queue finished ' + str(finished) + ' jobs')
 
     def btnStop_clicked(self):
         self.update_statusbar('Stopping scan')
-        self.StopRunFlag = True
+        # Thread-safe, the worker sees it at its next check or wakes up from the settle wait.
+        self.cancel_token.cancel()
         if self.SaveOnStop:
             self.save_data_array()
 
 
     def btnGoto_clicked(self):
-        self.update_statusbar('Starting Goto')
-        self.stage.move(self.nPosition.value())
-        self.update_statusbar('Goto value reached')
+        self.requestGoto.emit(self.nPosition.value())
 
     def getSensButton_clicked(self):
-        sens = self.lia.getSensitivity()
+        self.requestSensitivity.emit()
+
+    def on_sensitivity_read(self, sens):
+        self.sensitivity = sens
         self.sensitivityOnUI.setText(str(sens))
         self.update_statusbar('Sensitivity value on Lockin is: ' + str(sens))
 
@@ -177,19 +336,10 @@ class LightUIWindow(QMainWindow):
             raise ValueError(f"Unexpected time constant value: {selected_text}")
 
         # Set the time constant
-        self.lia.setTimeConstant(selected_tc)
-        newTimeConstant= self.lia.getTimeConstant()
-        self.update_statusbar("Time constant is set in Lockin to " + str(newTimeConstant) + " seconds.")
-
-
-    def measureVoltage(self):
-        dataY = []
-        for i in range(int(self.nAvg.value())):
-            single_measurement = self.lia.measure() #SR830 read
-            dataY.append(single_measurement)
-
-        return (np.mean(dataY))
+        self.requestTimeConstant.emit(selected_tc)
 
+    def on_time_constant_changed(self, newTimeConstant):
+        self.timeConstant = newTimeConstant
 
     def update_statusbar(self, new_update):
         self.statusBar.setText('Status: '+ new_update)
@@ -208,64 +358,29 @@ class LightUIWindow(QMainWindow):
 
 
     def estimate_scan_time(self):
-        nStart = self.nStart.value()
-        nStop = self.nStop.value()
-        nStepsize = self.nStepsize.value()
-        numberOfSteps = ((nStop-nStart)/nStepsize) + 1
-        nPostmove = self.nPostmove.value()
-        timeConstant = self.lia.getTimeConstant()
-        estimatedStageMovement = 0.2
-        estimatedLockinVoltageRead = 0.2
-
-        totalTime = numberOfSteps * (estimatedStageMovement + nPostmove*timeConstant + estimatedLockinVoltageRead)
-
-        return totalTime
-
-    def interruptable_sleep(self, wait_time):
-        i = 0
-        while not self.StopRunFlag and i < int(wait_time*100):
-            time.sleep(0.01)
-            i += 1
-
-    def reset_data_array(self):
-        self.dataX = np.array([])
-        self.dataY = np.array([])
-        self.dataStep = np.array([])
-
-    def save_data_array(self):
-        # The filename expression will be yyyymmdd-hr-mn-ss.dat
-        prefix_string = self.fileprefix.text()
-        working_directory = os.path.join(os.getcwd(), '..', 'data/')
-        
-        # Create the data directory if it does not exist
-        if not os.path.exists(working_directory):
-            os.makedirs(working_directory)
-
-        datetime_string = time.strftime('%Y%m%d-%H-%M-%S')
-        
-        # File for the main data
-        data_fname = working_directory + datetime_string + prefix_string + '_data.csv'
-        
-        # File for the parameters
-        params_fname = working_directory + datetime_string + prefix_string + '_params.csv'
-
-        if self.SaveAllFlag:
-            # Save the main data
-            print('Saving data to ' + data_fname)
-            df = pd.DataFrame(np.array([self.dataX, self.dataY]).T, columns=['stagePos', 'voltage'])
-            df.to_csv(data_fname, index=False)
-            
-            # Save the parameters in a separate file
-            print('Saving parameters to ' + params_fname)
-            with open(params_fname, 'w') as f:
-                f.write('stageStart, stageStop, stageStepSize, timeConstant, sensitivity, postStepPause, sampleAverage\n')
-                f.write(f"{self.nStart.value()}, {self.nStop.value()}, {self.nStepsize.value()}, {self.lia.getTimeConstant()}, {self.lia.getSensitivity()}, {self.nPostmove.value()}, {self.nAvg.value()}\n")
+        return estimate_scan_time(self.scan_recipe(), self.timeConstant, self.phaseTimer)
+
+    def reset_data_array(self, length_of_scan):
+        self.scanBuffer.reset(length_of_scan)
+
+    def save_data_array(self, result=None):
+        if not self.SaveAllFlag:
+            return
+        if result is None:
+            # Save what has arrived in the GUI so far.
+            result = ScanResult(self.recipe, self.scanBuffer, self.timeConstant, self.sensitivity, True)
+        with self.phaseTimer.phase('save'):
+            save_scan(result)
 
 
     # Define plotting and plot update functions
     def generate_plot(self):
         self.figure.clear()  # Clear the figure to ensure it's completely reset
-        self.ax = self.figure.add_subplot(111)  # Recreate the axes
+        # Trace on the left, amplitude and phase spectrum stacked on the right, then the peak map
+        # of a raster image
+        columns = 2 if self.imageRecipe is None else 3
+        grid = self.figure.add_gridspec(2, columns, width_ratios=(3, 2, 2)[:columns])
+        self.ax = self.figure.add_subplot(grid[:, 0])  # Recreate the axes
 
         # Set axis labels
         self.ax.set_xlabel("Stage Position", fontsize=12)  # Set X-axis label
@@ -283,40 +398,107 @@ class LightUIWindow(QMainWindow):
 
         # Plot the initial data
         self.lineX, = self.ax.plot(
-            self.dataX, self.dataY, 'r-')  # Adjust as needed
+            self.scanBuffer.positions, self.scanBuffer.values, 'r-')  # Adjust as needed
+
+        # Shaded one standard error band around the running mean of repeated scans
+        self.errorBand = None
+        if self.repeatAverage is not None:
+            from matplotlib.patches import Polygon
+            self.errorBand = Polygon(np.zeros((1, 2)), closed=True, color='r', alpha=0.25, linewidth=0)
+            self.ax.add_patch(self.errorBand)
+
+        self.generate_spectrum_plot(grid)
+        if self.imageRecipe is not None:
+            self.generate_image_plot(grid)
+        else:
+            self.peakImage.detach()
 
         # Refresh canvas
-        self.canvas.draw()
+        self.livePlot.attach(self.ax, self.lineX, self.errorBand)
+        self.amplitudePlot.attach(self.axAmplitude, self.lineAmplitude)
+        self.phasePlot.attach(self.axPhase, self.linePhase)
+
+    def generate_spectrum_plot(self, grid):
+        self.axAmplitude = self.figure.add_subplot(grid[0, 1])
+        self.axPhase = self.figure.add_subplot(grid[1, 1], sharex=self.axAmplitude)
+        self.axAmplitude.set_ylabel("Amplitude (dB)", fontsize=12)
+        self.axPhase.set_ylabel("Phase (rad)", fontsize=12)
+        self.axPhase.set_xlabel("Frequency (THz)", fontsize=12)
+        for ax in (self.axAmplitude, self.axPhase):
+            ax.tick_params(axis='both', which='major', labelsize=8)
+
+        nyquist = 1 / (2 * stage_delay_step(self.recipe.stepsize))
+        self.axAmplitude.set_xlim(0, min(nyquist, MAX_FREQUENCY))
+        self.axAmplitude.set_ylim(-60, 0)
+        self.axPhase.set_ylim(-np.pi, np.pi)
+        self.lineAmplitude, = self.axAmplitude.plot([], [], 'b-')
+        self.linePhase, = self.axPhase.plot([], [], 'g-')
+        self.traceChanged = False
+
+    def generate_image_plot(self, grid):
+        self.axImage = self.figure.add_subplot(grid[:, 2])
+        self.axImage.set_xlabel("x (μm)", fontsize=12)
+        self.axImage.set_ylabel("y (μm)", fontsize=12)
+        self.axImage.tick_params(axis='both', which='major', labelsize=8)
+        x, y = self.imageRecipe.x_positions(), self.imageRecipe.y_positions()
+        dx = (x[-1] - x[0]) / max(len(x) - 1, 1) or 1
+        dy = (y[-1] - y[0]) / max(len(y) - 1, 1) or 1
+        # Rows of the peak map are y, pixel centers on the raster positions.
+        image = self.axImage.imshow(self.peakMap.T, origin='lower', interpolation='nearest', aspect='equal',
+                                    extent=(x[0] - dx / 2, x[-1] + dx / 2, y[0] - dy / 2, y[-1] + dy / 2))
+        self.peakImage.attach(self.axImage, image)
 
     def update_plot(self):
-        # Dynamically adjust the x-axis limits based on the current data range.
-        # This could start from your initial point and extend to the last point collected.
-        if len(self.dataX) > 1:  # Ensure there are at least two points to define a range
-            current_min_x = min(self.dataX)
-            current_max_x = max(self.dataX)
-            self.ax.set_xlim(current_min_x, current_max_x)
-        else:
-            # Optional: Set a default or initial range for the x-axis if you prefer
-            self.ax.set_xlim(self.nStart.value(),
-                             self.nStart.value() + self.nStepsize.value())
-
-        # Dynamically adjust Y-axis limits based on data
-        if len(self.dataY) > 0:  # Ensure there's at least one point
-            self.ax.set_ylim(min(self.dataY), max(self.dataY))
-        else:
-            # Optional: Set a default or initial range for the y-axis if you prefer
-            self.ax.set_ylim(self.voltage_min, self.voltage_max)
-
-        # Update the data for the line plot
-        self.lineX.set_data(self.dataX, self.dataY)
-
-        # Necessary to recompute the graph limits after updating the data
-        self.ax.relim()
-        self.ax.autoscale_view(True, True, True)
-
-        # Refresh canvas
-        self.canvas.draw()
-        self.canvas.flush_events()
+        # Only hands the new views to the live plot, drawing happens on its own frame timer.
+        if self.repeatAverage is not None:
+            # The mean and band are worked out over the whole grid, once per drawn frame.
+            self.livePlot.set_view(self.repeat_view)
+            self.traceChanged = True
+            return
+        buffer = self.scanBuffer
+        positions, values = buffer.positions, buffer.values
+        if self.recipe.mode == 'refine':
+            # Refinement passes arrive out of order.
+            order = np.argsort(positions, kind='stable')
+            positions, values = positions[order], values[order]
+        self.livePlot.set_data(positions, values,
+                               (buffer.position_min, buffer.position_max, buffer.value_min, buffer.value_max))
+        self.traceChanged = True
+
+    def repeat_view(self):
+        average = self.repeatAverage
+        measured = average.count > 0
+        lower, upper = average.band()
+        return self.repeatGrid[measured], average.mean[measured], (lower[measured], upper[measured])
+
+    def update_spectrum(self):
+        # Sends the latest trace to the spectrum worker, unless it is still busy with the last one.
+        if self.spectrumBusy or not self.traceChanged or self.livePlot.x is None:
+            return
+        self.traceChanged = False
+        self.spectrumBusy = True
+        # Copies, the buffer keeps growing while the worker reads them.
+        n_fft = fft_length(self.recipe.length_of_scan())
+        self.requestSpectrum.emit((np.array(self.livePlot.x), np.array(self.livePlot.y),
+                                   self.recipe.stepsize, n_fft))
+
+    def on_spectrum_ready(self, spectrum):
+        self.spectrumBusy = False
+        if spectrum is None:
+            return
+        frequencies, amplitude, phase = spectrum
+        self.amplitudePlot.set_data(frequencies, amplitude)
+        self.phasePlot.set_data(frequencies, phase)
+
+    def closeEvent(self, event):
+        self.cancel_token.cancel()
+        self.spectrumTimer.stop()
+        # Runs once a cancelled scan has returned.
+        self.requestClose.emit()
+        for thread in (self.acquisition_thread, self.spectrum_thread):
+            thread.quit()
+            thread.wait()
+        super(LightUIWindow, self).closeEvent(event)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+import numpy as np
+
+LIVE_PLOT_FPS = 20
+MAX_DRAWN_POINTS = 4000
+AXIS_MARGIN = 0.05
+
+
+def minmax_decimate(x, y, n_out):
+    # Keep the min and max of each bin, in index order, so peaks survive decimation.
+    n = len(y)
+    if n <= n_out:
+        return x, y
+    n_bins = max(n_out // 2, 1)
+    bin_size = n // n_bins
+    m = n_bins * bin_size
+
+    binned = y[:m].reshape(n_bins, bin_size)
+    imin = binned.argmin(axis=1)
+    imax = binned.argmax(axis=1)
+    offsets = np.arange(n_bins) * bin_size
+    idx = np.column_stack((np.minimum(imin, imax) + offsets, np.maximum(imin, imax) + offsets)).ravel()
+    idx = np.concatenate((idx, np.arange(m, n)))
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets downsampling. Keeps the visual shape with n_out points.
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    idx = np.empty(n_out, dtype=int)
+    idx[0] = 0
+    idx[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        avg_y = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+
+        bucket_x = x[start:stop]
+        bucket_y = y[start:stop]
+        area = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+DECIMATORS = {
+    'minmax': minmax_decimate,
+    'lttb': lttb,
+}
+
+
+def expand_limits(lower, upper, data_min, data_max, margin=AXIS_MARGIN):
+    # Returns new limits only if the data left the current ones, otherwise None.
+    if data_min >= lower and data_max <= upper:
+        return None
+    span = max(data_max, upper) - min(data_min, lower)
+    if span == 0:
+        span = abs(data_max) if data_max != 0 else 1.0
+    pad = span * margin
+    new_lower = lower if data_min >= lower else data_min - pad
+    new_upper = upper if data_max <= upper else data_max + pad
+    return new_lower, new_upper
+
+
+class LivePlot:
+    # Blits only the trace line and redraws at most LIVE_PLOT_FPS times per second.
+    # set_data is cheap and may be called for every point; drawing happens on the timer.
+    def __init__(self, canvas, fps=LIVE_PLOT_FPS, max_points=MAX_DRAWN_POINTS, decimation='minmax',
+                 phase_timer=None):
+        self.canvas = canvas
+        self.phase_timer = phase_timer
+        self.max_points = max_points
+        self.decimate = DECIMATORS[decimation]
+        self.ax = None
+        self.line = None
+        self.background = None
+        self.dirty = False
+        self.x = None
+        self.y = None
+        self.bounds = None
+        self.y_fitted = False
+        # Optional shaded error band, a Polygon redrawn with the line.
+        self.band = None
+        self.band_data = None
+        self.view = None
+
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.timer = self.canvas.new_timer(interval=int(1000 / fps))
+        self.timer.add_callback(self.redraw)
+        self.timer.start()
+
+    def attach(self, ax, line, band=None):
+        self.ax = ax
+        self.line = line
+        self.line.set_animated(True)
+        self.band = band
+        self.band_data = None
+        if band is not None:
+            band.set_animated(True)
+        self.background = None
+        self.dirty = False
+        # The initial y limits are a placeholder, the first data replaces them.
+        self.y_fitted = False
+        self.canvas.draw()
+
+    def set_data(self, x, y, bounds=None, band=None):
+        # bounds is (x_min, x_max, y_min, y_max) if the caller tracks it, saves a pass over the data.
+        # band is (lower, upper), same length as x.
+        self.x = x
+        self.y = y
+        self.bounds = bounds
+        self.band_data = band
+        self.view = None
+        self.dirty = True
+
+    def set_view(self, view):
+        # view() returns (x, y, band) and is only called when a frame is drawn, for data that
+        # takes a pass over the whole trace to prepare, like the mean and band of repeated scans.
+        self.view = view
+        self.dirty = True
+
+    def draw_artists(self):
+        if self.band is not None:
+            self.ax.draw_artist(self.band)
+        self.ax.draw_artist(self.line)
+
+    def on_draw(self, event):
+        # Every full draw (resize, rescale, toolbar zoom) refreshes the cached background.
+        if self.ax is None:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
+
+    def rescale(self):
+        if self.bounds is None:
+            x_min, x_max = np.min(self.x), np.max(self.x)
+            y_min, y_max = np.min(self.y), np.max(self.y)
+        else:
+            x_min, x_max, y_min, y_max = self.bounds
+        if self.band_data is not None:
+            lower, upper = self.band_data
+            y_min = min(y_min, np.nanmin(lower))
+            y_max = max(y_max, np.nanmax(upper))
+
+        rescaled = False
+        new_xlim = expand_limits(*self.ax.get_xlim(), x_min, x_max)
+        if new_xlim is not None:
+            self.ax.set_xlim(*new_xlim)
+            rescaled = True
+        if self.y_fitted:
+            new_ylim = expand_limits(*self.ax.get_ylim(), y_min, y_max)
+        else:
+            pad = (y_max - y_min) * AXIS_MARGIN or abs(y_min) * AXIS_MARGIN or 1.0
+            new_ylim = (y_min - pad, y_max + pad)
+            self.y_fitted = True
+        if new_ylim is not None:
+            self.ax.set_ylim(*new_ylim)
+            rescaled = True
+        return rescaled
+
+    def redraw(self):
+        if not self.dirty or self.ax is None:
+            return
+        self.dirty = False
+        if self.view is not None:
+            self.x, self.y, self.band_data = self.view()
+            self.bounds = None
+        if self.phase_timer is None:
+            self.draw_frame()
+        else:
+            with self.phase_timer.phase('plot'):
+                self.draw_frame()
+
+    def draw_frame(self):
+        x, y = self.x, self.y
+        if len(y) > self.max_points:
+            x, y = self.decimate(x, y, self.max_points)
+        self.line.set_data(x, y)
+        if self.band is not None and self.band_data is not None:
+            self.update_band()
+
+        if len(self.y) == 0:
+            return
+        if self.rescale() or self.background is None:
+            # Limits changed, the cached background is stale.
+            self.canvas.draw()
+            return
+
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
+    def update_band(self):
+        x = self.x
+        lower, upper = self.band_data
+        if len(x) > self.max_points:
+            keep = np.linspace(0, len(x) - 1, self.max_points).astype(int)
+            x, lower, upper = x[keep], lower[keep], upper[keep]
+        if len(x) == 0:
+            self.band.set_xy(np.zeros((1, 2)))
+            return
+        self.band.set_xy(np.concatenate((np.column_stack((x, lower)), np.column_stack((x[::-1], upper[::-1])))))
+
+
+class LiveImage:
+    # Blits an image (the peak map of a raster scan) at most fps times per second. set_data
+    # only marks it stale, pixels come in much faster than it is worth drawing them.
+    def __init__(self, canvas, fps=4):
+        self.canvas = canvas
+        self.ax = None
+        self.image = None
+        self.background = None
+        self.data = None
+        self.dirty = False
+
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.timer = self.canvas.new_timer(interval=int(1000 / fps))
+        self.timer.add_callback(self.redraw)
+        self.timer.start()
+
+    def attach(self, ax, image):
+        self.ax = ax
+        self.image = image
+        self.image.set_animated(True)
+        self.background = None
+        self.dirty = False
+        self.canvas.draw()
+
+    def detach(self):
+        self.ax = None
+        self.image = None
+
+    def set_data(self, data):
+        self.data = data
+        self.dirty = True
+
+    def on_draw(self, event):
+        if self.ax is None:
+            return
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.image)
+
+    def redraw(self):
+        if not self.dirty or self.ax is None:
+            return
+        self.dirty = False
+        data = self.data
+        self.image.set_data(data)
+        finite = data[np.isfinite(data)]
+        if len(finite):
+            low, high = finite.min(), finite.max()
+            self.image.set_clim(low, high if high > low else low + 1)
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        self.canvas.blit(self.ax.bbox)
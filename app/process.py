@@ -0,0 +1,50 @@
+import argparse
+import sys
+import time
+import config
+from scan.processing import ProcessingCache, ProcessingRecipe, process_scans, save_result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Spectra, transmission, n and alpha of saved scans.')
+    parser.add_argument('samples', nargs='+', help='sample _data.csv files')
+    parser.add_argument('--reference', nargs='+', default=[], help='reference _data.csv files, averaged')
+    parser.add_argument('--thickness', type=float, default=None, help='sample thickness (um), for n and alpha')
+    parser.add_argument('--grid', type=float, nargs=3, default=(None, None, None), metavar=('START', 'STOP', 'STEP'),
+                        help='common delay grid (um), defaults to the range all scans cover')
+    parser.add_argument('--baseline', type=int, default=10, help='leading points subtracted as the baseline')
+    parser.add_argument('--window', choices=['hann', 'blackman', 'none'], default='hann')
+    parser.add_argument('--pad', type=int, default=ProcessingRecipe.padFactor, help='zero padding factor')
+    parser.add_argument('--max-frequency', type=float, default=ProcessingRecipe.maxFrequency, help='THz')
+    parser.add_argument('--workers', type=int, default=None, help='processes, defaults to one per CPU')
+    parser.add_argument('--cache', default=config.PROCESSING_CACHE_DIR, help='cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='recompute everything, write nothing to the cache')
+    parser.add_argument('-o', '--output', default=None, help='output CSV, defaults to <first sample>_processed.csv')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    recipe = ProcessingRecipe(*args.grid, baselinePoints=args.baseline, window=args.window, padFactor=args.pad,
+                              maxFrequency=args.max_frequency, thickness=args.thickness)
+    cache = None if args.no_cache else ProcessingCache(args.cache)
+
+    started = time.perf_counter()
+    try:
+        result = process_scans(args.samples, args.reference, recipe, cache, args.workers)
+    except (OSError, ValueError, KeyError) as e:
+        print('Error: ' + str(e))
+        return 1
+    print('Processed %d scans in %.2f s' % (len(args.samples) + len(args.reference), time.perf_counter() - started))
+    if cache is not None:
+        print('Cache: %d files from the cache, %d read' % (cache.hits, cache.misses))
+    if args.reference and args.thickness is None:
+        print('No --thickness given, n and alpha are not computed')
+
+    output = args.output or args.samples[0][:-len('_data.csv')] + '_processed.csv'
+    save_result(result, output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
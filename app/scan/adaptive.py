@@ -0,0 +1,78 @@
+import math
+import numpy as np
+from time import monotonic
+
+ADAPTIVE_COLUMNS = ('dwellTime', 'sampleCount', 'standardError')
+# Settled once the drift is within this many standard deviations of a single reading.
+SETTLE_NOISE_FACTOR = 3
+
+
+def settle(lia, time_constant, tolerance, max_wait, cancel_token):
+    # Wait for the lock-in output to settle after a move. Between two readings interval
+    # apart the output of a first-order filter moves by residual * (1 - exp(-interval / tc)),
+    # so the drift between consecutive readings gives the residual settling error.
+    # Stops once that is below tolerance, or after max_wait. Returns True if cancelled.
+    # Without a tolerance it just waits max_wait.
+    if time_constant <= 0 or max_wait <= 0:
+        return cancel_token.is_cancelled()
+    if tolerance is None:
+        return cancel_token.sleep(max_wait)
+
+    interval = time_constant
+    decay = 1 - math.exp(-interval / time_constant)
+    start = monotonic()
+    previous = lia.measure()
+    while True:
+        if cancel_token.sleep(min(interval, max(max_wait - (monotonic() - start), 0))):
+            return True
+        reading = lia.measure()
+        residual = abs(reading - previous) / decay
+        if residual <= tolerance or monotonic() - start >= max_wait:
+            return False
+        previous = reading
+
+
+def average(lia, target_error, min_samples, max_samples, batch=None, read=None):
+    # Reads in batches until the standard error of the mean is below target_error,
+    # with at least min_samples and at most max_samples. Returns (mean, count, error).
+    # A target_error of None always takes max_samples.
+    # read(count) replaces lia.measureBuffered, e.g. to keep the other channels of each sample.
+    # Samples taken faster than the time constant are correlated, so the error is optimistic there.
+    min_samples = max(int(min_samples), 2)
+    max_samples = max(int(max_samples), min_samples)
+    batch = int(batch) if batch else min_samples
+    read = read or lia.measureBuffered
+
+    total = 0.0
+    total_squares = 0.0
+    count = 0
+    error = np.inf
+    shift = None
+    while count < max_samples:
+        samples = np.asarray(read(min(batch if count else min_samples, max_samples - count)), dtype=float)
+        if shift is None:
+            # Sums are taken around the first sample, keeps the variance exact for a small
+            # noise on a large signal.
+            shift = samples[0]
+        samples = samples - shift
+        total += samples.sum()
+        total_squares += np.dot(samples, samples)
+        count += len(samples)
+
+        mean = total / count
+        variance = max(total_squares / count - mean ** 2, 0.0) * count / (count - 1)
+        error = math.sqrt(variance / count)
+        if count >= min_samples and target_error is not None and error <= target_error:
+            break
+    return shift + total / count, count, error
+
+
+def settle_tolerance(recipe, reading_noise):
+    # An explicit settleTolerance, or else a few times the noise of one reading as measured at
+    # the last point, never below targetError. The drift between single readings cannot get
+    # below their noise, so comparing it with the error of the mean would never pass.
+    if recipe.settleTolerance is not None:
+        return recipe.settleTolerance
+    if reading_noise is None:
+        return None
+    return max(SETTLE_NOISE_FACTOR * reading_noise, recipe.targetError or 0.0)
@@ -0,0 +1,49 @@
+import numpy as np
+
+REPEAT_COLUMNS = ('repeatCount', 'repeatStd')
+
+
+class RunningAverage:
+    # Per-point running mean and variance over repeated passes (Welford), O(points) memory
+    # however many repeats are folded in. mean is updated in place and can be plotted as is.
+    def __init__(self, length):
+        self.count = np.zeros(length, dtype=int)
+        self.mean = np.full(length, np.nan)
+        self.m2 = np.zeros(length)
+
+    def __len__(self):
+        return len(self.count)
+
+    def update(self, index, value):
+        # index may be a scalar or an array of distinct indices.
+        self.count[index] += 1
+        count = self.count[index]
+        previous = np.where(count == 1, 0.0, self.mean[index])
+        delta = value - previous
+        self.mean[index] = previous + delta / count
+        self.m2[index] += delta * (value - self.mean[index])
+
+    def variance(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), 0.0)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def standard_error(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.std() / np.sqrt(np.maximum(self.count, 1)), np.nan)
+
+    def band(self):
+        # (lower, upper) one standard error around the mean, for the live plot.
+        error = self.standard_error()
+        return self.mean - error, self.mean + error
+
+
+def average_passes(positions, values):
+    # Folds rows of several passes (e.g. read back from a stream file) into one averaged trace.
+    grid, index = np.unique(positions, return_inverse=True)
+    average = RunningAverage(len(grid))
+    for i, value in zip(index, values):
+        average.update(i, value)
+    return grid, average
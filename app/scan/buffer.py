@@ -0,0 +1,82 @@
+import numpy as np
+
+POSITION = 0
+VALUE = 1
+TIMESTAMP = 2
+
+
+class ScanBuffer:
+    # Preallocated storage for one scan. Columns are position, value and timestamp, followed
+    # by any extra per-point columns (e.g. dwell time) named in extra_columns.
+    # Fortran order keeps every column contiguous, so the views handed out below are zero-copy.
+    def __init__(self, capacity, extra_columns=()):
+        self.extra_columns = tuple(extra_columns)
+        self.reset(capacity)
+
+    def reset(self, capacity=None):
+        if capacity is not None:
+            self._data = np.empty((max(int(capacity), 1), 3 + len(self.extra_columns)), order='F')
+        self.length = 0
+        self.position_min = np.inf
+        self.position_max = -np.inf
+        self.value_min = np.inf
+        self.value_max = -np.inf
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    def __len__(self):
+        return self.length
+
+    def append(self, position, value, timestamp=np.nan, *extra):
+        if self.length == self.capacity:
+            # Rounding in length_of_scan can leave us one short, grow instead of failing.
+            self._grow(2 * self.capacity)
+
+        row = self._data[self.length]
+        row[POSITION] = position
+        row[VALUE] = value
+        row[TIMESTAMP] = timestamp
+        if extra:
+            row[3:3 + len(extra)] = extra
+        self.length += 1
+
+        if position < self.position_min:
+            self.position_min = position
+        if position > self.position_max:
+            self.position_max = position
+        if value < self.value_min:
+            self.value_min = value
+        if value > self.value_max:
+            self.value_max = value
+
+    def _grow(self, capacity):
+        data = np.empty((capacity, self._data.shape[1]), order='F')
+        data[:self.length] = self._data[:self.length]
+        self._data = data
+
+    @property
+    def positions(self):
+        return self._data[:self.length, POSITION]
+
+    @property
+    def values(self):
+        return self._data[:self.length, VALUE]
+
+    @property
+    def timestamps(self):
+        return self._data[:self.length, TIMESTAMP]
+
+    def column(self, name):
+        return self._data[:self.length, 3 + self.extra_columns.index(name)]
+
+    def records(self):
+        # Copy of the filled rows as a structured array, one named field per column.
+        names = ('position', 'value', 'timestamp') + self.extra_columns
+        return np.rec.fromarrays([self._data[:self.length, i] for i in range(len(names))], names=names)
+
+    @property
+    def data(self):
+        # (length, columns) view of the filled rows.
+        return self._data[:self.length]
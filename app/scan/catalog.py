@@ -0,0 +1,266 @@
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+import numpy as np
+from scan.writer import FILE_EXTENSION, load_stream
+
+CATALOG_FILENAME = 'catalog.sqlite'
+# <yyyymmdd-hr-mn-ss><prefix>[_job<id>]_data.csv, see scan_basename and run_queue.
+DATA_FILENAME = re.compile(r'^(\d{8}-\d{2}-\d{2}-\d{2})(.*?)(?:_job\d+)?_data\.csv$')
+
+# Parameter columns of the catalog, keyed by their name in the _params.csv file.
+PARAM_COLUMNS = {
+    'stageStart': 'start',
+    'stageStop': 'stop',
+    'stageStepSize': 'stepsize',
+    'timeConstant': 'timeConstant',
+    'sensitivity': 'sensitivity',
+    'postStepPause': 'nPostmove',
+    'sampleAverage': 'nAvg',
+    'repeats': 'repeats',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    dataPath TEXT PRIMARY KEY,
+    paramsPath TEXT,
+    streamPath TEXT,
+    saved TEXT,
+    prefix TEXT,
+    start REAL,
+    stop REAL,
+    stepsize REAL,
+    timeConstant REAL,
+    sensitivity REAL,
+    nPostmove REAL,
+    nAvg INTEGER,
+    repeats INTEGER,
+    channels TEXT,
+    points INTEGER,
+    peakPosition REAL,
+    peakAmplitude REAL,
+    duration REAL,
+    modified REAL
+);
+CREATE INDEX IF NOT EXISTS scansByTimeConstant ON scans (timeConstant);
+CREATE INDEX IF NOT EXISTS scansByPrefix ON scans (prefix);
+CREATE INDEX IF NOT EXISTS scansBySaved ON scans (saved);
+"""
+
+
+def catalog_path(working_directory):
+    return os.path.join(working_directory, CATALOG_FILENAME)
+
+
+def read_params(params_fname):
+    # The params file is pairs of lines, comma separated names and their values.
+    with open(params_fname) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    params = {}
+    for names, values in zip(lines[0::2], lines[1::2]):
+        names = [name.strip() for name in names.split(',')]
+        values = [value.strip() for value in values.split(',')] if len(names) > 1 else [values]
+        for name, value in zip(names, values):
+            try:
+                params[name] = float(value)
+            except ValueError:
+                params[name] = value
+    return params
+
+
+def trace_summary(positions, values, timestamps=None):
+    # Point count, position and value of the largest excursion, and the time the scan took.
+    summary = {'points': len(values), 'peakPosition': None, 'peakAmplitude': None, 'duration': None}
+    finite = np.isfinite(values)
+    if finite.any():
+        peak = np.flatnonzero(finite)[np.argmax(np.abs(values[finite]))]
+        summary['peakPosition'] = float(positions[peak])
+        summary['peakAmplitude'] = float(values[peak])
+    if timestamps is not None:
+        timestamps = timestamps[np.isfinite(timestamps)]
+        if len(timestamps):
+            summary['duration'] = float(timestamps.max() - timestamps.min())
+    return summary
+
+
+class ScanCatalog:
+    # SQLite index of the saved scans in one data directory. Only parameters, paths and a
+    # summary of each trace are stored, the CSV files stay the data. It can always be rebuilt
+    # from them, so losing or deleting the catalog file loses nothing.
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, data_fname, params_fname, params, positions, values, timestamps=None, channels=()):
+        name = os.path.basename(data_fname)
+        match = DATA_FILENAME.match(name)
+        saved, prefix = (None, None)
+        if match is not None:
+            saved = time.strftime('%Y-%m-%dT%H:%M:%S', time.strptime(match.group(1), '%Y%m%d-%H-%M-%S'))
+            prefix = match.group(2)
+        stream_fname = data_fname[:-len('.csv')] + FILE_EXTENSION
+        row = {
+            'dataPath': os.path.abspath(data_fname),
+            'paramsPath': os.path.abspath(params_fname),
+            'streamPath': os.path.abspath(stream_fname) if os.path.exists(stream_fname) else None,
+            'saved': saved,
+            'prefix': prefix,
+            'channels': ' '.join(channels) or None,
+            'modified': os.path.getmtime(data_fname),
+        }
+        for name, column in PARAM_COLUMNS.items():
+            row[column] = params.get(name)
+        row['repeats'] = int(row['repeats'] or 1)
+        row.update(trace_summary(np.asarray(positions), np.asarray(values),
+                                 None if timestamps is None else np.asarray(timestamps)))
+
+        connection = self.connect()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO scans (%s) VALUES (%s)' % (
+                ', '.join(row), ', '.join(':' + name for name in row)), row)
+
+    def add_result(self, result, data_fname, params_fname):
+        # Called right after write_csv, the numbers are still in memory.
+        recipe = result.recipe
+        params = {
+            'stageStart': recipe.start, 'stageStop': recipe.stop, 'stageStepSize': recipe.stepsize,
+            'timeConstant': result.timeConstant, 'sensitivity': result.sensitivity,
+            'postStepPause': recipe.nPostmove, 'sampleAverage': recipe.nAvg, 'repeats': recipe.repeats,
+        }
+        buffer = result.buffer
+        self.add(data_fname, params_fname, params, buffer.positions, buffer.values, buffer.timestamps,
+                 recipe.channels)
+
+    def add_files(self, data_fname, params_fname):
+        data = np.loadtxt(data_fname, delimiter=',', skiprows=1, ndmin=2)
+        params = read_params(params_fname)
+        channels = tuple(str(params.get('channels', '')).split())
+        # CSVs have no timestamps, a stream file next to them does.
+        timestamps = None
+        stream_fname = data_fname[:-len('.csv')] + FILE_EXTENSION
+        if os.path.exists(stream_fname):
+            timestamps = load_stream(stream_fname).column('timestamp')
+        self.add(data_fname, params_fname, params, data[:, 0], data[:, 1], timestamps, channels)
+
+    def rebuild(self, working_directory):
+        # Starts over from the files in working_directory. Returns the number of scans indexed.
+        connection = self.connect()
+        with connection:
+            connection.execute('DELETE FROM scans')
+        return self.update(working_directory)
+
+    def update(self, working_directory):
+        # Indexes scans that are new or changed since they were last indexed.
+        connection = self.connect()
+        known = {row['dataPath']: row['modified'] for row in connection.execute('SELECT dataPath, modified FROM scans')}
+        count = 0
+        for data_fname in sorted(glob.glob(os.path.join(working_directory, '*_data.csv'))):
+            params_fname = data_fname[:-len('_data.csv')] + '_params.csv'
+            path = os.path.abspath(data_fname)
+            if not os.path.exists(params_fname) or known.get(path) == os.path.getmtime(data_fname):
+                continue
+            try:
+                self.add_files(data_fname, params_fname)
+                count += 1
+            except (OSError, ValueError, IndexError) as e:
+                print('Skipping ' + data_fname + ': ' + str(e))
+        return count
+
+    def find(self, prefix=None, timeConstant=None, since=None, until=None, where=None, parameters=()):
+        # Rows matching all given filters, oldest first. prefix matches the start of the prefix,
+        # since/until compare against the save time (ISO, e.g. '2024-05-01'). where is extra SQL.
+        clauses, values = [], []
+        if prefix is not None:
+            clauses.append("prefix LIKE ? ESCAPE '\\'")
+            values.append(prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if timeConstant is not None:
+            # Stored as parsed from text, compare with a tolerance.
+            clauses.append('abs(timeConstant - ?) <= 1e-9 * abs(?)')
+            values += [timeConstant, timeConstant]
+        if since is not None:
+            clauses.append('saved >= ?')
+            values.append(since)
+        if until is not None:
+            clauses.append('saved < ?')
+            values.append(until)
+        if where is not None:
+            clauses.append('(' + where + ')')
+            values += list(parameters)
+        query = 'SELECT * FROM scans'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        return self.connect().execute(query + ' ORDER BY saved, dataPath', values).fetchall()
+
+
+def index_scan(result, data_fname, params_fname):
+    # Keeps the catalog of the data directory current after a save. The CSV pair is already
+    # on disk, so a catalog problem only costs a rebuild later, never the data.
+    try:
+        with ScanCatalog(catalog_path(os.path.dirname(os.path.abspath(data_fname)))) as catalog:
+            catalog.add_result(result, data_fname, params_fname)
+    except sqlite3.Error as e:
+        print('Scan catalog not updated: ' + str(e))
+
+
+def read_trace(row):
+    # Position and value columns of one catalog row. Stream files are memory-mapped and only
+    # pages that are used get read, the CSV is parsed otherwise.
+    if row['streamPath'] is not None and os.path.exists(row['streamPath']):
+        scan = load_stream(row['streamPath'])
+        # Only step scans stream the saved points as they are, fly and repeated scans are
+        # gridded and averaged into the CSV.
+        recipe = scan.header['recipe']
+        if recipe['mode'] == 'step' and recipe.get('repeats', 1) == 1 and len(scan) == row['points']:
+            return scan.data[:, 0], scan.data[:, 1]
+    data = np.loadtxt(row['dataPath'], delimiter=',', skiprows=1, usecols=(0, 1), ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def load_traces(rows, path=None):
+    # Stacks the traces of the given catalog rows into one (2, scans, points) array, positions
+    # then values, shorter traces padded with NaN. With a path the stack is a memory-mapped
+    # .npy file there, for selections larger than memory.
+    length = max([row['points'] for row in rows], default=0)
+    shape = (2, len(rows), length)
+    if path is None:
+        stack = np.full(shape, np.nan)
+    else:
+        stack = np.lib.format.open_memmap(path, mode='w+', dtype='<f8', shape=shape)
+        stack[...] = np.nan
+    for i, row in enumerate(rows):
+        positions, values = read_trace(row)
+        stack[0, i, :len(positions)] = positions
+        stack[1, i, :len(values)] = values
+    if path is not None:
+        stack.flush()
+    return stack
+
+
+if __name__ == '__main__':
+    # python -m scan.catalog [directory] rebuilds the catalog of a data directory.
+    from scan.storage import default_data_directory
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else default_data_directory()
+    with ScanCatalog(catalog_path(directory)) as catalog:
+        print('Indexed %d scans' % catalog.rebuild(directory))
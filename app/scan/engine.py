@@ -0,0 +1,398 @@
+import os
+import threading
+import time
+import numpy as np
+from instruments.lockinAmplifier.sr830 import buffer_sample_rate, mean_channels
+from scan import adaptive
+from scan.averaging import REPEAT_COLUMNS, RunningAverage
+from scan.buffer import ScanBuffer
+from scan.fly import fly_velocity, grid_fly_samples
+from scan.refine import REFINE_FACTOR, pass_steps, refinement_positions
+from scan.storage import scan_basename
+from scan.timing import PhaseTimer
+from scan.writer import FILE_EXTENSION, PASS_COLUMN, STANDARD_COLUMNS, StreamingWriter, load_stream
+from tracing import TRACER
+
+
+def channel_columns(recipe):
+    # Extra lock-in outputs of the recipe, R is the value column already.
+    return tuple(channel for channel in recipe.channels if channel != 'R')
+
+
+class CancelToken:
+    # Thread-safe stop flag. GUI thread cancels, acquisition thread polls or waits on it.
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def reset(self):
+        self._event.clear()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def sleep(self, wait_time):
+        # Returns True if cancelled before wait_time has passed.
+        return self._event.wait(wait_time)
+
+
+class ScanResult:
+    def __init__(self, recipe, buffer, timeConstant, sensitivity, stopped, streamPath=None):
+        self.recipe = recipe
+        self.buffer = buffer
+        self.timeConstant = timeConstant
+        self.sensitivity = sensitivity
+        self.stopped = stopped
+        self.streamPath = streamPath
+        # Instrument counters (serial round trips, stage moves, ...) of this scan.
+        self.counters = {}
+
+
+class ScanEngine:
+    # Runs a ScanRecipe on any LockinAmplifierBaseClass/ThorlabsStageBaseClass pair.
+    # Pure Python, no Qt or matplotlib. Front ends observe it through the on_* callbacks.
+    def __init__(self, lia, stage, cancel_token=None, timer=None):
+        self.lia = lia
+        self.stage = stage
+        self.cancel_token = cancel_token if cancel_token is not None else CancelToken()
+        self.timer = timer if timer is not None else PhaseTimer()
+        self.on_point = None    # (index, position, value, timestamp)
+        self.on_status = None   # (message)
+        # Points are streamed to a .lscan file here while the scan runs, None disables it.
+        self.stream_directory = None
+        # A fixed stream file instead of a new one in stream_directory. If it already holds
+        # points, a step scan resumes after the last of them.
+        self.stream_path = None
+        # Seconds between flushes of the stream file, 0 makes every point a checkpoint.
+        self.flush_interval = 1.0
+        self.writer = None
+        # Appended to every buffered row, the pass number in repeated scans.
+        self.row_tail = ()
+        # Start the move to the next point as soon as a point is read, and store and report
+        # the point while the stage travels. Off moves and measures strictly in turn.
+        self.pipelined = True
+        # Standard deviation of one reading at the last adaptive point, for the settle test.
+        self.reading_noise = None
+
+    def status(self, message):
+        if self.on_status is not None:
+            self.on_status(message)
+
+    # run_queue resets the cancel token once for all its jobs.
+    def run(self, recipe, reset_cancel=True):
+        if reset_cancel:
+            self.cancel_token.reset()
+        self.timer.start_scan()
+        self.reading_noise = None
+        counters = TRACER.snapshot()
+        self.status('Starting scan')
+
+        if recipe.timeConstant is not None:
+            self.lia.setTimeConstant(recipe.timeConstant)
+
+        try:
+            if recipe.repeats > 1 and recipe.mode in ('step', 'fly'):
+                result = self.run_repeats(recipe)
+            elif recipe.mode == 'fly':
+                result = self.run_fly(recipe)
+            elif recipe.mode == 'refine':
+                result = self.run_refine(recipe)
+            else:
+                result = self.run_step(recipe)
+        finally:
+            # Also after a failed scan, the next one must not write to this stream.
+            self.row_tail = ()
+            writer, self.writer = self.writer, None
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            result.streamPath = writer.path
+        result.counters = TRACER.since(counters)
+        return result
+
+    def open_stream(self, recipe, buffer, time_constant):
+        if self.stream_path is not None:
+            path = self.stream_path
+        elif self.stream_directory is not None:
+            path = scan_basename(recipe, self.stream_directory) + '_data' + FILE_EXTENSION
+        else:
+            return
+        params = {
+            'recipe': recipe.to_dict(),
+            'timeConstant': time_constant,
+            'sensitivity': self.lia.getSensitivity(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.writer = StreamingWriter(path, STANDARD_COLUMNS + buffer.extra_columns, params,
+                                      flush_interval=self.flush_interval, append=self.stream_path is not None)
+
+    def new_buffer(self, recipe, capacity, extra_columns=()):
+        return ScanBuffer(capacity, (adaptive.ADAPTIVE_COLUMNS if recipe.adaptive else ())
+                          + channel_columns(recipe) + extra_columns)
+
+    def run_step(self, recipe):
+        buffer = self.new_buffer(recipe, recipe.length_of_scan())
+        positions = recipe.positions()
+        done = self.resume_points(recipe, buffer, positions)
+
+        # goto start of scan range, or where an interrupted scan stopped
+        self.stage.move(positions[done] if done < len(positions) else recipe.start)
+
+        time_constant = self.lia.getTimeConstant()
+        self.open_stream(recipe, buffer, time_constant)
+        self.measure_positions(positions[done:], recipe, buffer, time_constant)
+
+        stopped = self.cancel_token.is_cancelled()
+        self.status('Scan stopped' if stopped else 'Scan finished')
+        return ScanResult(recipe, buffer, time_constant, self.lia.getSensitivity(), stopped)
+
+    def resume_points(self, recipe, buffer, positions):
+        # Loads the points an interrupted run left in stream_path. Returns how many there are.
+        if self.stream_path is None or not os.path.exists(self.stream_path):
+            return 0
+        data = load_stream(self.stream_path, mmap=False).data
+        if len(data) > len(positions) or not np.allclose(data[:, 0], positions[:len(data)]):
+            raise ValueError("Scan file " + self.stream_path + " belongs to another scan.")
+        for row in data:
+            buffer.append(*row)
+            self.emit_point(len(buffer) - 1, row[0], row[1], row[2])
+        if len(data):
+            self.status('Resuming at %g after %d points' % (positions[min(len(data), len(positions) - 1)], len(data)))
+        return len(data)
+
+    def run_refine(self, recipe):
+        # Coarse survey first, then passes with smaller steps only where the trace changes
+        # quickly. Points arrive out of order, the result is sorted by position.
+        buffer = self.new_buffer(recipe, recipe.length_of_scan())
+        self.stage.move(recipe.start)
+        time_constant = self.lia.getTimeConstant()
+        self.open_stream(recipe, buffer, time_constant)
+
+        coarse_step = recipe.coarseStep or REFINE_FACTOR ** 2 * recipe.stepsize
+        steps = pass_steps(coarse_step, recipe.stepsize)
+        positions = recipe.positions(steps[0])
+        for number, step in enumerate(steps):
+            self.status('Refine pass %d of %d, %d points at %g um' % (number + 1, len(steps), len(positions), step))
+            if not self.measure_positions(positions, recipe, buffer, time_constant):
+                break
+            if number + 1 < len(steps):
+                positions = refinement_positions(buffer.positions, buffer.values, steps[number + 1],
+                                                 recipe.start, recipe.stepsize, recipe.refineThreshold)
+
+        result = self.new_buffer(recipe, len(buffer))
+        for row in buffer.data[np.argsort(buffer.positions, kind='stable')]:
+            result.append(*row)
+
+        stopped = self.cancel_token.is_cancelled()
+        self.status('Scan stopped' if stopped else 'Scan finished')
+        return ScanResult(recipe, result, time_constant, self.lia.getSensitivity(), stopped)
+
+    def run_repeats(self, recipe):
+        # Every pass folds into a running per-point mean and variance. With serpentine, odd
+        # passes run backwards so the stage does not drive back to the start in between.
+        grid = recipe.positions()
+        average = RunningAverage(len(grid))
+        self.stage.move(recipe.start)
+        time_constant = self.lia.getTimeConstant()
+        last_timestamps = np.full(len(grid), np.nan)
+
+        for number in range(recipe.repeats):
+            self.status('Pass %d of %d' % (number + 1, recipe.repeats))
+            reverse = recipe.serpentine and number % 2 == 1
+            indices = np.arange(len(grid))[::-1] if reverse else np.arange(len(grid))
+            self.row_tail = (number,)
+
+            if recipe.mode == 'fly':
+                values, timestamps, counts = self.fly_pass(recipe, time_constant, reverse, live=False)
+                measured = indices[counts[indices] > 0] if self.cancel_token.is_cancelled() else indices
+                # Fly samples carry no adaptive or channel columns.
+                buffer = ScanBuffer(len(grid), (PASS_COLUMN,))
+                if number == 0:
+                    self.open_stream(recipe, buffer, time_constant)
+                for i in measured:
+                    buffer.append(grid[i], values[i], timestamps[i], number)
+                    if self.writer is not None:
+                        self.writer.append(buffer.data[-1])
+                    self.emit_point(i, grid[i], values[i], timestamps[i])
+                average.update(measured, values[measured])
+            else:
+                buffer = self.new_buffer(recipe, len(grid), (PASS_COLUMN,))
+                if number == 0:
+                    self.open_stream(recipe, buffer, time_constant)
+                self.measure_positions(grid[indices], recipe, buffer, time_constant, indices,
+                                       fold=average)
+                measured = indices[:len(buffer)]
+
+            last_timestamps[measured] = buffer.timestamps
+            if self.cancel_token.is_cancelled():
+                break
+
+        result = ScanBuffer(len(grid), REPEAT_COLUMNS)
+        std = average.std()
+        for i in np.flatnonzero(average.count):
+            result.append(grid[i], average.mean[i], last_timestamps[i], average.count[i], std[i])
+
+        stopped = self.cancel_token.is_cancelled()
+        self.status('Scan stopped' if stopped else 'Scan finished')
+        return ScanResult(recipe, result, time_constant, self.lia.getSensitivity(), stopped)
+
+    def emit_point(self, index, position, value, timestamp):
+        if self.on_point is not None:
+            self.on_point(int(index), float(position), float(value), float(timestamp))
+
+    def measure_positions(self, positions, recipe, buffer, time_constant, indices=None, fold=None):
+        # Step, settle and measure at each position. Returns False if cancelled.
+        # indices are reported to on_point instead of the arrival order, fold gets every value.
+        post_move_wait_time = time_constant * (1 + recipe.nPostmove)
+        if time_constant > 0:
+            # Buffered reads run at the fast default rate unless the recipe asks for independent ones.
+            self.lia.setSampleRate(buffer_sample_rate(time_constant) if recipe.decorrelated else None)
+        positions = [float(position) for position in positions]
+        if self.pipelined and positions:
+            self.stage.startMove(positions[0])
+
+        for k, position in enumerate(positions):
+            if self.cancel_token.is_cancelled():
+                return False
+
+            # Pipelined, only what is left of the travel is waited for here.
+            with self.timer.phase('move'):
+                if self.pipelined:
+                    self.stage.waitForMove()
+                else:
+                    self.stage.move(position)
+
+            point = self.dwell(recipe, time_constant, post_move_wait_time)
+            if point is None:
+                return False
+            if self.pipelined and k + 1 < len(positions):
+                self.start_next_move(position, positions[k + 1], recipe.stepsize)
+            voltageValue = point[0]
+            timestamp = time.time()
+            buffer.append(position, voltageValue, timestamp, *point[1:], *self.row_tail)
+            if self.writer is not None:
+                self.writer.append(buffer.data[-1])
+            self.timer.point_done()
+            index = len(buffer) - 1 if indices is None else indices[len(buffer) - 1]
+            if fold is not None:
+                fold.update(index, voltageValue)
+            self.emit_point(index, position, voltageValue, timestamp)
+        return True
+
+    def start_next_move(self, position, target, stepsize):
+        # One grid step goes out as a relative move, anything else as an absolute one.
+        distance = target - position
+        if abs(abs(distance) - stepsize) < 1e-6:
+            self.stage.startMoveBy(distance)
+        else:
+            self.stage.startMove(target)
+
+    def dwell(self, recipe, time_constant, post_move_wait_time):
+        # Settle and measure one point. Returns (value, *extra columns), or None if cancelled.
+        if not recipe.adaptive:
+            with self.timer.phase('settle'):
+                if self.cancel_token.sleep(post_move_wait_time):
+                    return None
+            with self.timer.phase('measure', recipe.nAvg):
+                if recipe.channels:
+                    return tuple(self.measureChannels(('R',) + channel_columns(recipe), recipe.nAvg))
+                return (self.measureVoltage(recipe.nAvg),)
+
+        # Adaptive: the fixed settle time and nAvg become upper bounds.
+        start = time.perf_counter()
+        with self.timer.phase('settle'):
+            tolerance = adaptive.settle_tolerance(recipe, self.reading_noise)
+            if adaptive.settle(self.lia, time_constant, tolerance, post_move_wait_time, self.cancel_token):
+                return None
+        measure_start = time.perf_counter()
+        names = ('R',) + channel_columns(recipe)
+        batches = []
+
+        def read(count):
+            # All channels of every sample are kept, R decides when to stop.
+            samples = self.lia.measureBufferedChannels(names, count)
+            batches.append(samples)
+            return samples[:, 0]
+
+        value, count, error = adaptive.average(self.lia, recipe.targetError, recipe.minAvg, recipe.nAvg,
+                                               read=read if recipe.channels else None)
+        self.reading_noise = error * np.sqrt(count)
+        now = time.perf_counter()
+        self.timer.record('measure', now - measure_start, count)
+        channels = tuple(mean_channels(names, np.concatenate(batches))[1:]) if recipe.channels else ()
+        return (value, now - start, count, error) + channels
+
+    def run_fly(self, recipe):
+        # The stage sweeps the range at constant velocity while the lock-in is read as fast
+        # as it answers. Samples are put on the recipe grid once the sweep is done.
+        time_constant = self.lia.getTimeConstant()
+        values, timestamps, counts = self.fly_pass(recipe, time_constant)
+
+        grid = recipe.positions()
+        buffer = ScanBuffer(len(grid))
+        covered = counts > 0 if self.cancel_token.is_cancelled() else np.ones(len(grid), dtype=bool)
+        for position, value, timestamp in zip(grid[covered], values[covered], timestamps[covered]):
+            buffer.append(position, value, timestamp)
+
+        # Fly scans are short, the gridded trace is streamed in one go.
+        self.open_stream(recipe, buffer, time_constant)
+        if self.writer is not None:
+            for row in buffer.data:
+                self.writer.append(row)
+
+        stopped = self.cancel_token.is_cancelled()
+        self.status('Scan stopped' if stopped else 'Scan finished')
+        return ScanResult(recipe, buffer, time_constant, self.lia.getSensitivity(), stopped)
+
+    def fly_pass(self, recipe, time_constant, reverse=False, live=True):
+        # One sweep across the range, returns (values, timestamps, counts) on the recipe grid.
+        # live reports every raw sample to on_point as it comes in.
+        velocity = fly_velocity(recipe, time_constant)
+        self.status('Fly scan at %.1f um/s' % velocity)
+
+        poll_times, poll_positions = [], []
+        sample_times, values = [], []
+
+        # Without serpentine, repeated passes and pixels find the stage at the far end.
+        self.stage.move(recipe.stop if reverse else recipe.start)
+        self.stage.sweep(recipe.start if reverse else recipe.stop, velocity)
+        index = 0
+        while not self.cancel_token.is_cancelled():
+            with self.timer.phase('move'):
+                moving = self.stage.isMoving()
+                poll_times.append(time.monotonic())
+                poll_positions.append(self.stage.getPosition())
+
+            with self.timer.phase('measure'):
+                value = self.lia.measure()
+            sample_times.append(time.monotonic())
+            values.append(value)
+            self.timer.point_done()
+            if live:
+                self.emit_point(index, poll_positions[-1], value, time.time())
+            index += 1
+
+            if not moving:
+                break
+
+        if self.cancel_token.is_cancelled():
+            # Do not leave the stage running to the end of the range.
+            self.stage.move(self.stage.getPosition())
+        poll_times.append(time.monotonic())
+        poll_positions.append(self.stage.getPosition())
+
+        values, timestamps, counts = grid_fly_samples(sample_times, values, poll_times, poll_positions,
+                                                      recipe.positions(), lag=time_constant)
+        # Monotonic sample times to wall clock for the saved timestamps.
+        timestamps += time.time() - time.monotonic()
+        return values, timestamps, counts
+
+    def measureChannels(self, channels, nAvg):
+        # nAvg samples of every channel from one buffer fill, averaged per channel.
+        return mean_channels(channels, self.lia.measureBufferedChannels(channels, int(max(nAvg, 1))))
+
+    def measureVoltage(self, nAvg):
+        # One bulk transfer from the lock-in instead of nAvg round trips.
+        return np.mean(self.lia.measureBuffered(nAvg))
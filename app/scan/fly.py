@@ -0,0 +1,52 @@
+import numpy as np
+
+FLY_MAX_VELOCITY = 5000.0  # um/s, same as the 5 mm/s the stage is driven at
+
+
+def fly_velocity(recipe, time_constant):
+    # Default: cross one grid step per settle time of the step scan.
+    if recipe.velocity:
+        return recipe.velocity
+    dwell = time_constant * (1 + recipe.nPostmove)
+    if dwell <= 0:
+        return FLY_MAX_VELOCITY
+    return min(recipe.stepsize / dwell, FLY_MAX_VELOCITY)
+
+
+def grid_fly_samples(sample_times, values, poll_times, poll_positions, grid, lag=0.0):
+    # Lock-in samples are placed on the stage trajectory by interpolating the polled
+    # positions at the sample times. The lock-in output trails the input by about one
+    # time constant, so samples are shifted back by lag before that.
+    sample_times = np.asarray(sample_times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    poll_times = np.asarray(poll_times, dtype=float)
+    poll_positions = np.asarray(poll_positions, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+
+    order = np.argsort(poll_times)
+    sample_positions = np.interp(sample_times - lag, poll_times[order], poll_positions[order])
+
+    # Average all samples within half a step of each grid point. The grid is ascending,
+    # the sweep direction does not matter here.
+    if len(grid) > 1:
+        half_steps = np.diff(grid) / 2
+        edges = np.concatenate(([grid[0] - half_steps[0]], grid[:-1] + half_steps, [grid[-1] + half_steps[-1]]))
+        bins = np.digitize(sample_positions, edges) - 1
+    else:
+        bins = np.zeros(len(sample_positions), dtype=int)
+
+    inside = (bins >= 0) & (bins < len(grid))
+    counts = np.bincount(bins[inside], minlength=len(grid))
+    sums = np.bincount(bins[inside], weights=values[inside], minlength=len(grid))
+    time_sums = np.bincount(bins[inside], weights=sample_times[inside], minlength=len(grid))
+
+    filled = counts > 0
+    gridded = np.full(len(grid), np.nan)
+    timestamps = np.full(len(grid), np.nan)
+    gridded[filled] = sums[filled] / counts[filled]
+    timestamps[filled] = time_sums[filled] / counts[filled]
+
+    # Grid points the stage crossed without a sample are interpolated from their neighbours.
+    if filled.any() and not filled.all():
+        gridded[~filled] = np.interp(grid[~filled], grid[filled], gridded[filled])
+    return gridded, timestamps, counts
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from scan.recipe import ScanRecipe
+from scan.storage import scan_basename, write_csv
+from scan.writer import FILE_EXTENSION
+
+# pending -> running -> done, stopped (cancelled, resumes on the next run) or failed.
+# A job still marked running when the queue is loaded was interrupted by a crash.
+JOB_STATES = ('pending', 'running', 'stopped', 'done', 'failed')
+
+
+def resumable(recipe):
+    # Only plain step scans measure their grid in order, the others start over.
+    return recipe.mode == 'step' and recipe.repeats == 1
+
+
+class ScanQueue:
+    # Scan jobs in a JSON file, written to a temporary file and swapped in on every change.
+    # The GUI adds jobs while the worker thread runs the queue, so changes hold the lock.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def save(self, jobs):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(jobs, f, indent=1)
+        os.replace(temporary, self.path)
+
+    def add(self, recipe):
+        with self.lock:
+            jobs = self.load()
+            job = {
+                'id': max([job['id'] for job in jobs], default=0) + 1,
+                'recipe': recipe.to_dict(),
+                'state': 'pending',
+                'added': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'streamPath': None,
+            }
+            jobs.append(job)
+            self.save(jobs)
+        return job
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            jobs = self.load()
+            for job in jobs:
+                if job['id'] == job_id:
+                    job.update(fields)
+            self.save(jobs)
+
+    def remove(self, job_id):
+        with self.lock:
+            self.save([job for job in self.load() if job['id'] != job_id])
+
+    def clear(self, states=('done',)):
+        with self.lock:
+            self.save([job for job in self.load() if job['state'] not in states])
+
+    def next_job(self):
+        # Interrupted and stopped jobs first, so a restart picks up where it left off.
+        jobs = self.load()
+        for wanted in (('running', 'stopped'), ('pending',)):
+            for job in jobs:
+                if job['state'] in wanted:
+                    return job
+        return None
+
+
+def run_queue(engine, queue, working_directory, on_start=None, on_job=None):
+    # Runs jobs back to back until the queue is empty or the engine is cancelled. Every point
+    # is flushed to the job's stream file, a rerun after a crash resumes from there.
+    # on_start(job, recipe) and on_job(job, result) are called around each job.
+    # Returns the number of jobs finished.
+    # The cancel token is reset here only, a Stop pressed between two jobs ends the queue.
+    finished = 0
+    engine.cancel_token.reset()
+    while not engine.cancel_token.is_cancelled():
+        job = queue.next_job()
+        if job is None:
+            break
+        recipe = ScanRecipe.from_dict(job['recipe'])
+        path = job['streamPath']
+        if path is None or not resumable(recipe):
+            if path is not None and os.path.exists(path):
+                os.replace(path, path + '.interrupted')
+            path = scan_basename(recipe, working_directory) + '_job%d_data%s' % (job['id'], FILE_EXTENSION)
+        queue.update(job['id'], state='running', streamPath=path)
+        if on_start is not None:
+            on_start(job, recipe)
+
+        engine.stream_path = path
+        engine.flush_interval = 0
+        try:
+            result = engine.run(recipe, reset_cancel=False)
+        except Exception as e:
+            queue.update(job['id'], state='failed', error=str(e))
+            continue
+        finally:
+            engine.stream_path = None
+            engine.flush_interval = 1.0
+
+        if result.stopped:
+            queue.update(job['id'], state='stopped')
+            if on_job is not None:
+                on_job(job, result)
+            break
+
+        base = path[:-len('_data' + FILE_EXTENSION)]
+        data_fname, params_fname = write_csv(result, base + '_data.csv', base + '_params.csv')
+        queue.update(job['id'], state='done', dataPath=data_fname, finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        finished += 1
+        if on_job is not None:
+            on_job(job, result)
+    return finished
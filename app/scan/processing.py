@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+import numpy as np
+from scan.catalog import read_params
+from scan.spectrum import MAX_FREQUENCY, SPEED_OF_LIGHT, ZERO_PAD_FACTOR, fft_length, frequency_axis, window_array
+
+CHUNK_SIZE = 16  # files per worker task
+CACHE_VERSION = 1  # bump when a stage computes something different for the same settings
+
+
+@dataclass
+class ProcessingRecipe:
+    # Settings of the post-processing pipeline. start, stop and step (um) set the common delay
+    # grid, None takes the range all scans cover at the coarsest step among them.
+    start: float = None
+    stop: float = None
+    step: float = None
+    baselinePoints: int = 10  # leading points averaged and subtracted, 0 for none
+    window: str = 'hann'
+    padFactor: int = ZERO_PAD_FACTOR
+    maxFrequency: float = MAX_FREQUENCY  # THz
+    thickness: float = None  # sample thickness in um, n and alpha need it
+    fitBand: tuple = (0.2, 1.0)  # THz, where the unwrapped phase is extrapolated to zero from
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class ProcessingResult:
+    # One row per sample file. transfer, n and alpha are None without references or thickness.
+    samples: list
+    references: list
+    frequencies: np.ndarray  # THz
+    spectra: np.ndarray  # complex, sample spectra
+    reference: np.ndarray  # complex, mean of the reference spectra
+    transfer: np.ndarray = None
+    n: np.ndarray = None
+    alpha: np.ndarray = None  # 1/cm, field absorption times two
+
+
+def params_path(data_fname):
+    return data_fname[:-len('_data.csv')] + '_params.csv'
+
+
+def load_trace(data_fname):
+    data = np.loadtxt(data_fname, delimiter=',', skiprows=1, usecols=(0, 1), ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def common_grid(data_fnames, recipe):
+    # The delay grid every trace is resampled onto, from the params files so no trace is read.
+    starts, stops, steps = [], [], []
+    for data_fname in data_fnames:
+        params = read_params(params_path(data_fname))
+        starts.append(min(params['stageStart'], params['stageStop']))
+        stops.append(max(params['stageStart'], params['stageStop']))
+        steps.append(abs(params['stageStepSize']))
+    start = max(starts) if recipe.start is None else recipe.start
+    stop = min(stops) if recipe.stop is None else recipe.stop
+    step = max(steps) if recipe.step is None else recipe.step
+    if stop - start < step:
+        raise ValueError('The scans have no delay range in common.')
+    return start + np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1) * step
+
+
+def resample(traces, grid):
+    # (scans, points) values of the (positions, values) traces on grid, NaN outside a trace.
+    stack = np.empty((len(traces), len(grid)))
+    for i, (positions, values) in enumerate(traces):
+        if np.any(np.diff(positions) < 0):
+            order = np.argsort(positions, kind='stable')
+            positions, values = positions[order], values[order]
+        stack[i] = np.interp(grid, positions, values, left=np.nan, right=np.nan)
+    return stack
+
+
+def subtract_baseline(stack, points):
+    # Mean of the first points of every trace, before the pulse, taken off the whole trace.
+    if points <= 0:
+        return stack
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN leading points
+        baseline = np.nanmean(stack[:, :points], axis=1, keepdims=True)
+    return stack - np.nan_to_num(baseline)
+
+
+def apply_window(stack, name):
+    # Points outside a trace become zero, the same as the zero padding of the FFT.
+    return np.nan_to_num(stack * window_array(name, stack.shape[1]))
+
+
+def compute_spectra(stack, step, n_fft, max_frequency=MAX_FREQUENCY):
+    # One rfft over all traces. Returns the frequencies up to max_frequency and the spectra.
+    frequencies = frequency_axis(n_fft, step)
+    keep = np.searchsorted(frequencies, max_frequency, side='right')
+    return frequencies[:keep], np.fft.rfft(stack, n_fft, axis=1)[:, :keep]
+
+
+def transfer_function(spectra, reference):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return spectra / reference
+
+
+def optical_constants(frequencies, transfer, thickness, fit_band=(0.2, 1.0)):
+    # Refractive index and absorption coefficient (1/cm) of a slab thickness um thick, echoes
+    # ignored. The unwrapped phase is shifted by the multiple of 2 pi that takes its straight
+    # line fit over fit_band through zero at zero frequency.
+    phase = np.unwrap(np.angle(transfer), axis=1)
+    band = (frequencies >= fit_band[0]) & (frequencies <= fit_band[1])
+    if np.count_nonzero(band) >= 2:
+        slope, offset = np.polyfit(frequencies[band], phase[:, band].T, 1)
+        phase = phase - 2 * np.pi * np.round(offset / (2 * np.pi))[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = 1 - SPEED_OF_LIGHT * phase / (2 * np.pi * frequencies * thickness)
+        alpha = -2 / (thickness * 1e-4) * np.log(np.abs(transfer) * (n + 1) ** 2 / (4 * n))
+    n[:, frequencies == 0] = np.nan
+    alpha[:, frequencies == 0] = np.nan
+    return n, alpha
+
+
+class ProcessingCache:
+    # Intermediate arrays in .npy files, one per input file and stage, named by a hash of the
+    # file (path, size, modification time) and of the settings the stage depends on. A changed
+    # file or setting gets a new name, stale entries are just no longer read.
+    def __init__(self, directory):
+        self.directory = directory
+        # Per input file, counted by file_spectra: a hit is a file that did not have to be read.
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data_fname, stage, params):
+        stat = os.stat(data_fname)
+        text = json.dumps([CACHE_VERSION, os.path.abspath(data_fname), stat.st_size, stat.st_mtime_ns,
+                           stage, params], sort_keys=True)
+        return stage + '-' + hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        try:
+            array = np.load(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return array
+
+    def put(self, key, array):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        temporary = self.path(key) + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.save(f, array)
+        os.replace(temporary, self.path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory) if os.path.exists(self.directory) else []:
+            if name.endswith('.npy'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def process_chunk(data_fnames, traces, grid, recipe, n_fft):
+    # One batch of files, run in a worker process when there are several batches. traces has
+    # the resampled values of files the cache had, None for the others. Returns the resampled
+    # traces and the spectra, as (scans, points) and (scans, frequencies) arrays.
+    missing = [i for i, trace in enumerate(traces) if trace is None]
+    if missing:
+        loaded = resample([load_trace(data_fnames[i]) for i in missing], grid)
+        traces = list(traces)
+        for i, trace in zip(missing, loaded):
+            traces[i] = trace
+    stack = np.array(traces)
+    windowed = apply_window(subtract_baseline(stack, recipe.baselinePoints), recipe.window)
+    _, spectra = compute_spectra(windowed, grid[1] - grid[0], n_fft, recipe.maxFrequency)
+    return stack, spectra
+
+
+def file_spectra(data_fnames, grid, recipe, cache=None, workers=1):
+    # Spectra of the files on grid. A file whose spectrum is cached is not read. Resampled
+    # traces are cached as well, so new window or baseline settings only redo the FFT.
+    step = grid[1] - grid[0]
+    n_fft = fft_length(len(grid), recipe.padFactor)
+    frequencies = frequency_axis(n_fft, step)
+    frequencies = frequencies[:np.searchsorted(frequencies, recipe.maxFrequency, side='right')]
+    trace_params = {'grid': [float(grid[0]), float(grid[-1]), float(step)]}
+    spectrum_params = dict(trace_params, baselinePoints=recipe.baselinePoints, window=recipe.window,
+                           nFft=n_fft, maxFrequency=recipe.maxFrequency)
+
+    spectra = np.empty((len(data_fnames), len(frequencies)), dtype=complex)
+    missing, traces = [], []
+    for i, data_fname in enumerate(data_fnames):
+        spectrum = cache.get(cache.key(data_fname, 'spectrum', spectrum_params)) if cache is not None else None
+        if spectrum is not None:
+            spectra[i] = spectrum
+            continue
+        missing.append(i)
+        traces.append(cache.get(cache.key(data_fname, 'trace', trace_params)) if cache is not None else None)
+    if cache is not None:
+        read = sum(trace is None for trace in traces)
+        cache.hits += len(data_fnames) - read
+        cache.misses += read
+    if not missing:
+        return frequencies, spectra
+
+    chunks = [slice(k, k + CHUNK_SIZE) for k in range(0, len(missing), CHUNK_SIZE)]
+    tasks = [([data_fnames[i] for i in missing[chunk]], traces[chunk], grid, recipe, n_fft) for chunk in chunks]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            results = list(pool.map(process_chunk, *zip(*tasks)))
+    else:
+        results = [process_chunk(*task) for task in tasks]
+
+    for chunk, (stack, chunk_spectra) in zip(chunks, results):
+        for i, trace, cached, spectrum in zip(missing[chunk], stack, traces[chunk], chunk_spectra):
+            spectra[i] = spectrum
+            if cache is not None:
+                if cached is None:
+                    cache.put(cache.key(data_fnames[i], 'trace', trace_params), trace)
+                cache.put(cache.key(data_fnames[i], 'spectrum', spectrum_params), spectrum)
+    return frequencies, spectra
+
+
+def process_scans(samples, references=(), recipe=None, cache=None, workers=None):
+    # Samples divided by the mean reference, then n and alpha if the recipe has a thickness.
+    # workers defaults to one process per CPU, large batches are spread over them.
+    recipe = recipe or ProcessingRecipe()
+    samples, references = list(samples), list(references)
+    grid = common_grid(samples + references, recipe)
+    frequencies, spectra = file_spectra(samples + references, grid, recipe, cache, workers or os.cpu_count() or 1)
+    result = ProcessingResult(samples, references, frequencies, spectra[:len(samples)],
+                              spectra[len(samples):].mean(axis=0) if references else None)
+    if references:
+        result.transfer = transfer_function(result.spectra, result.reference)
+        if recipe.thickness:
+            result.n, result.alpha = optical_constants(frequencies, result.transfer, recipe.thickness,
+                                                       recipe.fitBand)
+    return result
+
+
+def save_result(result, fname):
+    # Frequency, then per sample its transmission and phase, or amplitude without a reference,
+    # and n and alpha when they were computed.
+    import pandas as pd
+
+    print('Saving processed data to ' + fname)
+    columns = {'frequency': result.frequencies}
+    for i, sample in enumerate(result.samples):
+        name = os.path.basename(sample)[:-len('_data.csv')]
+        if result.transfer is None:
+            columns[name + '_amplitude'] = np.abs(result.spectra[i])
+        else:
+            columns[name + '_transmission'] = np.abs(result.transfer[i])
+            columns[name + '_phase'] = np.unwrap(np.angle(result.transfer[i]))
+        if result.n is not None:
+            columns[name + '_n'] = result.n[i]
+            columns[name + '_alpha'] = result.alpha[i]
+    pd.DataFrame(columns, copy=False).to_csv(fname, index=False)
+    return fname
@@ -0,0 +1,188 @@
+import json
+import time
+from dataclasses import dataclass, asdict, field
+import numpy as np
+from scan.recipe import ScanRecipe
+
+CUBE_SUFFIX = '_cube.npy'
+IMAGE_SUFFIX = '_image.json'
+
+
+def axis_positions(start, stop, step):
+    count = int(round((stop - start) / step)) + 1 if step else 1
+    return start + np.arange(max(count, 1)) * step
+
+
+@dataclass
+class ImageRecipe:
+    # A delay trace (delay, a step or fly ScanRecipe) at every pixel of an x/y raster, in um.
+    xStart: float
+    xStop: float
+    xStep: float
+    yStart: float
+    yStop: float
+    yStep: float
+    delay: ScanRecipe = field(default_factory=lambda: ScanRecipe(start=0, stop=0, stepsize=1))
+    serpentine: bool = True  # odd rows run backwards in x, odd pixels backwards in delay
+    fileprefix: str = ''
+
+    def x_positions(self):
+        return axis_positions(self.xStart, self.xStop, self.xStep)
+
+    def y_positions(self):
+        return axis_positions(self.yStart, self.yStop, self.yStep)
+
+    def shape(self):
+        return len(self.x_positions()), len(self.y_positions()), len(self.delay.positions())
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, params):
+        params = dict(params)
+        params['delay'] = ScanRecipe.from_dict(params['delay'])
+        return cls(**params)
+
+
+def raster_order(nx, ny, serpentine=True):
+    # Pixel (ix, iy) visiting order, row by row along x. With serpentine every other row runs
+    # backwards, so the stage never flies back across the sample between rows.
+    ix = np.tile(np.arange(nx), ny)
+    iy = np.repeat(np.arange(ny), nx)
+    if serpentine:
+        odd = (iy % 2) == 1
+        ix[odd] = nx - 1 - ix[odd]
+    return np.column_stack((ix, iy))
+
+
+class WaveformCube:
+    # (x, y, delay) waveforms in a memory-mapped .npy file, NaN until measured. Only the pixels
+    # being written or read are in memory, a 200 x 200 x 1000 image is 320 MB on disk.
+    # The peak map, largest |value| per pixel, is kept up to date as traces come in.
+    def __init__(self, path, data, params):
+        self.path = path
+        self.data = data
+        self.params = params
+        self.peak = np.full(data.shape[:2], np.nan)
+
+    @classmethod
+    def create(cls, path, recipe, params=None):
+        data = np.lib.format.open_memmap(path, mode='w+', dtype='<f8', shape=recipe.shape())
+        data[...] = np.nan
+        params = dict(params or {})
+        params['recipe'] = recipe.to_dict()
+        params['x'] = recipe.x_positions().tolist()
+        params['y'] = recipe.y_positions().tolist()
+        params['delay'] = recipe.delay.positions().tolist()
+        with open(image_params_path(path), 'w') as f:
+            json.dump(params, f, indent=1)
+        return cls(path, data, params)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        with open(image_params_path(path)) as f:
+            params = json.load(f)
+        cube = cls(path, np.load(path, mmap_mode=mode), params)
+        # One row of pixels at a time, the cube is never read in one piece.
+        for iy in range(cube.data.shape[1]):
+            cube.peak[:, iy] = peak_values(cube.data[:, iy, :])
+        return cube
+
+    def write_trace(self, ix, iy, values):
+        self.data[ix, iy, :] = values
+        self.peak[ix, iy] = peak_values(values)
+
+    def trace(self, ix, iy):
+        return self.data[ix, iy, :]
+
+    def flush(self):
+        self.data.flush()
+        with open(image_params_path(self.path), 'w') as f:
+            json.dump(self.params, f, indent=1)
+
+
+def image_params_path(cube_path):
+    return cube_path[:-len(CUBE_SUFFIX)] + IMAGE_SUFFIX if cube_path.endswith(CUBE_SUFFIX) else cube_path + '.json'
+
+
+def peak_values(traces):
+    # Signed value of the largest excursion along the last axis, NaN where nothing was measured.
+    traces = np.asarray(traces)
+    magnitude = np.where(np.isnan(traces), -1.0, np.abs(traces))
+    index = np.expand_dims(np.argmax(magnitude, axis=-1), -1)
+    return np.take_along_axis(traces, index, axis=-1)[..., 0]
+
+
+def run_image(engine, xy_stage, recipe, cube, on_pixel=None):
+    # Raster scan. engine runs the delay trace of every pixel on its lock-in and delay stage,
+    # xy_stage is a MultiAxisStageBaseClass. on_pixel(ix, iy, peak) after each pixel.
+    # Returns the number of pixels measured, fewer if cancelled.
+    delay = recipe.delay
+    grid = delay.positions()
+    x, y = recipe.x_positions(), recipe.y_positions()
+    order = raster_order(len(x), len(y), recipe.serpentine)
+
+    engine.cancel_token.reset()
+    engine.timer.start_scan()
+    if delay.timeConstant is not None:
+        engine.lia.setTimeConstant(delay.timeConstant)
+    time_constant = engine.lia.getTimeConstant()
+    cube.params.update({'timeConstant': time_constant, 'sensitivity': engine.lia.getSensitivity(),
+                        'started': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+    xy_stage.startMove((x[order[0, 0]], y[order[0, 1]]))
+    engine.stage.move(delay.start)
+    done = 0
+    for k, (ix, iy) in enumerate(order):
+        if engine.cancel_token.is_cancelled():
+            break
+        engine.status('Pixel %d of %d' % (k + 1, len(order)))
+        with engine.timer.phase('move'):
+            xy_stage.waitForMove()
+
+        # Alternate delay direction as well, the delay stage picks up where it stopped.
+        reverse = recipe.serpentine and k % 2 == 1
+        indices = np.arange(len(grid))[::-1] if reverse else np.arange(len(grid))
+        if delay.mode == 'fly':
+            values, timestamps, counts = engine.fly_pass(delay, time_constant, reverse, live=False)
+            trace = np.where(counts > 0, values, np.nan)
+            complete = not engine.cancel_token.is_cancelled()
+        else:
+            buffer = engine.new_buffer(delay, len(grid))
+            complete = engine.measure_positions(grid[indices], delay, buffer, time_constant, indices)
+            trace = np.full(len(grid), np.nan)
+            trace[indices[:len(buffer)]] = buffer.values
+
+        # The next pixel is on its way while this one is stored.
+        if k + 1 < len(order) and complete:
+            xy_stage.startMove((x[order[k + 1, 0]], y[order[k + 1, 1]]))
+        with engine.timer.phase('save'):
+            cube.write_trace(ix, iy, trace)
+        if not complete:
+            break
+        done += 1
+        if on_pixel is not None:
+            on_pixel(int(ix), int(iy), float(cube.peak[ix, iy]))
+
+    stopped = engine.cancel_token.is_cancelled()
+    cube.params.update({'pixels': done, 'stopped': stopped})
+    cube.flush()
+    engine.status('Image stopped' if stopped else 'Image finished')
+    return done
+
+
+def image_path(recipe, working_directory=None):
+    from scan.storage import scan_basename
+
+    return scan_basename(recipe, working_directory) + CUBE_SUFFIX
+
+
+def save_peak_map(cube):
+    # Peak map as x, y, peak rows next to the cube, readable without NumPy.
+    fname = cube.path[:-len(CUBE_SUFFIX)] + '_peak.csv'
+    print('Saving peak map to ' + fname)
+    x, y = np.meshgrid(cube.params['x'], cube.params['y'], indexing='ij')
+    np.savetxt(fname, np.column_stack((x.ravel(), y.ravel(), cube.peak.ravel())), delimiter=',',
+               header='x,y,peak', comments='')
+    return fname
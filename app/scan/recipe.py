@@ -0,0 +1,49 @@
+from dataclasses import dataclass, asdict
+import numpy as np
+
+
+@dataclass
+class ScanRecipe:
+    # Everything needed to run one scan, independent of where it came from (GUI, CLI, queue).
+    start: float
+    stop: float
+    stepsize: float
+    nAvg: int = 1
+    decorrelated: bool = False  # nAvg reads half a time constant apart, at least nAvg * tc / 2 per point
+    nPostmove: float = 0
+    timeConstant: float = None  # None keeps whatever is set on the lock-in
+    fileprefix: str = ''
+    mode: str = 'step'  # 'step', 'fly' or 'refine'
+    velocity: float = None  # fly-scan stage velocity in um/s, None picks one from the time constant
+    adaptive: bool = False  # adaptive dwell: settle detection and averaging down to targetError
+    targetError: float = None  # V, standard error of each point
+    minAvg: int = 2  # nAvg is the maximum in adaptive mode
+    settleTolerance: float = None  # V, None follows the measured noise of one reading
+    coarseStep: float = None  # refine: step of the first survey pass, None is REFINE_FACTOR**2 * stepsize
+    refineThreshold: float = 0.1  # refine: fraction of the largest change that marks an interval for refinement
+    repeats: int = 1  # passes folded into a running mean and variance (step and fly scans)
+    serpentine: bool = False  # odd passes run from stop back to start
+    channels: tuple = ()  # lock-in outputs saved next to R, e.g. ('X', 'Y', 'theta'), one read per sample
+
+    def length_of_scan(self):
+        return int(((self.stop - self.start) / self.stepsize) + 1)
+
+    def positions(self, stepsize=None):
+        if stepsize is None:
+            stepsize = self.stepsize
+        count = int(((self.stop - self.start) / stepsize) + 1)
+        positions = self.start + np.arange(count) * stepsize
+        if self.mode == 'refine' and positions[-1] < self.stop:
+            # The coarse survey still has to reach the end of the range.
+            positions = np.append(positions, self.stop)
+        return positions
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, params):
+        params = dict(params)
+        # JSON (stream headers, the job queue) brings tuples back as lists.
+        params['channels'] = tuple(params.get('channels', ()))
+        return cls(**params)
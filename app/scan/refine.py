@@ -0,0 +1,50 @@
+import numpy as np
+
+REFINE_FACTOR = 4
+
+
+def pass_steps(coarse_step, fine_step, factor=REFINE_FACTOR):
+    # Step size of each pass, from the coarse survey down to the requested step.
+    steps = [float(coarse_step)]
+    while steps[-1] > fine_step:
+        steps.append(max(steps[-1] / factor, float(fine_step)))
+    return steps
+
+
+def interval_scores(positions, values):
+    # How much the trace changes inside each interval between neighbouring points:
+    # the step in value (gradient) or the second difference at either end (curvature).
+    steps = np.abs(np.diff(values))
+    curvature = np.zeros(len(values))
+    if len(values) > 2:
+        curvature[1:-1] = np.abs(values[2:] - 2 * values[1:-1] + values[:-2])
+    return np.maximum(steps, np.maximum(curvature[:-1], curvature[1:]))
+
+
+def refinement_positions(positions, values, step, grid_start, grid_step, threshold):
+    # New positions, step apart, inside the intervals whose score is above threshold times the
+    # largest one. Snapped to the final scan grid and never repeating a measured position.
+    order = np.argsort(positions)
+    positions = np.asarray(positions, dtype=float)[order]
+    values = np.asarray(values, dtype=float)[order]
+    if len(positions) < 2:
+        return np.array([])
+
+    scores = interval_scores(positions, values)
+    if scores.max() <= 0:
+        return np.array([])
+    selected = np.flatnonzero(scores >= threshold * scores.max())
+
+    new_positions = []
+    for i in selected:
+        left, right = positions[i], positions[i + 1]
+        candidates = np.arange(left + step, right - step / 2, step)
+        new_positions.append(candidates)
+    if not new_positions:
+        return np.array([])
+
+    new_positions = np.concatenate(new_positions)
+    new_positions = grid_start + np.round((new_positions - grid_start) / grid_step) * grid_step
+    new_positions = np.unique(new_positions)
+    measured = np.isclose(new_positions[:, None], positions[None, :], rtol=0, atol=grid_step / 1000).any(axis=1)
+    return new_positions[~measured]
@@ -0,0 +1,77 @@
+from functools import lru_cache
+import numpy as np
+
+# Spectra of delay traces, for the live plot (spectrum.py) and batch processing (scan.processing).
+ZERO_PAD_FACTOR = 4
+MAX_FREQUENCY = 10.0  # THz, nothing the detector sees is above this
+DB_FLOOR = -100.0
+SPEED_OF_LIGHT = 299.792458  # um/ps
+
+
+def stage_delay_step(step):
+    # The beam travels the stage displacement twice. um -> ps.
+    return 2 * step / SPEED_OF_LIGHT
+
+
+@lru_cache(maxsize=32)
+def window_array(name, n):
+    # Cached per trace length, the returned array must not be modified.
+    if name == 'hann':
+        return np.hanning(n)
+    if name == 'blackman':
+        return np.blackman(n)
+    if name == 'none':
+        return np.ones(n)
+    raise ValueError('Unknown window: ' + name)
+
+
+@lru_cache(maxsize=32)
+def frequency_axis(n_fft, step):
+    # Frequencies in THz of an rfft over n_fft points spaced step um apart.
+    return np.fft.rfftfreq(n_fft, stage_delay_step(step))
+
+
+def fft_length(n, pad_factor=ZERO_PAD_FACTOR):
+    # Next power of two of the zero-padded length.
+    return 1 << int(np.ceil(np.log2(max(n * pad_factor, 2))))
+
+
+def uniform_trace(positions, values, step):
+    # Resamples onto a grid of the given step, for refine and raw fly traces.
+    positions = np.asarray(positions, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if np.any(np.diff(positions) < 0):
+        order = np.argsort(positions, kind='stable')
+        positions, values = positions[order], values[order]
+    n = int(np.floor((positions[-1] - positions[0]) / step + 1e-9)) + 1
+    grid = positions[0] + np.arange(n) * step
+    if len(grid) == len(positions) and np.allclose(grid, positions):
+        return values
+    return np.interp(grid, positions, values)
+
+
+class SpectrumCalculator:
+    # Amplitude (dB from the peak) and unwrapped phase of a trace. With n_fft fixed for a scan
+    # the frequency axis and windows come from the caches and each update is one rfft.
+    def __init__(self, window='hann', pad_factor=ZERO_PAD_FACTOR, max_frequency=MAX_FREQUENCY):
+        self.window = window
+        self.pad_factor = pad_factor
+        self.max_frequency = max_frequency
+
+    def compute(self, positions, values, step, n_fft=None):
+        values = uniform_trace(positions, values, step)
+        n = len(values)
+        if n_fft is None or n_fft < n:
+            n_fft = fft_length(n, self.pad_factor)
+
+        spectrum = np.fft.rfft((values - values.mean()) * window_array(self.window, n), n_fft)
+        frequencies = frequency_axis(n_fft, step)
+        keep = np.searchsorted(frequencies, self.max_frequency, side='right')
+        spectrum = spectrum[:keep]
+
+        amplitude = np.abs(spectrum)
+        peak = amplitude.max()
+        with np.errstate(divide='ignore'):
+            amplitude_db = 20 * np.log10(amplitude / peak) if peak > 0 else np.full(keep, DB_FLOOR)
+        np.maximum(amplitude_db, DB_FLOOR, out=amplitude_db)
+        return frequencies[:keep], amplitude_db, np.unwrap(np.angle(spectrum))
@@ -0,0 +1,73 @@
+import os
+import time
+
+
+def default_data_directory():
+    return os.path.join(os.getcwd(), '..', 'data/')
+
+
+def scan_basename(recipe, working_directory=None):
+    # The filename expression will be yyyymmdd-hr-mn-ss<prefix>
+    if working_directory is None:
+        working_directory = default_data_directory()
+
+    # Create the data directory if it does not exist
+    if not os.path.exists(working_directory):
+        os.makedirs(working_directory)
+
+    datetime_string = time.strftime('%Y%m%d-%H-%M-%S')
+    return os.path.join(working_directory, datetime_string + recipe.fileprefix)
+
+
+def save_scan(result, working_directory=None):
+    # A streamed scan keeps the name of its stream file, so the catalog finds the pair.
+    from scan.writer import FILE_EXTENSION
+
+    suffix = '_data' + FILE_EXTENSION
+    if result.streamPath is not None and result.streamPath.endswith(suffix):
+        if working_directory is None:
+            working_directory = default_data_directory()
+        base = os.path.join(working_directory, os.path.basename(result.streamPath)[:-len(suffix)])
+    else:
+        base = scan_basename(result.recipe, working_directory)
+    return write_csv(result, base + '_data.csv', base + '_params.csv')
+
+
+def write_csv(result, data_fname, params_fname):
+    import pandas as pd
+    from scan.catalog import index_scan
+
+    recipe = result.recipe
+
+    # Save the main data
+    print('Saving data to ' + data_fname)
+    columns = {'stagePos': result.buffer.positions, 'voltage': result.buffer.values}
+    # Per-point extras (dwell time, sample count, ...) go after the two standard columns.
+    for name in result.buffer.extra_columns:
+        columns[name] = result.buffer.column(name)
+    df = pd.DataFrame(columns, copy=False)
+    df.to_csv(data_fname, index=False)
+
+    # Save the parameters in a separate file
+    print('Saving parameters to ' + params_fname)
+    with open(params_fname, 'w') as f:
+        f.write('stageStart, stageStop, stageStepSize, timeConstant, sensitivity, postStepPause, sampleAverage\n')
+        f.write(f"{recipe.start}, {recipe.stop}, {recipe.stepsize}, {result.timeConstant}, {result.sensitivity}, {recipe.nPostmove}, {recipe.nAvg}\n")
+        if recipe.mode == 'refine':
+            f.write('coarseStep, refineThreshold\n')
+            f.write(f"{recipe.coarseStep}, {recipe.refineThreshold}\n")
+        if recipe.adaptive:
+            f.write('targetError, minAverage, settleTolerance\n')
+            f.write(f"{recipe.targetError}, {recipe.minAvg}, {recipe.settleTolerance}\n")
+        if recipe.decorrelated:
+            f.write('decorrelated\n')
+            f.write(f"{recipe.decorrelated}\n")
+        if recipe.channels:
+            f.write('channels\n')
+            f.write(' '.join(recipe.channels) + '\n')
+        if recipe.repeats > 1:
+            f.write('repeats, serpentine\n')
+            f.write(f"{recipe.repeats}, {recipe.serpentine}\n")
+
+    index_scan(result, data_fname, params_fname)
+    return data_fname, params_fname
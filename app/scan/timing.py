@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PHASES = ('move', 'settle', 'measure', 'plot', 'save')
+
+# Used until the first real timings come in.
+DEFAULT_MOVE_TIME = 0.2
+DEFAULT_MEASURE_TIME = 0.2
+
+
+class PhaseTimer:
+    # Rolling per-phase statistics. Durations are stored per sample, so a measure phase
+    # of nAvg reads counts as nAvg samples. Safe to record from the acquisition and GUI threads.
+    def __init__(self, window=200):
+        self.window = window
+        # Taken around every access to the dicts, the GUI reads them while the scan records.
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.recent = {}
+            self.totals = {}
+            self.counts = {}
+        self.start_scan()
+
+    def start_scan(self):
+        # Rolling phase statistics carry over between scans, the point rate does not.
+        self.points = 0
+        self.started = None
+
+    def record(self, name, duration, samples=1):
+        with self.lock:
+            if name not in self.recent:
+                self.recent[name] = deque(maxlen=self.window)
+                self.totals[name] = 0.0
+                self.counts[name] = 0
+            self.recent[name].append(duration / samples)
+            self.totals[name] += duration
+            self.counts[name] += samples
+
+    @contextmanager
+    def phase(self, name, samples=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, samples)
+
+    def point_done(self):
+        if self.started is None:
+            self.started = time.perf_counter()
+        self.points += 1
+
+    def mean(self, name, default=None):
+        with self.lock:
+            recent = self.recent.get(name)
+            if not recent:
+                return default
+            return sum(recent) / len(recent)
+
+    def points_per_second(self):
+        if self.started is None or self.points < 2:
+            return None
+        return (self.points - 1) / (time.perf_counter() - self.started)
+
+    def summary(self):
+        with self.lock:
+            names = list(self.recent)
+            totals, counts = dict(self.totals), dict(self.counts)
+        return {name: {'mean': self.mean(name), 'total': totals[name], 'count': counts[name]} for name in names}
+
+
+def estimate_scan_time(recipe, time_constant, timer=None):
+    # Settle time is what the loop actually waits, move and measure come from measured timings.
+    if recipe.mode == 'fly':
+        from scan.fly import fly_velocity
+        return recipe.repeats * abs(recipe.stop - recipe.start) / fly_velocity(recipe, time_constant)
+
+    move_time = DEFAULT_MOVE_TIME
+    measure_time = DEFAULT_MEASURE_TIME
+    if timer is not None:
+        move_time = timer.mean('move', move_time)
+        measured = timer.mean('measure')
+        if measured is not None:
+            measure_time = measured * recipe.nAvg
+    settle_time = time_constant * (1 + recipe.nPostmove)
+    # Refinement scans are not repeated.
+    passes = recipe.repeats if recipe.mode == 'step' else 1
+    return passes * recipe.length_of_scan() * (move_time + settle_time + measure_time)
@@ -0,0 +1,171 @@
+import json
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+# Light scan file: 8 byte magic, uint32 header length, JSON header padded to a multiple of 64 bytes,
+# then rows of little endian float64, one per point. The file is append-only, so whatever made it
+# to disk before a crash is readable; a partially written last row is ignored by the loader.
+MAGIC = b'LGHTSCN1'
+PREAMBLE = struct.Struct('<8sI')
+HEADER_ALIGN = 64
+STANDARD_COLUMNS = ('position', 'value', 'timestamp')
+PASS_COLUMN = 'pass'  # last column of repeated scans, one row per point and pass
+FILE_EXTENSION = '.lscan'
+
+
+class StreamingWriter:
+    # append continues an existing file with the same columns, e.g. to resume an interrupted scan.
+    # flush_interval 0 puts every row on disk before append returns.
+    def __init__(self, path, columns, params, flush_interval=1.0, chunk_rows=256, append=False):
+        self.path = path
+        self.columns = tuple(columns)
+        self.flush_interval = flush_interval
+        self.chunk = np.empty((chunk_rows, len(self.columns)), dtype='<f8')
+        self.pending = 0
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+        if append and os.path.exists(path):
+            self.reopen(path)
+            return
+
+        header = dict(params)
+        header['columns'] = list(self.columns)
+        header['dtype'] = '<f8'
+        encoded = json.dumps(header).encode('utf-8')
+        padding = -(PREAMBLE.size + len(encoded)) % HEADER_ALIGN
+        encoded += b' ' * padding
+
+        self.file = open(path, 'wb')
+        self.file.write(PREAMBLE.pack(MAGIC, len(encoded)))
+        self.file.write(encoded)
+        self.sync()
+
+    def reopen(self, path):
+        with open(path, 'rb') as f:
+            header, offset = read_header(f)
+        if header['columns'] != list(self.columns):
+            raise ValueError("Scan file has columns " + ', '.join(header['columns']))
+        self.file = open(path, 'r+b')
+        # Drop a partially written last row, new rows go right after the last complete one.
+        self.rows = (os.path.getsize(path) - offset) // (8 * len(self.columns))
+        self.file.truncate(offset + self.rows * 8 * len(self.columns))
+        self.file.seek(0, os.SEEK_END)
+
+    def append(self, row):
+        self.chunk[self.pending] = row
+        self.pending += 1
+        self.rows += 1
+        if self.pending == len(self.chunk) or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(self.chunk[:self.pending].tobytes())
+            self.pending = 0
+        self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StreamedScan:
+    def __init__(self, header, data):
+        self.header = header
+        self.data = data
+
+    def column(self, name):
+        return self.data[:, self.header['columns'].index(name)]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def read_header(f):
+    magic, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError("Not a Light scan file.")
+    return json.loads(f.read(header_length).decode('utf-8')), PREAMBLE.size + header_length
+
+
+def load_stream(path, mmap=True):
+    # Memory-maps the rows by default, nothing is read until it is used.
+    with open(path, 'rb') as f:
+        header, offset = read_header(f)
+    ncolumns = len(header['columns'])
+    row_bytes = 8 * ncolumns
+    rows = (os.path.getsize(path) - offset) // row_bytes
+    if rows == 0:
+        data = np.empty((0, ncolumns))
+    elif mmap:
+        data = np.memmap(path, dtype=header['dtype'], mode='r', offset=offset, shape=(rows, ncolumns))
+    else:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype=header['dtype'], count=rows * ncolumns).reshape(rows, ncolumns)
+    return StreamedScan(header, data)
+
+
+def stream_to_csv(path, working_directory=None):
+    # Writes the usual <name>_data.csv/_params.csv pair next to the stream file.
+    from scan.engine import ScanResult
+    from scan.recipe import ScanRecipe
+    from scan.buffer import ScanBuffer
+    from scan.storage import write_csv
+
+    scan = load_stream(path, mmap=False)
+    header = scan.header
+    recipe = ScanRecipe.from_dict(header['recipe'])
+    extra = header['columns'][len(STANDARD_COLUMNS):]
+    data = scan.data
+    if PASS_COLUMN in extra:
+        buffer = averaged_buffer(data)
+    else:
+        if recipe.mode == 'refine':
+            data = data[np.argsort(data[:, 0], kind='stable')]
+        buffer = ScanBuffer(len(data), extra)
+        for row in data:
+            buffer.append(*row)
+
+    if working_directory is None:
+        working_directory = os.path.dirname(os.path.abspath(path))
+    base = os.path.join(working_directory, os.path.basename(path)[:-len(FILE_EXTENSION)])
+    if base.endswith('_data'):
+        base = base[:-len('_data')]
+    result = ScanResult(recipe, buffer, header['timeConstant'], header['sensitivity'], header.get('stopped'))
+    return write_csv(result, base + '_data.csv', base + '_params.csv')
+
+
+def averaged_buffer(data):
+    from scan.averaging import REPEAT_COLUMNS, average_passes
+    from scan.buffer import ScanBuffer
+
+    grid, average = average_passes(data[:, 0], data[:, 1])
+    buffer = ScanBuffer(len(grid), REPEAT_COLUMNS)
+    std = average.std()
+    for i in range(len(grid)):
+        buffer.append(grid[i], average.mean[i], np.nan, average.count[i], std[i])
+    return buffer
+
+
+if __name__ == '__main__':
+    # python -m scan.writer <file.lscan> ... converts to the CSV layout.
+    for name in sys.argv[1:]:
+        print(*stream_to_csv(name))
@@ -0,0 +1,22 @@
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from scan.spectrum import SpectrumCalculator
+
+SPECTRUM_FPS = 4
+
+
+class SpectrumWorker(QObject):
+    # Lives in its own QThread. The GUI hands it a copy of the trace, at most one request
+    # is in flight so a slow FFT never queues up behind the scan.
+    spectrumReady = pyqtSignal(object)
+
+    def __init__(self, calculator=None):
+        super(SpectrumWorker, self).__init__()
+        self.calculator = calculator or SpectrumCalculator()
+
+    @pyqtSlot(object)
+    def compute(self, request):
+        positions, values, step, n_fft = request
+        if len(values) < 4:
+            self.spectrumReady.emit(None)
+            return
+        self.spectrumReady.emit(self.calculator.compute(positions, values, step, n_fft))
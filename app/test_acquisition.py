@@ -0,0 +1,164 @@
+from acquisition import AcquisitionWorker
+from scan.raster import ImageRecipe
+from scan.recipe import ScanRecipe
+
+
+class FakeLockin:
+    def __init__(self):
+        self.timeConstant = 0.0
+
+    def measure(self):
+        return 1.0
+
+    def measureBuffered(self, count):
+        return [1.0] * count
+
+    def getTimeConstant(self):
+        return self.timeConstant
+
+    def getSensitivity(self):
+        return 0
+
+
+class FakeStage:
+    def __init__(self):
+        self.positions = []
+
+    def move(self, position):
+        self.positions.append(position)
+
+    def startMove(self, position):
+        self.positions.append(position)
+
+    def startMoveBy(self, distance):
+        self.positions.append(self.positions[-1] + distance)
+
+    def waitForMove(self):
+        return True
+
+
+class TestAcquisitionWorker:
+    params = {'start': 0, 'stop': 40, 'stepsize': 10, 'nAvg': 3, 'nPostmove': 0}
+
+    def test_scan_emits_every_point(self):
+        stage = FakeStage()
+        worker = AcquisitionWorker(FakeLockin(), stage)
+        points = []
+        finished = []
+        worker.pointAcquired.connect(lambda i, x, y, t: points.append((i, x, y)))
+        worker.scanFinished.connect(finished.append)
+
+        worker.run_scan(self.params)
+
+        assert [p[1] for p in points] == [0, 10, 20, 30, 40]
+        assert all(p[2] == 1.0 for p in points)
+        assert stage.positions == [0, 0, 10, 20, 30, 40]
+        assert finished[0].stopped is False
+
+    def test_cancel_stops_scan(self):
+        worker = AcquisitionWorker(FakeLockin(), FakeStage())
+        points = []
+        finished = []
+
+        def on_point(i, x, y, t):
+            points.append(x)
+            worker.cancel_token.cancel()
+
+        worker.pointAcquired.connect(on_point)
+        worker.scanFinished.connect(finished.append)
+        worker.run_scan(self.params)
+
+        assert points == [0]
+        assert finished[0].stopped is True
+
+    def test_instruments_come_up_in_the_worker(self):
+        worker = AcquisitionWorker()
+        statuses = []
+        ready = []
+        worker.statusChanged.connect(statuses.append)
+        worker.instrumentsReady.connect(lambda tc, sens: ready.append(tc))
+        worker.open_instruments('demo')
+
+        assert ready == [0.3]
+        assert statuses == ['Connecting lock-in', 'Connecting stage', 'Homing stage']
+        assert worker.engine.lia is worker.lia and worker.engine.stage is worker.stage
+
+    def test_failed_bring_up_is_reported(self):
+        worker = AcquisitionWorker()
+        failed = []
+        worker.instrumentsFailed.connect(failed.append)
+        worker.open_instruments('gpib')
+        assert 'gpib' in failed[0]
+
+    def test_image_without_an_xy_stage_still_finishes(self, tmp_path):
+        worker = AcquisitionWorker(FakeLockin(), FakeStage())
+        worker.backend = 'server'
+        failed, finished = [], []
+        worker.instrumentsFailed.connect(failed.append)
+        worker.imageFinished.connect(finished.append)
+        recipe = ImageRecipe(0, 10, 10, 0, 10, 10, delay=ScanRecipe(start=0, stop=10, stepsize=10))
+        worker.run_image((recipe, str(tmp_path / 'image.npy')))
+        assert 'server' in failed[0]
+        assert finished == [0]
+        assert worker.xyStage is None
+
+    def test_failed_image_is_reported(self, tmp_path):
+        worker = AcquisitionWorker(FakeLockin(), FakeStage())
+        worker.backend = 'demo'
+        statuses, finished = [], []
+        worker.statusChanged.connect(statuses.append)
+        worker.imageFinished.connect(finished.append)
+        recipe = ImageRecipe(0, 10, 10, 0, 10, 10, delay=ScanRecipe(start=0, stop=10, stepsize=10))
+        worker.run_image((recipe, str(tmp_path / 'missing' / 'image.npy')))
+        assert statuses[-1].startswith('Image failed')
+        assert finished == [0]
+
+    def test_failed_scan_still_finishes(self):
+        def measureBuffered(count):
+            raise TimeoutError('buffer did not fill')
+
+        lockin = FakeLockin()
+        lockin.measureBuffered = measureBuffered
+        worker = AcquisitionWorker(lockin, FakeStage())
+        statuses, finished = [], []
+        worker.statusChanged.connect(statuses.append)
+        worker.scanFinished.connect(finished.append)
+        worker.run_scan(self.params)
+        assert statuses[-1] == 'Scan failed: buffer did not fill'
+        assert finished == [None]
+
+    def test_failed_queue_still_finishes(self, tmp_path):
+        class BrokenQueue:
+            def next_job(self):
+                raise ValueError('queue file is not JSON')
+
+        worker = AcquisitionWorker(FakeLockin(), FakeStage())
+        statuses, finished = [], []
+        worker.statusChanged.connect(statuses.append)
+        worker.queueFinished.connect(finished.append)
+        worker.run_queue((BrokenQueue(), str(tmp_path)))
+        assert statuses[-1] == 'Queue failed: queue file is not JSON'
+        assert finished == [0]
+
+    def test_failed_goto_is_reported(self):
+        def move(position):
+            raise RuntimeError('stage not enabled')
+
+        stage = FakeStage()
+        stage.move = move
+        worker = AcquisitionWorker(FakeLockin(), stage)
+        statuses = []
+        worker.statusChanged.connect(statuses.append)
+        worker.goto(100.0)
+        assert statuses == ['Starting Goto', 'Goto failed: stage not enabled']
+
+    def test_close_instruments_closes_the_stages(self):
+        closed = []
+        stage, xy_stage = FakeStage(), FakeStage()
+        stage.closeConnection = lambda: closed.append('stage')
+        xy_stage.closeConnection = lambda: closed.append('xy')
+        worker = AcquisitionWorker(FakeLockin(), stage)
+        worker.xyStage = xy_stage
+        worker.close_instruments()
+        assert closed == ['stage', 'xy']
+        assert worker.stage is None and worker.xyStage is None
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from instruments.simulator.simulator import SR830Simulator, SerialLink, ThorlabsStageSimulator
+from scan import adaptive
+from scan.engine import CancelToken, ScanEngine
+from scan.recipe import ScanRecipe
+from scan.storage import save_scan
+
+
+class SequenceLockin:
+    def __init__(self, values):
+        self.values = list(values)
+        self.reads = 0
+
+    def measure(self):
+        self.reads += 1
+        return self.values.pop(0)
+
+    def measureBuffered(self, count):
+        self.reads += count
+        return np.array([self.values.pop(0) for i in range(count)])
+
+
+class TestSettle:
+    def test_stops_once_drift_is_small(self):
+        lia = SequenceLockin([0.0, 0.5, 0.7, 0.70001, 0.70001])
+        assert adaptive.settle(lia, 0.001, 1e-3, 10, CancelToken()) is False
+        assert lia.reads == 4
+
+    def test_max_wait_bounds_the_settle(self):
+        lia = SequenceLockin([float(i) for i in range(1000)])
+        assert adaptive.settle(lia, 0.001, 1e-9, 0.01, CancelToken()) is False
+        assert lia.reads < 1000
+
+    def test_cancel(self):
+        token = CancelToken()
+        token.cancel()
+        assert adaptive.settle(SequenceLockin([0.0]), 0.001, 1e-9, 1, token) is True
+
+    def test_no_tolerance_waits_the_full_time(self):
+        lia = SequenceLockin([0.0])
+        assert adaptive.settle(lia, 0.001, None, 0.01, CancelToken()) is False
+        assert lia.reads == 0
+
+
+class NoisyLockin(SR830Demo):
+    # Settled output of 1 V with 1 mV of white noise on every reading.
+    def __init__(self):
+        super(NoisyLockin, self).__init__()
+        self.rng = np.random.default_rng(1)
+
+    def measure(self):
+        return 1.0 + 1e-3 * self.rng.standard_normal()
+
+    def measureBuffered(self, count):
+        return 1.0 + 1e-3 * self.rng.standard_normal(int(count))
+
+
+class TestAverage:
+    def test_quiet_signal_stops_at_minimum(self):
+        lia = SequenceLockin([1.0] * 100)
+        mean, count, error = adaptive.average(lia, 1e-6, 4, 100)
+        assert (mean, count, error) == (1.0, 4, 0.0)
+
+    def test_noisy_signal_goes_to_maximum(self):
+        rng = np.random.default_rng(0)
+        lia = SequenceLockin(rng.normal(5.0, 1.0, 100))
+        mean, count, error = adaptive.average(lia, 1e-6, 4, 50, batch=8)
+        assert count == 50
+        assert abs(error - 1.0 / np.sqrt(50)) < 0.1
+
+    def test_no_target_averages_the_maximum(self):
+        lia = SequenceLockin([1.0] * 100)
+        assert adaptive.average(lia, None, 4, 30)[1] == 30
+
+    def test_error_is_exact_on_large_offset(self):
+        lia = SequenceLockin(1e3 + np.array([1e-6, -1e-6] * 10))
+        mean, count, error = adaptive.average(lia, 1e-12, 20, 20)
+        assert abs(mean - 1e3) < 1e-9
+        assert abs(error - 1e-6 * np.sqrt(20 / 19) / np.sqrt(20)) < 1e-12
+
+
+class TestAdaptiveScan:
+    def test_dwell_columns_are_saved(self, tmp_path):
+        stage = ThorlabsStageSimulator('0', velocity=1e6, acceleration=1e9, moveOverhead=0)
+        lia = SR830Simulator(stage, noise=1e-7, seed=3, link=SerialLink(latency=0, baudrate=1e9))
+        recipe = ScanRecipe(start=1400, stop=1600, stepsize=50, nAvg=20, nPostmove=3, timeConstant=0.002,
+                            adaptive=True, targetError=1e-5, minAvg=3)
+        result = ScanEngine(lia, stage).run(recipe)
+
+        counts = result.buffer.column('sampleCount')
+        assert len(result.buffer) == 5
+        assert np.all((counts >= 3) & (counts <= 20))
+        assert np.all(result.buffer.column('dwellTime') > 0)
+
+        data_fname, params_fname = save_scan(result, str(tmp_path))
+        df = pd.read_csv(data_fname)
+        assert list(df.columns) == ['stagePos', 'voltage', 'dwellTime', 'sampleCount', 'standardError']
+
+    def test_noisy_signal_settles_before_the_maximum_wait(self):
+        # The target error of the mean is far below the noise of one reading. Once the first
+        # point has measured that noise, the settle test passes long before max_wait.
+        recipe = ScanRecipe(start=0, stop=50, stepsize=10, nAvg=50, nPostmove=99, timeConstant=0.001,
+                            adaptive=True, targetError=1e-5, minAvg=10)
+        result = ScanEngine(NoisyLockin(), ThorlabsStageControllerDemo('0')).run(recipe)
+        dwell = result.buffer.column('dwellTime')
+        max_wait = 0.001 * (1 + recipe.nPostmove)
+        assert dwell[0] >= max_wait
+        assert np.median(dwell[1:]) < max_wait / 2
+
+    def test_without_target_error_every_point_takes_nAvg(self):
+        recipe = ScanRecipe(start=0, stop=20, stepsize=10, nAvg=12, timeConstant=0.001, adaptive=True)
+        result = ScanEngine(NoisyLockin(), ThorlabsStageControllerDemo('0')).run(recipe)
+        assert list(result.buffer.column('sampleCount')) == [12] * 3
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from scan.averaging import RunningAverage, average_passes
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.timing import estimate_scan_time
+from scan.writer import load_stream, stream_to_csv
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+
+
+class TestRunningAverage:
+    def test_matches_numpy_over_passes(self):
+        rng = np.random.default_rng(1)
+        passes = rng.normal(size=(7, 20))
+        average = RunningAverage(20)
+        for values in passes:
+            average.update(np.arange(20), values)
+        assert np.allclose(average.mean, passes.mean(axis=0))
+        assert np.allclose(average.variance(), passes.var(axis=0, ddof=1))
+        assert np.allclose(average.standard_error(), passes.std(axis=0, ddof=1) / np.sqrt(7))
+
+    def test_scalar_updates_and_partial_passes(self):
+        average = RunningAverage(3)
+        average.update(0, 1.0)
+        average.update(0, 3.0)
+        average.update(2, 5.0)
+        assert list(average.count) == [2, 0, 1]
+        assert average.mean[0] == 2.0 and np.isnan(average.mean[1])
+        # A single sample has no spread yet.
+        assert average.std()[2] == 0.0
+        lower, upper = average.band()
+        assert lower[0] < 2.0 < upper[0]
+
+    def test_average_passes_groups_by_position(self):
+        grid, average = average_passes([0, 1, 0, 1], [1.0, 2.0, 3.0, 6.0])
+        assert list(grid) == [0, 1]
+        assert list(average.mean) == [2.0, 4.0]
+
+
+def make_engine():
+    lia = SR830Demo()
+    stage = ThorlabsStageControllerDemo('0')
+    lia.setTimeConstant(0)
+    return ScanEngine(lia, stage), stage
+
+
+def test_repeated_serpentine_step_scan(tmp_path):
+    engine, stage = make_engine()
+    engine.stream_directory = str(tmp_path)
+    points = []
+    engine.on_point = lambda index, *rest: points.append(index)
+    recipe = ScanRecipe(start=0, stop=40, stepsize=10, repeats=3, serpentine=True)
+    result = engine.run(recipe)
+
+    assert points == [0, 1, 2, 3, 4, 4, 3, 2, 1, 0, 0, 1, 2, 3, 4]
+    assert list(result.buffer.positions) == [0, 10, 20, 30, 40]
+    assert list(result.buffer.column('repeatCount')) == [3] * 5
+    # The last pass runs forward again and ends at the stop position.
+    assert stage.getPosition() == 40
+
+    stream = load_stream(result.streamPath)
+    assert len(stream.data) == 15
+    assert list(stream.column('pass')) == [0] * 5 + [1] * 5 + [2] * 5
+    data_fname, _ = stream_to_csv(result.streamPath, str(tmp_path))
+    saved = pd.read_csv(data_fname)
+    assert np.allclose(saved['voltage'], result.buffer.values)
+
+
+def test_repeats_multiply_estimate():
+    single = ScanRecipe(start=0, stop=100, stepsize=10)
+    repeated = ScanRecipe(start=0, stop=100, stepsize=10, repeats=4)
+    assert np.isclose(estimate_scan_time(repeated, 0.1), 4 * estimate_scan_time(single, 0.1))
+
+
+def test_repeated_fly_scan_reports_grid_points():
+    engine, stage = make_engine()
+    points = []
+    engine.on_point = lambda index, *rest: points.append(index)
+    recipe = ScanRecipe(start=0, stop=20, stepsize=5, mode='fly', velocity=400, repeats=2, serpentine=True)
+    result = engine.run(recipe)
+
+    assert points == [0, 1, 2, 3, 4, 4, 3, 2, 1, 0]
+    assert list(result.buffer.column('repeatCount')) == [2] * 5
+    assert stage.getPosition() == 0
+
+    # Without serpentine every pass sweeps from the start again.
+    sweeps = []
+    stage_sweep = stage.sweep
+    stage.sweep = lambda position, velocity: sweeps.append((stage.getPosition(), position)) or \
+        stage_sweep(position, velocity)
+    points.clear()
+    result = engine.run(ScanRecipe(start=0, stop=20, stepsize=5, mode='fly', velocity=400, repeats=2,
+                                   serpentine=False))
+    assert sweeps == [(0, 20), (0, 20)]
+    assert points == [0, 1, 2, 3, 4] * 2
+    assert list(result.buffer.column('repeatCount')) == [2] * 5
@@ -0,0 +1,85 @@
+import numpy as np
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan import storage
+from scan.catalog import ScanCatalog, catalog_path, load_traces, read_params
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.storage import save_scan
+from scan.writer import stream_to_csv
+
+
+def run_scan(directory, prefix, stop, timeConstant=0.0, stream=False):
+    lia = SR830Demo()
+    engine = ScanEngine(lia, ThorlabsStageControllerDemo('0'))
+    if stream:
+        # The CSV pair is then written next to the stream file, with the same name.
+        engine.stream_path = directory + '/20240501-12-00-00' + prefix + '_data.lscan'
+    result = engine.run(ScanRecipe(start=0, stop=stop, stepsize=10, timeConstant=timeConstant, fileprefix=prefix))
+    if stream:
+        return result, stream_to_csv(engine.stream_path)
+    return result, save_scan(result, directory)
+
+
+class TestScanCatalog:
+    def test_save_updates_the_catalog(self, tmp_path):
+        result, (data_fname, params_fname) = run_scan(str(tmp_path), 'sampleX', 50)
+        with ScanCatalog(catalog_path(str(tmp_path))) as catalog:
+            rows = catalog.find(prefix='sampleX')
+        assert len(rows) == 1
+        row = rows[0]
+        assert row['points'] == 6
+        assert row['stop'] == 50
+        peak = np.argmax(np.abs(result.buffer.values))
+        assert row['peakPosition'] == result.buffer.positions[peak]
+        assert row['duration'] >= 0
+
+    def test_find_by_prefix_and_time_constant(self, tmp_path):
+        run_scan(str(tmp_path), 'sampleX1', 20, timeConstant=0.001)
+        run_scan(str(tmp_path), 'sampleX2', 30)
+        run_scan(str(tmp_path), 'sampleY', 40, timeConstant=0.001)
+        with ScanCatalog(catalog_path(str(tmp_path))) as catalog:
+            rows = catalog.find(prefix='sampleX', timeConstant=0.001)
+            assert [row['stop'] for row in rows] == [20]
+            assert len(catalog.find(where='points > ?', parameters=(3,))) == 2
+
+    def test_rebuild_from_files(self, tmp_path):
+        run_scan(str(tmp_path), 'a', 20)
+        run_scan(str(tmp_path), 'b', 30)
+        (tmp_path / 'catalog.sqlite').unlink()
+        with ScanCatalog(catalog_path(str(tmp_path))) as catalog:
+            assert catalog.rebuild(str(tmp_path)) == 2
+            assert catalog.update(str(tmp_path)) == 0
+            assert sorted(row['points'] for row in catalog.find()) == [3, 4]
+
+    def test_load_traces_stacks_and_pads(self, tmp_path):
+        streamed, _ = run_scan(str(tmp_path), 'a', 20, stream=True)
+        saved, _ = run_scan(str(tmp_path), 'b', 40)
+        with ScanCatalog(catalog_path(str(tmp_path))) as catalog:
+            rows = catalog.find()
+        assert rows[0]['streamPath'] is not None and rows[1]['streamPath'] is None
+
+        stack = load_traces(rows, str(tmp_path / 'stack.npy'))
+        assert stack.shape == (2, 2, 5)
+        np.testing.assert_array_equal(stack[1, 0, :3], streamed.buffer.values)
+        assert np.isnan(stack[:, 0, 3:]).all()
+        np.testing.assert_allclose(stack[1, 1], saved.buffer.values)
+        np.testing.assert_array_equal(np.load(str(tmp_path / 'stack.npy'), mmap_mode='r'), stack)
+
+def test_saved_scan_is_paired_with_its_stream(tmp_path, monkeypatch):
+    engine = ScanEngine(SR830Demo(), ThorlabsStageControllerDemo('0'))
+    engine.stream_directory = str(tmp_path)
+    result = engine.run(ScanRecipe(start=0, stop=30, stepsize=10, fileprefix='sampleX'))
+    # The scan ended in a later second than it started.
+    monkeypatch.setattr(storage, 'scan_basename', lambda recipe, directory=None: str(tmp_path / 'later'))
+    data_fname, params_fname = save_scan(result, str(tmp_path))
+    assert data_fname == result.streamPath[:-len('.lscan')] + '.csv'
+    with ScanCatalog(catalog_path(str(tmp_path))) as catalog:
+        assert catalog.find(prefix='sampleX')[0]['streamPath'] == result.streamPath
+
+
+def test_read_params(tmp_path):
+    _, (data_fname, params_fname) = run_scan(str(tmp_path), '', 20, timeConstant=0.001)
+    params = read_params(params_fname)
+    assert params['timeConstant'] == 0.001
+    assert params['stageStop'] == 20
@@ -0,0 +1,155 @@
+import os
+import socket
+import stat
+import time
+from multiprocessing.connection import Client
+import numpy as np
+import pytest
+import config
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.server.client import InstrumentConnection, LockinAmplifierClient, ThorlabsStageClient
+from instruments.server.server import InstrumentServer
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+
+AUTHKEY = b'test'
+
+
+class CountingStage(ThorlabsStageControllerDemo):
+    def __init__(self):
+        super(CountingStage, self).__init__('0')
+        self.homeCount = 0
+        self.unpicklable = False
+
+    def home(self):
+        self.homeCount += 1
+
+    def sweep(self, position, velocity):
+        # Stands in for a driver exception, e.g. a .NET one.
+        raise type('KinesisException', (Exception,), {})('device not responding')
+
+    def getPosition(self):
+        if self.unpicklable:
+            return lambda: None
+        return super(CountingStage, self).getPosition()
+
+
+@pytest.fixture
+def server():
+    lia = SR830Demo()
+    lia.setTimeConstant(0)
+    server = InstrumentServer(lia, CountingStage(), ('localhost', 0), AUTHKEY)
+    server.start()
+    yield server
+    server.close()
+
+
+def connect(server):
+    connection = InstrumentConnection(server.address, AUTHKEY)
+    lia, stage = LockinAmplifierClient(connection), ThorlabsStageClient(connection)
+    lia.openConnection()
+    stage.openConnection()
+    return lia, stage
+
+
+class TestInstrumentServer:
+    def test_scan_through_the_server(self, server):
+        lia, stage = connect(server)
+        result = ScanEngine(lia, stage).run(ScanRecipe(start=0, stop=50, stepsize=10, nAvg=2))
+        np.testing.assert_array_equal(result.buffer.positions, np.arange(0, 51, 10))
+        assert not result.stopped
+        stage.closeConnection()
+
+    def test_clients_share_the_instruments(self, server):
+        first_lia, first_stage = connect(server)
+        second_lia, second_stage = connect(server)
+        first_stage.move(120)
+        assert second_stage.getPosition() == 120
+        second_lia.setTimeConstant(0.01)
+        assert first_lia.getTimeConstant() == 0.01
+        first_stage.home()
+        second_stage.home()
+        assert server.instruments['stage'].homeCount == 1
+
+    def test_batch_is_one_round_trip(self, server):
+        lia, stage = connect(server)
+        moved, value, channels = lia.connection.batch([('stage', 'move', (30,)),
+                                                       ('lockin', 'measure', ()),
+                                                       ('lockin', 'measureChannels', (('X', 'Y'),))])
+        assert lia.connection.roundTrips == 1
+        assert 0 <= value <= 10
+        assert len(channels) == 2
+        assert stage.getPosition() == 30
+
+    def test_errors_reach_the_client(self, server):
+        lia, stage = connect(server)
+        with pytest.raises(ValueError):
+            stage.connection.call('stage', 'closeConnection')
+        with pytest.raises(TypeError):
+            stage.connection.call('stage', 'move')
+        # The connection is still usable afterwards.
+        assert stage.getPosition() == 0
+
+    def test_driver_errors_come_back_by_name(self, server):
+        lia, stage = connect(server)
+        with pytest.raises(RuntimeError, match='KinesisException: device not responding'):
+            stage.sweep(100, 10)
+        server.instruments['stage'].unpicklable = True
+        with pytest.raises(TypeError, match='not sent'):
+            stage.getPosition()
+        server.instruments['stage'].unpicklable = False
+        assert stage.getPosition() == 0
+
+    def test_slow_client_does_not_block_others(self, server):
+        # Connects and never answers the challenge.
+        silent = socket.create_connection(server.address)
+        lia, stage = connect(server)
+        assert stage.getPosition() == 0
+        silent.close()
+
+    def test_closed_clients_are_dropped(self, server):
+        lia, stage = connect(server)
+        stage.getPosition()
+        assert len(server.clients) == 1
+        stage.closeConnection()
+        deadline = time.monotonic() + 5
+        while server.clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.clients == []
+
+
+def test_connect_leaves_the_server_settings_alone(server):
+    server.instruments['lockin'].setTimeConstant(0.01)
+    connection = InstrumentConnection(server.address, AUTHKEY)
+    lia, stage = LockinAmplifierClient(connection), ThorlabsStageClient(connection)
+    config.connect_instruments(lia, stage)
+    assert lia.getTimeConstant() == 0.01
+    assert server.instruments['stage'].homeCount == 0
+
+
+class Payload:
+    # Creates a file when it is unpickled.
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def test_pickles_are_not_loaded(server, tmp_path):
+    connection = Client(server.address, authkey=AUTHKEY)
+    connection.send(Payload(str(tmp_path / 'unpickled')))
+    response = connection.recv_bytes()
+    assert b'error' in response
+    assert not (tmp_path / 'unpickled').exists()
+    connection.close()
+
+
+def test_key_is_created_once_for_this_user(tmp_path):
+    path = str(tmp_path / 'light' / 'instrument_server.key')
+    key = config.instrument_server_key(path)
+    assert len(key) == 64
+    assert config.instrument_server_key(path) == key
+    if os.name == 'posix':
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
@@ -0,0 +1,109 @@
+import threading
+import numpy as np
+import jobs
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.jobs import ScanQueue, run_queue
+from scan.recipe import ScanRecipe
+from scan.writer import STANDARD_COLUMNS, StreamingWriter, load_stream
+
+
+def make_engine():
+    lia = SR830Demo()
+    lia.setTimeConstant(0)
+    return ScanEngine(lia, ThorlabsStageControllerDemo('0'))
+
+
+class TestScanQueue:
+    def test_jobs_persist_in_order(self, tmp_path):
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        first = queue.add(ScanRecipe(start=0, stop=10, stepsize=1))
+        second = queue.add(ScanRecipe(start=0, stop=20, stepsize=2))
+
+        reloaded = ScanQueue(str(tmp_path / 'queue.json'))
+        assert [job['id'] for job in reloaded.load()] == [first['id'], second['id']]
+        assert ScanRecipe.from_dict(reloaded.next_job()['recipe']).stop == 10
+
+    def test_interrupted_jobs_come_first(self, tmp_path):
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        queue.add(ScanRecipe(start=0, stop=10, stepsize=1))
+        second = queue.add(ScanRecipe(start=0, stop=20, stepsize=2))
+        queue.update(second['id'], state='stopped')
+        assert queue.next_job()['id'] == second['id']
+
+    def test_concurrent_adds_keep_every_job(self, tmp_path):
+        # The GUI adds jobs while the worker updates them.
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        threads = [threading.Thread(target=lambda: [queue.add(ScanRecipe(start=0, stop=10, stepsize=1))
+                                                     for _ in range(20)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(job['id'] for job in queue.load()) == list(range(1, 81))
+
+
+class TestRunQueue:
+    def test_jobs_are_run_and_saved(self, tmp_path):
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        queue.add(ScanRecipe(start=0, stop=10, stepsize=5))
+        queue.add(ScanRecipe(start=0, stop=20, stepsize=5, repeats=2))
+
+        assert run_queue(make_engine(), queue, str(tmp_path)) == 2
+        finished = queue.load()
+        assert [job['state'] for job in finished] == ['done', 'done']
+        assert len(np.loadtxt(finished[1]['dataPath'], delimiter=',', skiprows=1)) == 5
+        assert queue.next_job() is None
+
+    def test_stopped_step_scan_resumes_where_it_stopped(self, tmp_path):
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        queue.add(ScanRecipe(start=0, stop=100, stepsize=10))
+
+        engine = make_engine()
+        engine.on_point = lambda i, x, y, t: i == 3 and engine.cancel_token.cancel()
+        assert run_queue(engine, queue, str(tmp_path)) == 0
+        job = queue.load()[0]
+        assert job['state'] == 'stopped'
+        assert len(load_stream(job['streamPath'])) == 4
+
+        engine = make_engine()
+        moves = []
+        stage_move = engine.stage.startMove
+        engine.stage.startMove = lambda position: moves.append(position) or stage_move(position)
+        assert run_queue(engine, queue, str(tmp_path)) == 1
+        # The stage never goes back to the positions before the checkpoint.
+        assert min(moves) == 40 and max(moves) == 100
+        data = load_stream(queue.load()[0]['streamPath']).data
+        np.testing.assert_array_equal(data[:, 0], np.arange(0, 101, 10))
+
+    def test_stop_between_jobs_ends_the_queue(self, tmp_path):
+        queue = ScanQueue(str(tmp_path / 'queue.json'))
+        queue.add(ScanRecipe(start=0, stop=10, stepsize=5))
+        queue.add(ScanRecipe(start=0, stop=10, stepsize=5))
+
+        engine = make_engine()
+        # Stop pressed after the second job was picked, before its scan starts.
+        on_start = lambda job, recipe: job['id'] == 2 and engine.cancel_token.cancel()
+        assert run_queue(engine, queue, str(tmp_path), on_start=on_start) == 1
+        assert [job['state'] for job in queue.load()] == ['done', 'stopped']
+
+    def test_cli_adds_and_lists_jobs(self, tmp_path, capsys):
+        path = str(tmp_path / 'queue.json')
+        assert jobs.main(['--queue', path, 'add', '--start', '0', '--stop', '10', '--step', '5']) == 0
+        assert jobs.main(['--queue', path, 'list']) == 0
+        assert 'pending' in capsys.readouterr().out
+
+
+def test_append_drops_a_partial_row(tmp_path):
+    path = str(tmp_path / 'scan.lscan')
+    writer = StreamingWriter(path, STANDARD_COLUMNS, {}, flush_interval=0)
+    writer.append((1.0, 2.0, 3.0))
+    writer.close()
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 12)
+
+    writer = StreamingWriter(path, STANDARD_COLUMNS, {}, flush_interval=0, append=True)
+    writer.append((4.0, 5.0, 6.0))
+    writer.close()
+    np.testing.assert_array_equal(load_stream(path).data, [[1, 2, 3], [4, 5, 6]])
@@ -0,0 +1,84 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from liveplot import LivePlot, minmax_decimate, lttb, expand_limits
+
+
+class TestDecimation:
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 500.0)
+
+    def test_short_traces_are_untouched(self):
+        x, y = minmax_decimate(self.x[:10], self.y[:10], 100)
+        assert len(y) == 10
+
+    def test_minmax_keeps_extremes(self):
+        y = self.y.copy()
+        y[1234] = 50.0
+        x, yd = minmax_decimate(self.x, y, 200)
+        assert len(yd) <= 200 + 10000 // 100
+        assert yd.max() == 50.0
+        assert yd.min() == y.min()
+        assert np.all(np.diff(x) > 0)
+
+    def test_lttb_size_and_endpoints(self):
+        x, y = lttb(self.x, self.y, 300)
+        assert len(y) == 300
+        assert x[0] == self.x[0] and x[-1] == self.x[-1]
+        assert np.all(np.diff(x) > 0)
+
+
+class TestExpandLimits:
+    def test_inside_limits_returns_none(self):
+        assert expand_limits(0, 10, 2, 8) is None
+
+    def test_only_the_exceeded_side_moves(self):
+        lower, upper = expand_limits(0, 10, 2, 12)
+        assert lower == 0
+        assert upper > 12
+
+
+class TestLivePlot:
+    def make_plot(self):
+        figure = Figure()
+        canvas = FigureCanvasAgg(figure)
+        ax = figure.add_subplot(111)
+        ax.set_xlim(0, 100)
+        ax.set_ylim(0, 10)
+        line, = ax.plot([], [], 'r-')
+        plot = LivePlot(canvas, max_points=50)
+        plot.attach(ax, line)
+        return plot, ax, line
+
+    def test_first_data_fits_y_limits(self):
+        plot, ax, line = self.make_plot()
+        plot.set_data(np.array([0.0, 1.0]), np.array([1e-6, 2e-6]))
+        plot.redraw()
+        lower, upper = ax.get_ylim()
+        assert lower < 1e-6 and upper > 2e-6 and upper < 1e-5
+
+    def test_redraw_only_when_dirty_and_decimates(self):
+        plot, ax, line = self.make_plot()
+        x = np.linspace(0, 100, 1000)
+        plot.set_data(x, np.sin(x))
+        plot.redraw()
+        assert not plot.dirty
+        assert len(line.get_xdata()) <= 50 + 1000 // 25
+        assert ax.get_xlim() == (0, 100)
+
+    def test_view_is_evaluated_once_per_frame(self):
+        plot, ax, line = self.make_plot()
+        calls = []
+
+        def view():
+            calls.append(1)
+            x = np.arange(10.0)
+            return x, x, (x - 1, x + 1)
+
+        for i in range(100):
+            plot.set_view(view)
+        assert calls == []
+        plot.redraw()
+        plot.redraw()
+        assert len(calls) == 1
+        assert len(line.get_xdata()) == 10
@@ -0,0 +1,84 @@
+import time
+import numpy as np
+import pytest
+import config
+import instruments.nidaq.nidaq as nidaq
+from instruments.lockinAmplifier.sr830 import SR830Demo, buffer_sample_rate
+from instruments.nidaq.nidaq import NIDAQ, NIDAQSimulated
+
+
+def test_block_read_is_clocked_and_scaled():
+    daq = NIDAQSimulated(SR830Demo(), source=lambda: 2e-3, sampleRate=10000.0, noise=0.0)
+    daq.openConnection('COM1', 9600)
+    daq.setSensitivity(5e-3)
+
+    start = time.perf_counter()
+    data = daq.measureBuffered(500)
+    assert time.perf_counter() - start >= 0.05
+    # 2 mV at 5 mV sensitivity is 4 V on the output, scaled back to the lock-in reading.
+    assert data.shape == (500,)
+    assert np.allclose(data, 2e-3)
+    assert daq.measure() == pytest.approx(2e-3)
+    assert daq.blockCount == 2
+
+
+def test_buffered_reads_are_fast_unless_decorrelated():
+    daq = NIDAQSimulated(SR830Demo(), source=lambda: 2e-3, sampleRate=10000.0, noise=0.0)
+    daq.openConnection('COM1', 9600)
+    daq.setTimeConstant(0.01)
+    start = time.perf_counter()
+    daq.measureBuffered(50)
+    assert time.perf_counter() - start < 50 / 200.0
+
+    daq.setSampleRate(buffer_sample_rate(0.01))
+    assert daq.bufferRate == 200.0
+    start = time.perf_counter()
+    daq.measureBuffered(4)
+    assert time.perf_counter() - start >= 4 / 200.0
+    # Single reads keep the fast clock.
+    start = time.perf_counter()
+    daq.measure()
+    assert time.perf_counter() - start < 4 / 200.0
+    daq.setSampleRate(None)
+    assert daq.bufferRate is None
+
+
+class FakeReader:
+    def read_many_sample(self, data, number_of_samples_per_channel, timeout):
+        data[:] = np.random.uniform(size=len(data))
+
+
+def test_blocks_do_not_share_the_read_buffer(monkeypatch):
+    monkeypatch.setattr(nidaq, 'AcquisitionType', type('AcquisitionType', (), {'FINITE': 'finite'}), raising=False)
+    daq = NIDAQ()
+    daq.task = type('Task', (), {'start': lambda self: None, 'stop': lambda self: None})()
+    daq.task.timing = type('Timing', (), {'cfg_samp_clk_timing': lambda self, *args, **kwargs: None})()
+    daq.reader = FakeReader()
+    first = daq.readBlock(10)
+    kept = first.copy()
+    daq.readBlock(10)
+    assert np.array_equal(first, kept)
+
+
+def test_settings_go_to_the_lockin():
+    lockin = SR830Demo()
+    daq = NIDAQSimulated(lockin)
+    daq.openConnection('COM1', 9600)
+    daq.setTimeConstant(0.3)
+    assert lockin.getTimeConstant() == 0.3
+    assert daq.getTimeConstant() == 0.3
+
+
+def test_read_needs_an_open_task():
+    daq = NIDAQSimulated()
+    with pytest.raises(ConnectionError):
+        daq.measure()
+
+
+def test_config_wraps_the_lockin():
+    lia, stage = config.create_instruments('simulator', 'daq')
+    assert isinstance(lia, NIDAQSimulated)
+    config.connect_instruments(lia, stage, time_constant=0.01)
+    assert lia.measureBuffered(10).std() < 1e-3
+    with pytest.raises(ValueError):
+        config.create_instruments('demo', 'gpib')
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import scan.processing as processing
+from scan.processing import (ProcessingCache, ProcessingRecipe, common_grid, process_scans, resample, save_result,
+                             subtract_baseline)
+from scan.spectrum import stage_delay_step
+
+THICKNESS = 500.0  # um
+INDEX = 2.0
+ABSORPTION = 10.0  # 1/cm
+
+
+def pulse(delay, t0=3.0, width=0.15):
+    # Derivative of a gaussian, delay and t0 in ps.
+    t = (delay - t0) / width
+    return -t * np.exp(-t ** 2)
+
+
+def write_scan(path, name, positions, values, offset=0.0):
+    # A _data.csv/_params.csv pair as write_csv saves it.
+    data_fname = str(path / (name + '_data.csv'))
+    pd.DataFrame({'stagePos': positions, 'voltage': values + offset}).to_csv(data_fname, index=False)
+    with open(str(path / (name + '_params.csv')), 'w') as f:
+        f.write('stageStart, stageStop, stageStepSize, timeConstant, sensitivity, postStepPause, sampleAverage\n')
+        f.write('%s, %s, %s, 0.1, 0.001, 0, 1\n' % (positions[0], positions[-1], positions[1] - positions[0]))
+    return data_fname
+
+
+def write_slab(path, name='sample', offset=0.0):
+    positions = np.arange(0, 3000.0 + 1, 3.0)
+    delay = positions * stage_delay_step(1.0)
+    shift = (INDEX - 1) * THICKNESS / 299.792458
+    amplitude = 4 * INDEX / (INDEX + 1) ** 2 * np.exp(-ABSORPTION * THICKNESS * 1e-4 / 2)
+    reference = write_scan(path, 'reference', positions, pulse(delay), offset)
+    sample = write_scan(path, name, positions, amplitude * pulse(delay, 3.0 + shift), offset)
+    return sample, reference
+
+
+def test_optical_constants_of_a_synthetic_slab(tmp_path):
+    sample, reference = write_slab(tmp_path, offset=0.05)
+    recipe = ProcessingRecipe(window='none', thickness=THICKNESS)
+    result = process_scans([sample], [reference], recipe, workers=1)
+    band = (result.frequencies > 0.3) & (result.frequencies < 2.0)
+    assert np.allclose(result.n[0, band], INDEX, atol=1e-3)
+    assert np.allclose(result.alpha[0, band], ABSORPTION, atol=0.1)
+
+
+def test_common_grid_is_the_shared_range_at_the_coarsest_step(tmp_path):
+    a = write_scan(tmp_path, 'a', np.arange(0, 101.0, 1.0), np.zeros(101))
+    b = write_scan(tmp_path, 'b', np.arange(20, 201.0, 2.0), np.zeros(91))
+    grid = common_grid([a, b], ProcessingRecipe())
+    assert grid[0] == 20 and grid[-1] == 100 and grid[1] - grid[0] == 2
+    assert len(common_grid([a, b], ProcessingRecipe(step=5))) == 17
+
+
+def test_resample_and_baseline_are_batched():
+    traces = [(np.array([0.0, 2.0, 1.0]), np.array([1.0, 3.0, 2.0])), (np.array([0.0, 1.0]), np.array([5.0, 5.0]))]
+    stack = resample(traces, np.array([0.0, 0.5, 1.0, 1.5, 2.0]))
+    assert np.allclose(stack[0], [1, 1.5, 2, 2.5, 3])
+    assert np.isnan(stack[1, -1])
+    assert np.allclose(subtract_baseline(stack, 2)[1, :3], 0)
+
+
+def test_cache_skips_unchanged_files(tmp_path, monkeypatch):
+    sample, reference = write_slab(tmp_path)
+    loads = []
+    load_trace = processing.load_trace
+    monkeypatch.setattr(processing, 'load_trace', lambda fname: loads.append(fname) or load_trace(fname))
+    cache = ProcessingCache(str(tmp_path / 'cache'))
+
+    first = process_scans([sample], [reference], ProcessingRecipe(thickness=THICKNESS), cache, workers=1)
+    assert len(loads) == 2 and (cache.hits, cache.misses) == (0, 2)
+    # Only the thickness changes, every spectrum comes from the cache.
+    process_scans([sample], [reference], ProcessingRecipe(thickness=2 * THICKNESS), cache, workers=1)
+    assert len(loads) == 2 and cache.hits == 2
+    # A new window redoes the FFT from the cached traces, nothing is read again.
+    other = process_scans([sample], [reference], ProcessingRecipe(window='blackman'), cache, workers=1)
+    assert len(loads) == 2 and (cache.hits, cache.misses) == (4, 2)
+    assert not np.allclose(np.abs(first.spectra), np.abs(other.spectra))
+
+    write_slab(tmp_path, offset=1.0)
+    process_scans([sample], [reference], ProcessingRecipe(), cache, workers=1)
+    assert len(loads) == 4 and cache.misses == 4
+
+
+def test_process_pool_matches_one_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(processing, 'CHUNK_SIZE', 2)
+    sample, reference = write_slab(tmp_path)
+    samples = [sample] + [write_slab(tmp_path, 'sample%d' % i, offset=i)[0] for i in range(4)]
+    recipe = ProcessingRecipe(thickness=THICKNESS)
+    serial = process_scans(samples, [reference], recipe, workers=1)
+    parallel = process_scans(samples, [reference], recipe, workers=2)
+    assert np.allclose(serial.spectra, parallel.spectra)
+
+    fname = save_result(parallel, str(tmp_path / 'processed.csv'))
+    columns = pd.read_csv(fname).columns
+    assert list(columns[:5]) == ['frequency', 'sample_transmission', 'sample_phase', 'sample_n', 'sample_alpha']
+    assert len(columns) == 1 + 4 * len(samples)
+
+
+def test_batch_processing_does_not_load_qt():
+    # Pool workers import the module again, they should not need a Qt installation.
+    code = 'import sys, process, scan.processing; print("PyQt5" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
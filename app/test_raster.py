@@ -0,0 +1,81 @@
+import numpy as np
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from instruments.thorlabsStage.xystage import XYStageDemo
+from scan.engine import ScanEngine
+from scan.raster import ImageRecipe, WaveformCube, raster_order, run_image
+from scan.recipe import ScanRecipe
+
+
+class PositionLockin(SR830Demo):
+    # Reads back where the delay stage and the sample are, so every value says where it was taken.
+    def __init__(self, stage, xy_stage):
+        super(PositionLockin, self).__init__()
+        self.stage = stage
+        self.xy_stage = xy_stage
+
+    def measureBuffered(self, count):
+        x, y = self.xy_stage.getPosition()
+        return np.full(int(count), self.stage.getPosition() + 1000 * x + 1000000 * y)
+
+
+def make_image(tmp_path, serpentine=True, delay=None):
+    stage = ThorlabsStageControllerDemo('0')
+    xy_stage = XYStageDemo()
+    lia = PositionLockin(stage, xy_stage)
+    lia.setTimeConstant(0)
+    delay = delay or ScanRecipe(start=0, stop=40, stepsize=10)
+    recipe = ImageRecipe(0, 3, 1, 0, 2, 1, delay=delay, serpentine=serpentine)
+    cube = WaveformCube.create(str(tmp_path / 'test_cube.npy'), recipe)
+    return ScanEngine(lia, stage), xy_stage, recipe, cube
+
+
+def test_serpentine_raster_order():
+    order = raster_order(3, 2)
+    assert order.tolist() == [[0, 0], [1, 0], [2, 0], [2, 1], [1, 1], [0, 1]]
+    assert raster_order(3, 2, serpentine=False)[3].tolist() == [0, 1]
+
+
+def test_xy_stage_moves_both_axes():
+    xy_stage = XYStageDemo()
+    xy_stage.move((120, 80))
+    assert xy_stage.getPosition() == (120, 80)
+    assert not xy_stage.isMoving()
+
+
+class TestRunImage:
+    def test_every_pixel_is_stored_in_place(self, tmp_path):
+        engine, xy_stage, recipe, cube = make_image(tmp_path)
+        pixels = []
+        assert run_image(engine, xy_stage, recipe, cube, lambda ix, iy, peak: pixels.append((ix, iy))) == 12
+        assert pixels == [tuple(pixel) for pixel in raster_order(4, 3)]
+
+        # Odd pixels were measured with the delay running backwards, the cube is still in order.
+        delay = np.arange(0, 41, 10)
+        for ix in range(4):
+            for iy in range(3):
+                np.testing.assert_array_equal(cube.data[ix, iy], delay + 1000 * ix + 1000000 * iy)
+        np.testing.assert_array_equal(cube.peak, 40 + 1000 * np.arange(4)[:, None] + 1000000 * np.arange(3))
+
+    def test_reopened_cube_is_memory_mapped(self, tmp_path):
+        engine, xy_stage, recipe, cube = make_image(tmp_path, serpentine=False)
+        run_image(engine, xy_stage, recipe, cube)
+        reopened = WaveformCube.open(cube.path)
+        assert isinstance(reopened.data, np.memmap)
+        assert reopened.data.shape == (4, 3, 5)
+        np.testing.assert_array_equal(reopened.peak, cube.peak)
+        assert reopened.params['pixels'] == 12
+        assert ImageRecipe.from_dict(reopened.params['recipe']) == recipe
+
+    def test_cancel_leaves_the_rest_unmeasured(self, tmp_path):
+        engine, xy_stage, recipe, cube = make_image(tmp_path)
+        assert run_image(engine, xy_stage, recipe, cube,
+                         lambda ix, iy, peak: iy == 1 and engine.cancel_token.cancel()) == 5
+        assert np.isfinite(cube.peak[:, 0]).all()
+        assert np.isfinite(cube.peak).sum() == 5
+
+    def test_fly_pixels_without_serpentine_sweep_the_whole_range(self, tmp_path):
+        delay = ScanRecipe(start=0, stop=40, stepsize=10, mode='fly', velocity=400)
+        engine, xy_stage, recipe, cube = make_image(tmp_path, serpentine=False, delay=delay)
+        assert run_image(engine, xy_stage, recipe, cube) == 12
+        assert np.isfinite(cube.data).all()
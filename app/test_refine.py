@@ -0,0 +1,42 @@
+import numpy as np
+from instruments.simulator.simulator import SR830Simulator, SerialLink, ThorlabsStageSimulator
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.refine import pass_steps, refinement_positions
+
+
+class TestRefinement:
+    def test_pass_steps(self):
+        assert pass_steps(160, 10) == [160, 40, 10]
+        assert pass_steps(100, 10) == [100, 25, 10]
+        assert pass_steps(10, 10) == [10]
+
+    def test_only_the_edge_is_refined(self):
+        positions = np.arange(0, 101, 20.0)
+        values = np.array([0, 0, 0, 1, 1, 1.0])
+        new = refinement_positions(positions, values, 5, 0, 5, 0.5)
+        # Curvature marks the intervals on both sides of the edge.
+        assert new.min() > 20 and new.max() < 80
+        assert not np.isin(new, positions).any()
+        np.testing.assert_array_equal(new % 5, 0)
+
+    def test_flat_trace_needs_nothing(self):
+        assert len(refinement_positions(np.arange(5.0), np.ones(5), 0.5, 0, 0.5, 0.1)) == 0
+
+
+class TestRefineScan:
+    def test_pulse_gets_fine_points_and_baseline_stays_coarse(self):
+        stage = ThorlabsStageSimulator('0', velocity=1e6, acceleration=1e9, moveOverhead=0)
+        lia = SR830Simulator(stage, noise=0, link=SerialLink(latency=0, baudrate=1e9))
+        recipe = ScanRecipe(start=0, stop=3000, stepsize=5, timeConstant=0.0005, nPostmove=4, mode='refine',
+                            coarseStep=80, refineThreshold=0.05)
+        result = ScanEngine(lia, stage).run(recipe)
+        positions = result.buffer.positions
+
+        assert np.all(np.diff(positions) > 0)
+        assert positions[0] == 0 and positions[-1] == 3000
+        assert len(positions) < recipe.length_of_scan() / 3
+        steps = np.diff(positions)
+        near_pulse = (positions[:-1] > 1450) & (positions[:-1] < 1550)
+        assert steps[near_pulse].max() == 5
+        assert steps.max() == 80
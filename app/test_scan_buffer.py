@@ -0,0 +1,55 @@
+import numpy as np
+from scan.buffer import ScanBuffer
+
+
+class TestScanBuffer:
+    def test_append_and_views(self):
+        buffer = ScanBuffer(4)
+        for i, value in enumerate([3.0, -1.0, 5.0]):
+            buffer.append(10 * i, value, float(i))
+
+        assert len(buffer) == 3
+        np.testing.assert_array_equal(buffer.positions, [0, 10, 20])
+        np.testing.assert_array_equal(buffer.values, [3.0, -1.0, 5.0])
+        np.testing.assert_array_equal(buffer.timestamps, [0.0, 1.0, 2.0])
+        assert buffer.data.shape == (3, 3)
+
+    def test_views_do_not_copy(self):
+        buffer = ScanBuffer(10)
+        buffer.append(1, 2)
+        assert np.shares_memory(buffer.positions, buffer.data)
+        assert buffer.values.flags['C_CONTIGUOUS']
+
+    def test_min_max_tracked_incrementally(self):
+        buffer = ScanBuffer(10)
+        for position, value in [(5, 1.0), (2, 4.0), (8, -3.0)]:
+            buffer.append(position, value)
+
+        assert (buffer.position_min, buffer.position_max) == (2, 8)
+        assert (buffer.value_min, buffer.value_max) == (-3.0, 4.0)
+
+    def test_grows_when_full(self):
+        buffer = ScanBuffer(2)
+        for i in range(5):
+            buffer.append(i, i)
+
+        assert buffer.capacity >= 5
+        np.testing.assert_array_equal(buffer.values, np.arange(5))
+
+    def test_reset(self):
+        buffer = ScanBuffer(2)
+        buffer.append(1, 1)
+        buffer.reset(8)
+
+        assert len(buffer) == 0
+        assert buffer.capacity == 8
+        assert buffer.value_min == np.inf
+
+    def test_extra_columns(self):
+        buffer = ScanBuffer(1, extra_columns=('dwellTime', 'sampleCount'))
+        buffer.append(1, 2, 3, 0.5, 10)
+        buffer.append(2, 3, 4, 0.25, 20)
+
+        np.testing.assert_array_equal(buffer.column('sampleCount'), [10, 20])
+        np.testing.assert_array_equal(buffer.column('dwellTime'), [0.5, 0.25])
+        assert buffer.data.shape == (2, 5)
@@ -0,0 +1,163 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import cli
+from instruments.lockinAmplifier.sr830 import SR830Demo, mean_channels
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import CancelToken, ScanEngine
+from scan.recipe import ScanRecipe
+from scan.storage import save_scan
+from tracing import SERIAL_ROUND_TRIPS
+
+
+class TestCancelToken:
+    def test_sleep_wakes_up_on_cancel(self):
+        token = CancelToken()
+        threading.Timer(0.05, token.cancel).start()
+        assert token.sleep(10) is True
+        assert token.is_cancelled()
+
+    def test_reset(self):
+        token = CancelToken()
+        token.cancel()
+        token.reset()
+        assert not token.is_cancelled()
+        assert token.sleep(0) is False
+
+
+class TestScanEngine:
+    def make_engine(self):
+        lia = SR830Demo()
+        lia.setTimeConstant(0)
+        return ScanEngine(lia, ThorlabsStageControllerDemo('0'))
+
+    def test_run_with_demo_instruments(self):
+        engine = self.make_engine()
+        points = []
+        engine.on_point = lambda i, x, y, t: points.append(i)
+        result = engine.run(ScanRecipe(start=0, stop=100, stepsize=5, nAvg=2))
+
+        assert len(result.buffer) == 21
+        assert points == list(range(21))
+        np.testing.assert_array_equal(result.buffer.positions, np.arange(0, 101, 5))
+        assert not result.stopped
+
+    def test_recipe_time_constant_is_applied(self):
+        engine = self.make_engine()
+        result = engine.run(ScanRecipe(start=0, stop=0, stepsize=1, timeConstant=0.001))
+        assert result.timeConstant == 0.001
+
+    def test_cancel_keeps_measured_points(self):
+        engine = self.make_engine()
+        engine.on_point = lambda i, x, y, t: i == 2 and engine.cancel_token.cancel()
+        result = engine.run(ScanRecipe(start=0, stop=100, stepsize=1))
+        assert len(result.buffer) == 3
+        assert result.stopped
+
+
+class TestPipelinedMoves:
+    def timed_scan(self, pipelined):
+        lia = SR830Demo()
+        lia.setTimeConstant(0)
+        stage = ThorlabsStageControllerDemo('0', velocity=1000)
+        engine = ScanEngine(lia, stage)
+        engine.pipelined = pipelined
+        # Stands in for plotting and saving, about as long as one 20 um move.
+        engine.on_point = lambda *point: time.sleep(0.02)
+        start = time.perf_counter()
+        result = engine.run(ScanRecipe(start=0, stop=160, stepsize=20))
+        return time.perf_counter() - start, result, stage
+
+    def test_next_move_overlaps_point_handling(self):
+        sequential, _, _ = self.timed_scan(False)
+        pipelined, result, stage = self.timed_scan(True)
+        assert list(result.buffer.positions) == list(range(0, 161, 20))
+        assert stage.getPosition() == 160
+        assert pipelined < 0.8 * sequential
+
+    def test_demo_start_move_returns_before_arrival(self):
+        stage = ThorlabsStageControllerDemo('0', velocity=1000)
+        stage.startMove(50)
+        assert stage.isMoving()
+        assert stage.waitForMove()
+        assert stage.getPosition() == 50
+
+
+class TestStorage:
+    def test_save_scan_keeps_csv_layout(self, tmp_path):
+        engine = TestScanEngine().make_engine()
+        result = engine.run(ScanRecipe(start=0, stop=10, stepsize=1, fileprefix='sample'))
+        data_fname, params_fname = save_scan(result, str(tmp_path))
+
+        df = pd.read_csv(data_fname)
+        assert list(df.columns) == ['stagePos', 'voltage']
+        assert len(df) == 11
+        assert data_fname.endswith('sample_data.csv')
+        with open(params_fname) as f:
+            assert f.readline().startswith('stageStart, stageStop, stageStepSize')
+
+
+class TestCli:
+    def test_demo_scan_writes_data(self, tmp_path):
+        code = cli.main(['--demo', '--start', '0', '--stop', '20', '--step', '2', '--tc', '0',
+                         '--data-dir', str(tmp_path)])
+        assert code == 0
+        assert len(list(tmp_path.glob('*_data.csv'))) == 1
+
+
+def test_channels_are_saved_as_columns(tmp_path):
+    from instruments.simulator.simulator import SR830Simulator, SerialLink, ThorlabsStageSimulator
+    stage = ThorlabsStageSimulator('0', moveOverhead=0)
+    lia = SR830Simulator(stage, link=SerialLink(latency=0), seed=1)
+    lia.setTimeConstant(0.001)
+    engine = ScanEngine(lia, stage)
+    result = engine.run(ScanRecipe(start=1400, stop=1600, stepsize=50, channels=('X', 'Y', 'R', 'theta')))
+
+    buffer = result.buffer
+    assert buffer.extra_columns == ('X', 'Y', 'theta')
+    assert np.allclose(buffer.values, np.hypot(buffer.column('X'), buffer.column('Y')))
+    records = buffer.records()
+    assert records.dtype.names == ('position', 'value', 'timestamp', 'X', 'Y', 'theta')
+    assert np.allclose(records.position, [1400, 1450, 1500, 1550, 1600])
+
+    data_fname, params_fname = save_scan(result, str(tmp_path))
+    assert list(pd.read_csv(data_fname).columns) == ['stagePos', 'voltage', 'X', 'Y', 'theta']
+    assert 'X Y R theta' in open(params_fname).read()
+
+
+def test_theta_is_averaged_as_an_angle():
+    means = mean_channels(('X', 'theta'), [[1.0, 179.0], [3.0, -179.0]])
+    assert means[0] == 2.0
+    assert abs(abs(means[1]) - 180.0) < 1e-9
+
+
+def test_channel_averaging_is_one_buffer_read_per_point():
+    # Serial round trips per point do not grow with nAvg.
+    counts = []
+    for nAvg in (2, 20):
+        lia = SR830Demo()
+        result = ScanEngine(lia, ThorlabsStageControllerDemo('0')).run(
+            ScanRecipe(start=0, stop=40, stepsize=10, nAvg=nAvg, channels=('X', 'Y', 'R', 'theta')))
+        counts.append(result.counters[SERIAL_ROUND_TRIPS])
+    assert counts[0] == counts[1]
+
+
+class PhaseFlipLockin(SR830Demo):
+    # Buffered X/Y/R/theta samples near 180 degrees. SNAP? is not expected.
+    def measureBufferedChannels(self, channels, count):
+        theta = np.where(np.arange(count) % 2 == 0, 179.0, -179.0)
+        outputs = {'R': np.full(count, 2.0), 'X': np.full(count, -2.0), 'Y': np.zeros(count), 'theta': theta}
+        return np.column_stack([outputs[channel] for channel in channels])
+
+    def measureChannels(self, channels):
+        raise AssertionError('SNAP? after the averaged samples')
+
+
+def test_adaptive_channels_come_from_the_averaged_samples():
+    recipe = ScanRecipe(start=0, stop=10, stepsize=10, nAvg=8, adaptive=True, targetError=1e-3, minAvg=4,
+                        settleTolerance=1.0, channels=('X', 'Y', 'R', 'theta'))
+    result = ScanEngine(PhaseFlipLockin(), ThorlabsStageControllerDemo('0')).run(recipe)
+    assert np.allclose(result.buffer.values, 2.0)
+    assert np.allclose(result.buffer.column('X'), -2.0)
+    assert np.allclose(np.abs(result.buffer.column('theta')), 180.0)
@@ -0,0 +1,54 @@
+import numpy as np
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.fly import grid_fly_samples, fly_velocity
+from scan.recipe import ScanRecipe
+
+
+class TestGridFlySamples:
+    def test_linear_sweep_lands_on_grid(self):
+        # Stage moves 0 -> 100 um in 1 s, signal equals the position.
+        poll_times = np.linspace(0, 1, 11)
+        poll_positions = 100 * poll_times
+        sample_times = np.linspace(0, 1, 1001)
+        values = 100 * sample_times
+        grid = np.arange(0, 101, 10.0)
+
+        gridded, timestamps, counts = grid_fly_samples(sample_times, values, poll_times, poll_positions, grid)
+
+        # End points only get the half bin inside the sweep.
+        np.testing.assert_allclose(gridded[1:-1], grid[1:-1], atol=0.1)
+        np.testing.assert_allclose(gridded[[0, -1]], [2.5, 97.5], atol=0.1)
+        assert counts.sum() == 1001
+
+    def test_lag_shifts_samples_back(self):
+        poll_times = np.array([0.0, 1.0, 2.0])
+        poll_positions = np.array([0.0, 100.0, 100.0])
+        sample_times = np.array([0.6])
+        gridded, _, counts = grid_fly_samples(sample_times, [1.0], poll_times, poll_positions,
+                                              np.array([0.0, 50.0, 100.0]), lag=0.5)
+        assert counts.tolist() == [1, 0, 0]
+
+    def test_empty_grid_points_are_interpolated(self):
+        gridded, _, counts = grid_fly_samples([0.0, 1.0], [0.0, 10.0], [0.0, 1.0], [0.0, 100.0],
+                                              np.arange(0, 101, 25.0))
+        np.testing.assert_allclose(gridded, [0.0, 2.5, 5.0, 7.5, 10.0])
+
+
+class TestFlyScan:
+    def test_default_velocity_from_time_constant(self):
+        recipe = ScanRecipe(start=0, stop=100, stepsize=10, nPostmove=1)
+        assert fly_velocity(recipe, 0.5) == 10
+
+    def test_demo_fly_scan(self):
+        lia = SR830Demo()
+        stage = ThorlabsStageControllerDemo('0')
+        engine = ScanEngine(lia, stage)
+        recipe = ScanRecipe(start=0, stop=100, stepsize=10, timeConstant=0, mode='fly', velocity=1000)
+
+        result = engine.run(recipe)
+
+        np.testing.assert_array_equal(result.buffer.positions, np.arange(0, 101, 10))
+        assert np.all(np.isfinite(result.buffer.values))
+        assert stage.getPosition() == 100
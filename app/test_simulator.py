@@ -0,0 +1,68 @@
+import math
+import time
+import numpy as np
+from instruments.simulator.simulator import (SR830Simulator, SerialLink, ThorlabsStageSimulator, thz_pulse,
+                                             trapezoid_distance, trapezoid_travel_time)
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+
+
+class TestWaveformAndProfile:
+    def test_pulse_is_single_cycle_around_center(self):
+        positions = np.linspace(0, 3000, 3001)
+        field = thz_pulse(positions, center=1500, amplitude=1.0)
+        assert abs(field).max() <= 1.0 + 1e-9
+        assert abs(thz_pulse(1500)) < 1e-12
+        assert field.argmin() > 1500 > field.argmax() or field.argmax() > 1500 > field.argmin()
+        assert abs(field[0]) < 1e-6
+
+    def test_trapezoid(self):
+        # 1 mm at 5 mm/s with 5 mm/s^2 never reaches full speed: triangle of 2*sqrt(d/a).
+        assert trapezoid_travel_time(1000, 5000, 5000) == 2 * math.sqrt(1000 / 5000)
+        assert trapezoid_travel_time(50000, 5000, 5000) == 50000 / 5000 + 1
+        total = trapezoid_travel_time(50000, 5000, 5000)
+        assert trapezoid_distance(50000, 5000, 5000, total / 2) == 25000
+        assert trapezoid_distance(50000, 5000, 5000, total + 1) == 50000
+
+    def test_serial_link_cost(self):
+        link = SerialLink(latency=0.01, baudrate=9600)
+        assert link.cost(7, 12) == 0.01 + 190 / 9600
+
+
+class TestSimulatedInstruments:
+    def test_stage_move_takes_travel_time(self):
+        stage = ThorlabsStageSimulator('0', velocity=1000, acceleration=100000, moveOverhead=0)
+        start = time.monotonic()
+        stage.move(100)
+        assert time.monotonic() - start >= 0.1
+        assert stage.getPosition() == 100
+        assert not stage.isMoving()
+
+    def test_lockin_follows_first_order_filter(self):
+        stage = ThorlabsStageSimulator('0', moveOverhead=0)
+        lia = SR830Simulator(stage, waveform=lambda position: 1.0 if position > 0 else 0.0, noise=0,
+                             link=SerialLink(latency=0))
+        lia.setTimeConstant(0.05)
+        stage.startMoveAt(1, 1e9)
+        lia.lastUpdate = time.monotonic()
+        lia.advance(lia.lastUpdate + 0.05)
+        assert abs(lia.signal - (1 - math.exp(-1))) < 0.02
+        lia.advance(lia.lastUpdate + 0.5)
+        assert abs(lia.signal - 1) < 1e-4
+
+    def test_round_trips_are_counted(self):
+        stage = ThorlabsStageSimulator('0')
+        lia = SR830Simulator(stage, link=SerialLink(latency=0, baudrate=1e9))
+        lia.measure()
+        lia.measureBuffered(8)
+        assert lia.link.roundTrips == 3
+        assert lia.link.bytesTransferred >= 4 * 8
+
+    def test_step_scan_sees_the_pulse(self):
+        stage = ThorlabsStageSimulator('0', velocity=1e6, acceleration=1e9, moveOverhead=0)
+        lia = SR830Simulator(stage, noise=0, seed=1, link=SerialLink(latency=0, baudrate=1e9))
+        result = ScanEngine(lia, stage).run(ScanRecipe(start=1200, stop=1800, stepsize=20, timeConstant=0.001,
+                                                       nPostmove=5))
+        peak = result.buffer.positions[np.argmax(result.buffer.values)]
+        assert 1200 < peak < 1800
+        assert result.buffer.value_max > 0.5e-3
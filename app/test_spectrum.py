@@ -0,0 +1,32 @@
+import numpy as np
+from scan.spectrum import SpectrumCalculator, frequency_axis, fft_length, stage_delay_step, uniform_trace, window_array
+
+
+def test_peak_at_the_signal_frequency():
+    step = 5.0
+    positions = np.arange(600) * step
+    delay = positions * stage_delay_step(1.0)
+    values = np.sin(2 * np.pi * 1.5 * delay)  # 1.5 THz
+    frequencies, amplitude, phase = SpectrumCalculator().compute(positions, values, step)
+    assert abs(frequencies[np.argmax(amplitude)] - 1.5) < 0.05
+    assert amplitude.max() == 0.0
+    assert len(frequencies) == len(amplitude) == len(phase)
+    assert frequencies[-1] <= 10.0
+
+
+def test_fixed_fft_length_reuses_cached_axes():
+    frequency_axis.cache_clear()
+    window_array.cache_clear()
+    calculator = SpectrumCalculator()
+    positions = np.arange(100, dtype=float)
+    n_fft = fft_length(200)
+    for _ in range(3):
+        frequencies, _, _ = calculator.compute(positions, np.random.rand(100), 1.0, n_fft)
+    assert frequency_axis.cache_info().hits == 2
+    assert window_array.cache_info().hits == 2
+
+
+def test_uniform_trace_sorts_and_resamples():
+    values = uniform_trace([0, 4, 2, 1], [0, 4, 2, 1], 1.0)
+    assert np.allclose(values, [0, 1, 2, 3, 4])
+    assert fft_length(100) == 512
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from instruments.lockinAmplifier.sr830 import (SR830, SR830Demo, buffer_sample_rate, sr830_sample_rate_index,
+                                               SR830_SAMPLE_RATES)
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+
+
+class FakeResource:
+    def __init__(self):
+        self.commands = []
+
+    def write(self, command):
+        self.commands.append(command)
+
+    def query(self, command):
+        self.commands.append(command)
+        return '1000'
+
+    def query_binary_values(self, command, data_points, **kwargs):
+        self.commands.append(command)
+        return np.arange(data_points, dtype=np.float32)
+
+
+class TestSR830Buffer:
+    def make_sr830(self):
+        lia = SR830()
+        lia.instrument = object()
+        lia.resource = FakeResource()
+        return lia
+
+    def test_sample_rate_index(self):
+        assert sr830_sample_rate_index(512) == 13
+        assert sr830_sample_rate_index(1) == 4
+        assert sr830_sample_rate_index(10000) == 13
+        assert SR830_SAMPLE_RATES[4] == 1.0
+
+    def test_measure_buffered_single_binary_transfer(self):
+        lia = self.make_sr830()
+        data = lia.measureBuffered(50)
+
+        np.testing.assert_array_equal(data, np.arange(50))
+        commands = lia.resource.commands
+        assert commands[:5] == ['DDEF 1,1,0', 'SRAT 13', 'SEND 0', 'REST', 'STRT']
+        assert commands[-1] == 'TRCB? 1,0,50'
+        assert sum(c.startswith('TRC') for c in commands) == 1
+
+    def test_sample_rate_follows_the_time_constant(self):
+        lia = self.make_sr830()
+        # Two samples per 10 ms time constant is 200 Hz, rounded down to 128 Hz.
+        lia.setSampleRate(buffer_sample_rate(0.01))
+        assert lia.sampleRate == 128.0
+        lia.measureBuffered(5)
+        assert 'SRAT 11' in lia.resource.commands
+
+    def test_channels_from_one_xy_buffer_fill(self):
+        lia = self.make_sr830()
+        samples = lia.measureBufferedChannels(('R', 'X', 'theta'), 4)
+        commands = lia.resource.commands
+        assert commands[:2] == ['DDEF 1,0,0', 'DDEF 2,0,0']
+        assert [c for c in commands if c.startswith('TRCB')] == ['TRCB? 1,0,4', 'TRCB? 2,0,4']
+        assert not any(c.startswith('SNAP') for c in commands)
+        x = np.arange(4)
+        assert np.allclose(samples[:, 0], np.hypot(x, x))
+        assert np.allclose(samples[:, 1], x)
+        assert np.allclose(samples[1:, 2], 45.0)
+
+    def test_measure_buffered_rejects_overflow(self):
+        with pytest.raises(ValueError):
+            self.make_sr830().measureBuffered(20000)
+
+    def test_not_connected(self):
+        with pytest.raises(ConnectionError):
+            SR830().measureBuffered(10)
+
+
+class TestSR830Demo:
+    def test_measure_buffered(self):
+        data = SR830Demo().measureBuffered(25)
+        assert data.shape == (25,)
+        assert np.all((data >= 0) & (data <= 10))
+
+
+def test_snap_reads_channels_in_one_query():
+    lia = SR830()
+    lia.instrument = object()
+    lia.resource = FakeResource()
+    lia.resource.query = lambda command: lia.resource.commands.append(command) or '1.5,-0.5,1.58,-18.4'
+    values = lia.measureChannels(('X', 'Y', 'R', 'theta'))
+    assert lia.resource.commands == ['SNAP? 1,2,3,4']
+    assert list(values) == [1.5, -0.5, 1.58, -18.4]
+
+
+def test_engine_sets_the_buffer_rate_for_the_scan():
+    lia = SR830Demo()
+    rates = []
+    lia.setSampleRate = rates.append
+    engine = ScanEngine(lia, ThorlabsStageControllerDemo('0'))
+    engine.run(ScanRecipe(start=0, stop=20, stepsize=10, timeConstant=0.01))
+    # The fast rate unless the recipe asks for reads a time constant apart.
+    engine.run(ScanRecipe(start=0, stop=20, stepsize=10, timeConstant=0.01, decorrelated=True))
+    assert rates == [None, 200.0]
+
+
+def test_default_rate_is_the_fastest():
+    lia = SR830()
+    lia.setSampleRate(1.0)
+    lia.setSampleRate(None)
+    assert lia.sampleRate == 512.0
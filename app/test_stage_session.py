@@ -0,0 +1,89 @@
+import json
+import time
+from types import SimpleNamespace
+import instruments.thorlabsStage.lts150m as lts150m
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from instruments.thorlabsStage.session import StageSession, wait_until
+
+
+class TestStageSession:
+    def test_skip_homing_only_at_the_stored_position(self, tmp_path):
+        session = StageSession('45283704', str(tmp_path / 'state' / 'stage.json'))
+        assert not session.can_skip_homing(0.0)
+
+        session.mark_homed(None)
+        # Homed, but the position is unknown until a clean disconnect stores it.
+        assert not session.can_skip_homing(0.0)
+        session.record_position(1500.0)
+        assert session.can_skip_homing(1500.4)
+        assert not session.can_skip_homing(0.0)
+
+        session.forget()
+        assert not session.can_skip_homing(1500.0)
+
+    def test_other_stage_or_broken_file_is_ignored(self, tmp_path):
+        path = tmp_path / 'stage.json'
+        StageSession('1', str(path)).mark_homed(10.0)
+        assert StageSession('2', str(path)).load() is None
+        path.write_text('{not json')
+        assert StageSession('1', str(path)).load() is None
+
+    def test_state_file_is_replaced_whole(self, tmp_path):
+        path = tmp_path / 'stage.json'
+        StageSession('1', str(path)).mark_homed(10.0)
+        assert json.loads(path.read_text())['position'] == 10.0
+        assert not (tmp_path / 'stage.json.tmp').exists()
+
+
+def test_wait_until_polls_and_times_out():
+    deadline = time.monotonic() + 0.05
+    assert wait_until(lambda: time.monotonic() > deadline, 1, 0.005)
+    assert not wait_until(lambda: False, 0.02, 0.005)
+
+
+def test_demo_relative_moves():
+    stage = ThorlabsStageControllerDemo('0', velocity=10000)
+    stage.move(100)
+    stage.startMoveBy(20)
+    stage.waitForMove()
+    stage.startMoveBy(-50)
+    stage.waitForMove()
+    assert stage.getPosition() == 70
+
+
+class FakeDecimal(float):
+    @staticmethod
+    def ToDouble(value):
+        return float(value)
+
+
+class FakeKinesisStage:
+    # Records the calls, positions in mm like the .NET device.
+    def __init__(self):
+        self.Position = FakeDecimal(1.0)
+        self.calls = []
+
+    def GetVelocityParams(self):
+        return SimpleNamespace(MaxVelocity=None)
+
+    def SetVelocityParams(self, params):
+        pass
+
+    def MoveRelative(self, direction, distance, timeout):
+        self.calls.append(('MoveRelative', direction, float(distance), timeout))
+        self.Position = FakeDecimal(self.Position + (distance if direction == 'F' else -distance))
+
+    def __getattr__(self, name):
+        # Anything else, jogs included, is a call the controller should not get here.
+        raise AssertionError(name + ' called')
+
+
+def test_relative_move_is_not_a_jog(monkeypatch):
+    monkeypatch.setattr(lts150m, 'Decimal', FakeDecimal)
+    monkeypatch.setattr(lts150m, 'MotorDirection', SimpleNamespace(Forward='F', Backward='B'))
+    stage = lts150m.ThorlabsStageController('45283704')
+    stage.device = FakeKinesisStage()
+    stage.startMoveBy(20)
+    stage.startMoveBy(-50)
+    assert stage.device.calls == [('MoveRelative', 'F', 0.02, 0), ('MoveRelative', 'B', 0.05, 0)]
+    assert stage.target == 970
@@ -0,0 +1,60 @@
+import threading
+import benchmark
+from scan.recipe import ScanRecipe
+from scan.timing import PhaseTimer, estimate_scan_time
+
+
+class TestPhaseTimer:
+    def test_rolling_mean_per_sample(self):
+        timer = PhaseTimer(window=2)
+        timer.record('measure', 1.0, samples=10)
+        timer.record('measure', 0.4, samples=2)
+        timer.record('measure', 0.6, samples=2)
+
+        assert timer.mean('measure') == 0.25
+        assert timer.counts['measure'] == 14
+        assert timer.totals['measure'] == 2.0
+        assert timer.mean('move', 'none') == 'none'
+
+    def test_phase_context_manager(self):
+        timer = PhaseTimer()
+        with timer.phase('save'):
+            pass
+        assert timer.summary()['save']['count'] == 1
+
+    def test_summary_while_another_thread_records(self):
+        timer = PhaseTimer()
+        done = threading.Event()
+
+        def record():
+            for i in range(20000):
+                timer.record('phase%d' % i, 0.001)
+            done.set()
+
+        thread = threading.Thread(target=record)
+        thread.start()
+        while not done.is_set():
+            timer.summary()
+        thread.join()
+        assert len(timer.summary()) == 20000
+
+
+class TestEstimateScanTime:
+    recipe = ScanRecipe(start=0, stop=90, stepsize=10, nAvg=4, nPostmove=1)
+
+    def test_defaults_without_timings(self):
+        assert estimate_scan_time(self.recipe, 0.5) == 10 * (0.2 + 1.0 + 0.2)
+
+    def test_uses_measured_timings(self):
+        timer = PhaseTimer()
+        timer.record('move', 0.05)
+        timer.record('measure', 0.04, samples=4)
+        assert abs(estimate_scan_time(self.recipe, 0.5, timer) - 10 * (0.05 + 1.0 + 0.04)) < 1e-9
+
+
+class TestBenchmark:
+    def test_demo_benchmark_reports_phases(self):
+        report = benchmark.run_benchmark('step', benchmark.STANDARD_RECIPES['step'], 'demo')
+        assert report['points'] == 51
+        assert report['points_per_second'] > 0
+        assert set(report['phases']) == {'move', 'settle', 'measure', 'save'}
@@ -0,0 +1,63 @@
+import json
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.simulator.simulator import SerialLink
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from tracing import SERIAL_ROUND_TRIPS, STAGE_MOVES, TRACER, Tracer
+
+
+class TestTracer:
+    def test_disabled_stores_nothing(self):
+        tracer = Tracer()
+        start = tracer.begin()
+        tracer.end(start, 'OUTP? 3', 12)
+        tracer.message('moving')
+        tracer.count('reads')
+        assert start is None
+        assert len(tracer.spans) == 0
+        assert tracer.counters == {'reads': 1}
+
+    def test_ring_buffer_keeps_the_latest(self):
+        tracer = Tracer(capacity=3)
+        tracer.enable()
+        for i in range(5):
+            tracer.end(tracer.begin(), 'call %d' % i)
+        assert [span[2] for span in tracer.spans] == ['call 2', 'call 3', 'call 4']
+
+    def test_export(self, tmp_path):
+        tracer = Tracer()
+        tracer.enable()
+        link = SerialLink(latency=0.001)
+        start = tracer.begin()
+        link.transfer(7, 12)
+        tracer.end(start, 'OUTP? 3', 19)
+        tracer.message('DEMO stagecontroller is ordered to move to: 10')
+        assert tracer.export(str(tmp_path / 'trace.json')) == 2
+
+        with open(str(tmp_path / 'trace.json')) as f:
+            events = json.load(f)['traceEvents']
+        assert events[0]['name'] == 'OUTP? 3'
+        assert events[0]['ph'] == 'X' and events[0]['dur'] >= 1000
+        assert events[0]['args'] == {'bytes': 19}
+        assert events[1]['ph'] == 'i'
+
+
+def test_scan_counts_round_trips_and_moves():
+    lia = SR830Demo()
+    lia.setTimeConstant(0)
+    result = ScanEngine(lia, ThorlabsStageControllerDemo('0')).run(ScanRecipe(start=0, stop=90, stepsize=10, nAvg=4))
+    # One buffered read per point, a move to the start and one per point.
+    assert result.counters[SERIAL_ROUND_TRIPS] == 10
+    assert result.counters[STAGE_MOVES] == 11
+
+
+def test_simulated_serial_link_is_traced():
+    TRACER.clear()
+    TRACER.enable()
+    try:
+        SerialLink(latency=0).transfer(8, 0, 'OFLT')
+    finally:
+        TRACER.enable(False)
+    assert TRACER.counters[SERIAL_ROUND_TRIPS] == 1
+    assert TRACER.spans[-1][2:4] == ('OFLT', 8)
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pandas as pd
+from instruments.lockinAmplifier.sr830 import SR830Demo
+from instruments.thorlabsStage.lts150m import ThorlabsStageControllerDemo
+from scan.engine import ScanEngine
+from scan.recipe import ScanRecipe
+from scan.writer import StreamingWriter, load_stream, stream_to_csv
+
+
+class TestStreamingWriter:
+    params = {'recipe': ScanRecipe(start=0, stop=4, stepsize=1).to_dict(), 'timeConstant': 0.3,
+              'sensitivity': 0.5}
+
+    def test_round_trip(self, tmp_path):
+        path = str(tmp_path / 'scan_data.lscan')
+        with StreamingWriter(path, ('position', 'value', 'timestamp'), self.params) as writer:
+            for i in range(5):
+                writer.append((i, 10.0 * i, 100.0 + i))
+
+        scan = load_stream(path)
+        assert len(scan) == 5
+        assert scan.header['timeConstant'] == 0.3
+        np.testing.assert_array_equal(scan.column('value'), [0, 10, 20, 30, 40])
+        assert isinstance(scan.data, np.memmap)
+
+    def test_rows_survive_without_close(self, tmp_path):
+        path = str(tmp_path / 'crash_data.lscan')
+        writer = StreamingWriter(path, ('position', 'value', 'timestamp'), self.params, flush_interval=0)
+        writer.append((1, 2, 3))
+        writer.append((4, 5, 6))
+        # Simulate a crash in the middle of the next row.
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 12)
+
+        scan = load_stream(path, mmap=False)
+        np.testing.assert_array_equal(scan.data, [[1, 2, 3], [4, 5, 6]])
+        writer.file.close()
+
+    def test_convert_to_csv(self, tmp_path):
+        path = str(tmp_path / '20240101-00-00-00x_data.lscan')
+        with StreamingWriter(path, ('position', 'value', 'timestamp'), self.params) as writer:
+            writer.append((0, 1, 0))
+            writer.append((1, 2, 0))
+
+        data_fname, params_fname = stream_to_csv(path)
+        assert os.path.basename(data_fname) == '20240101-00-00-00x_data.csv'
+        df = pd.read_csv(data_fname)
+        assert list(df.columns) == ['stagePos', 'voltage']
+        assert df['voltage'].tolist() == [1, 2]
+        with open(params_fname) as f:
+            assert f.readlines()[1].startswith('0, 4, 1, 0.3, 0.5')
+
+
+class TestEngineStreaming:
+    def test_scan_is_streamed(self, tmp_path):
+        lia = SR830Demo()
+        lia.setTimeConstant(0)
+        engine = ScanEngine(lia, ThorlabsStageControllerDemo('0'))
+        engine.stream_directory = str(tmp_path)
+        result = engine.run(ScanRecipe(start=0, stop=50, stepsize=5, fileprefix='s'))
+
+        assert result.streamPath.endswith('s_data.lscan')
+        scan = load_stream(result.streamPath)
+        np.testing.assert_array_equal(scan.data, result.buffer.data)
+        assert scan.header['recipe']['stepsize'] == 5
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+TRACE_CAPACITY = 100000  # spans kept in memory, the oldest are dropped first
+
+# Counter names used by the instruments.
+SERIAL_ROUND_TRIPS = 'serialRoundTrips'
+STAGE_MOVES = 'stageMoves'
+DAQ_BLOCKS = 'daqBlocks'
+SERVER_ROUND_TRIPS = 'serverRoundTrips'
+
+
+class Tracer:
+    # Spans of instrument calls (command, start, duration, bytes) in a ring buffer, exported as
+    # a Chrome trace file (chrome://tracing, ui.perfetto.dev). Off by default: begin() then
+    # returns None and end() returns right away, no clock is read and nothing is stored.
+    # Counters are plain dict increments and always count.
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.enabled = False
+        # Print messages as well, like the instruments used to.
+        self.echo = False
+        self.spans = deque(maxlen=capacity)
+        self.counters = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def begin(self):
+        if not self.enabled:
+            return None
+        return time.perf_counter()
+
+    def end(self, start, name, nbytes=0):
+        if start is None:
+            return
+        self.spans.append((start, time.perf_counter() - start, name, nbytes, threading.get_ident()))
+
+    def message(self, text):
+        # Replaces print() in the hot path. Stored as a zero length span when tracing.
+        if self.echo:
+            print(text)
+        if self.enabled:
+            self.spans.append((time.perf_counter(), 0.0, text, 0, threading.get_ident()))
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        return dict(self.counters)
+
+    def since(self, snapshot):
+        # Counts since snapshot(), e.g. per scan.
+        return {name: value - snapshot.get(name, 0) for name, value in self.counters.items()
+                if value != snapshot.get(name, 0)}
+
+    def clear(self):
+        self.spans.clear()
+        self.counters = {}
+
+    def export(self, path):
+        # Complete ('X') events in microseconds, instant ('i') events for messages.
+        pid = os.getpid()
+        events = []
+        for start, duration, name, nbytes, thread in list(self.spans):
+            event = {'name': name, 'ph': 'X' if duration else 'i', 'ts': start * 1e6, 'pid': pid, 'tid': thread}
+            if duration:
+                event['dur'] = duration * 1e6
+            if nbytes:
+                event['args'] = {'bytes': nbytes}
+            events.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'otherData': {'counters': self.counters}}, f)
+        return len(events)
+
+
+# One per process, shared by the instruments and the scan engine.
+TRACER = Tracer()